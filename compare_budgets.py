@@ -0,0 +1,7 @@
+# -*- coding: utf8 -*-
+
+import sys
+import ynabdebtsync.batch
+
+if __name__ == "__main__":
+    sys.exit(ynabdebtsync.batch.main())
@@ -0,0 +1,49 @@
+# -*- coding: utf8 -*-
+import json
+import os
+import shutil
+import tempfile
+from nose.tools import assert_equal
+from ynabdebtsync import batch
+
+this_budget_file_path = os.path.join(os.path.dirname(__file__), "this_budget.json")
+other_budget_file_path = os.path.join(os.path.dirname(__file__), "other_budget.json")
+
+def test_compare_budget_files_returns_a_result_per_comparison():
+    comparisons = [
+        {"this_budget": this_budget_file_path, "this_category": "Test Debt Category",
+         "other_budget": other_budget_file_path, "other_category": "Test Debt Category"},
+        {"this_budget": this_budget_file_path, "this_category": "Test Debt Category",
+         "other_budget": other_budget_file_path, "other_category": "Test Debt Category",
+         "start_date": "2016"}
+    ]
+
+    results = batch.compare_budget_files(comparisons, processes=2)
+
+    assert_equal(len(results), 2)
+    assert_equal([txn["entityId"] for txn in results[0]["this_missing"]],
+                 ["AD5F14BC-5BCC-E075-4B14-208676CA762F"])
+    assert_equal(results[0]["other_missing"], [])
+    assert_equal(results[1]["start_date"], "2016")
+    assert_equal((results[1]["this_missing"], results[1]["other_missing"]), ([], []))
+
+def test_compare_budget_files_without_comparisons_returns_no_results():
+    assert_equal(batch.compare_budget_files([]), [])
+
+def test_main_writes_results_to_output_file():
+    directory = tempfile.mkdtemp()
+    try:
+        job_file_path = os.path.join(directory, "job.json")
+        output_file_path = os.path.join(directory, "results.json")
+        with open(job_file_path, "w") as job_file:
+            json.dump({"comparisons": [
+                {"this_budget": this_budget_file_path, "this_category": "Test Debt Category",
+                 "other_budget": other_budget_file_path, "other_category": "Test Debt Category"}
+            ]}, job_file)
+
+        assert_equal(batch.main([job_file_path, "--output", output_file_path]), 0)
+
+        with open(output_file_path) as output_file:
+            assert_equal(len(json.load(output_file)["results"]), 1)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import time
+
+from nose.tools import assert_equal, assert_true, with_setup
+from ynabdebtsync.budgetcache import BudgetCache
+
+cache_directory = None
+
+def create_cache_directory():
+    global cache_directory
+    cache_directory = tempfile.mkdtemp()
+
+def remove_cache_directory():
+    shutil.rmtree(cache_directory)
+
+@with_setup(create_cache_directory, remove_cache_directory)
+def test_get_returns_none_for_missing_key():
+    cache = BudgetCache(cache_directory, 1024)
+
+    assert_true(cache.get(("file", "id:budget", "rev1")) is None)
+
+@with_setup(create_cache_directory, remove_cache_directory)
+def test_get_returns_put_value_of_same_revision_only():
+    cache = BudgetCache(cache_directory, 1024)
+    cache.put(("file", "id:budget", "rev1"), u'{"payees": []}')
+
+    assert_equal(cache.get(("file", "id:budget", "rev1")), u'{"payees": []}')
+    assert_true(cache.get(("file", "id:budget", "rev2")) is None)
+
+@with_setup(create_cache_directory, remove_cache_directory)
+def test_put_evicts_least_recently_used_values():
+    cache = BudgetCache(cache_directory, 500)
+    cache.put(("file", "first"), "a" * 200)
+    cache.put(("file", "second"), "b" * 200)
+    # Make first the most recently used.
+    past = time.time() - 60
+    os.utime(cache.path(("file", "second")), (past, past))
+    cache.get(("file", "first"))
+
+    cache.put(("file", "third"), "c" * 200)
+
+    assert_equal(cache.get(("file", "first")), "a" * 200)
+    assert_true(cache.get(("file", "second")) is None)
+    assert_equal(cache.get(("file", "third")), "c" * 200)
+
+@with_setup(create_cache_directory, remove_cache_directory)
+def test_put_skips_values_larger_than_cache():
+    cache = BudgetCache(cache_directory, 100)
+    cache.put(("file", "id:budget", "rev1"), "a" * 200)
+
+    assert_true(cache.get(("file", "id:budget", "rev1")) is None)
+    assert_equal([name for name in os.listdir(cache_directory) if name.endswith(".tmp")], [])
+
+@with_setup(create_cache_directory, remove_cache_directory)
+def test_get_treats_corrupt_values_as_missing_and_removes_them():
+    cache = BudgetCache(cache_directory, 1024)
+    # Truncated, unknown opcode, missing class and missing module pickles.
+    for index, contents in enumerate(["\x80\x02]q", "not a pickle",
+                                      "cynabdebtsync.budgetcache\nNoSuchClass\n.",
+                                      "cno_such_module\nNoSuchClass\n."]):
+        key = ("file", "id:budget", "rev{0}".format(index))
+        with open(cache.path(key), "wb") as cache_file:
+            cache_file.write(contents)
+
+        assert_true(cache.get(key) is None)
+        assert_true(not os.path.exists(cache.path(key)))
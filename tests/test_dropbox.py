@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 
+import threading
 import unittest
 
 from ynabdebtsync import dropbox
-from nose.tools import assert_equal
+from nose.tools import assert_equal, assert_raises, assert_true
 
 # Assumes one budget named dineros.
 # Generate a token at https://www.dropbox.com/developers
@@ -125,3 +126,385 @@ def test_dropbox_comparison():
     data = json.loads(response.data)
     assert_equal(len(data["this_missing"]), 0)
     assert_equal(len(data["other_missing"]), 240)
+
+def test_get_budget_files_fetches_concurrently_in_order():
+    # Each fetch signals it started, then waits for the other one to start,
+    # which only happens if they run at the same time.
+    started = {"this/path": threading.Event(), "other/path": threading.Event()}
+    overlapped = []
+
+    class ConcurrentDropbox(dropbox.Dropbox):
+        def get_budget_file(self, budget_directory_path):
+            started[budget_directory_path].set()
+            other_path = [path for path in started if path != budget_directory_path][0]
+            overlapped.append(started[other_path].wait(5))
+            return budget_directory_path + " budget"
+
+    db = ConcurrentDropbox(token)
+    budget_jsons = db.get_budget_files(["this/path", "other/path"])
+
+    assert_equal(budget_jsons, ["this/path budget", "other/path budget"])
+    assert_equal(overlapped, [True, True])
+
+def test_get_budget_files_caps_concurrent_fetches():
+    lock = threading.Lock()
+    running = [0, 0]
+
+    class CountingDropbox(dropbox.Dropbox):
+        max_concurrent_fetches = 2
+
+        def get_budget_file(self, budget_directory_path):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            threading.Event().wait(0.01)
+            with lock:
+                running[0] -= 1
+            return budget_directory_path
+
+    db = CountingDropbox(token)
+
+    assert_equal(db.get_budget_files([str(n) for n in range(6)]), [str(n) for n in range(6)])
+    assert_true(running[1] <= 2)
+    assert_equal(db.get_budget_files([]), [])
+
+def test_get_budget_parses_budget_as_it_downloads():
+    budget_bytes = u'{"payees": [{"name": "Café"}], "accounts": [1, 2]}'.encode('utf-8')
+
+    class FakeResponse(object):
+        status_code = 200
+
+        def iter_content(self, chunk_size):
+            # Split the bytes of the 'é' across two chunks.
+            return [budget_bytes[:26], budget_bytes[26:]]
+
+        def close(self):
+            pass
+
+    class FakeDropbox(dropbox.Dropbox):
+        def newest_budget_file(self, budget_directory_path):
+            return {'id': 'id:budget', 'rev': 'rev1', 'size': len(budget_bytes)}
+
+        def _download(self, budget_file, stream=False):
+            assert stream
+            return FakeResponse()
+
+    db = FakeDropbox(token)
+    budget = db.get_budget("budget/path", sections=["payees"])
+
+    assert_equal(budget, {"payees": [{"name": u"Café"}]})
+
+def test_get_budget_serves_unchanged_budget_from_cache():
+    import shutil
+    import tempfile
+    from ynabdebtsync.budgetcache import BudgetCache
+
+    downloads = []
+
+    class FakeResponse(object):
+        status_code = 200
+
+        def iter_content(self, chunk_size):
+            return [b'{"payees": [], "accounts": []}']
+
+        def close(self):
+            pass
+
+    class FakeDropbox(dropbox.Dropbox):
+        rev = "rev1"
+
+        def newest_budget_file(self, budget_directory_path):
+            return {'id': 'id:budget', 'rev': self.rev, 'size': 30}
+
+        def _download(self, budget_file, stream=False):
+            downloads.append(budget_file['rev'])
+            return FakeResponse()
+
+    cache_directory = tempfile.mkdtemp()
+    try:
+        db = FakeDropbox(token, BudgetCache(cache_directory, 1024 * 1024))
+        db.get_budget("budget/path", sections=["payees"])
+        budget = db.get_budget("budget/path", sections=["payees"])
+        db.rev = "rev2"
+        db.get_budget("budget/path", sections=["payees"])
+    finally:
+        shutil.rmtree(cache_directory)
+
+    assert_equal(budget, {"payees": []})
+    assert_equal(downloads, ["rev1", "rev2"])
+
+class FakeListingDropbox(object):
+    """Stands in for Dropbox in BudgetDirectoryView tests, returning the
+    given listing and, for each cursor, its changes or None for a reset."""
+    def __init__(self, listing, changes):
+        self.listing = listing
+        self.changes = changes
+        self.listings = 0
+
+    def list_budget_directory(self, budget_directory_path):
+        self.listings += 1
+        return list(self.listing), "cursor0"
+
+    def list_budget_directory_changes(self, cursor):
+        return self.changes[cursor]
+
+def entry(tag, path):
+    return {'.tag': tag, 'path_lower': path, 'name': path.split('/')[-1]}
+
+def test_budget_directory_view_applies_changes_since_cursor():
+    listing = [entry('folder', '/b/data/device'),
+               entry('file', '/b/data/device/budget.yfull'),
+               entry('file', '/b/data/device/1.ydiff')]
+    changes = {"cursor0": ([entry('deleted', '/b/data/device'),
+                            entry('file', '/b/data/other/budget.yfull')], "cursor1")}
+    db = FakeListingDropbox(listing, changes)
+    view = dropbox.BudgetDirectoryView('/b')
+
+    first_entries = view.refresh(db)
+    second_entries = view.refresh(db)
+
+    assert_equal(len(first_entries), 3)
+    assert_equal([e['path_lower'] for e in second_entries], ['/b/data/other/budget.yfull'])
+    assert_equal(view.cursor, "cursor1")
+    assert_equal(db.listings, 1)
+
+def test_budget_directory_view_lists_again_after_cursor_reset():
+    listing = [entry('file', '/b/data/device/budget.yfull')]
+    db = FakeListingDropbox(listing, {"cursor0": None})
+    view = dropbox.BudgetDirectoryView('/b')
+
+    view.refresh(db)
+    entries = view.refresh(db)
+
+    assert_equal(len(entries), 1)
+    assert_equal(db.listings, 2)
+
+class FakeBudgetDropbox(dropbox.Dropbox):
+    """Serves a budget's small JSON files, directory listings and metadata
+    from dictionaries keyed by path, as if they were in Dropbox."""
+    def __init__(self, files, folders, metadata, directory_views=None):
+        dropbox.Dropbox.__init__(self, token, directory_views=directory_views)
+        self.files = files
+        self.folders = folders
+        self.metadata = metadata
+        self.listed = []
+        self.changes = {}
+
+    def _download_json(self, path):
+        return self.files.get(path)
+
+    def list_budget_directory(self, budget_directory_path, recursive=True):
+        self.listed.append((budget_directory_path, recursive))
+        if budget_directory_path not in self.folders:
+            raise dropbox.DropboxNotFoundError("Not found")
+        return self.folders[budget_directory_path], "cursor"
+
+    def list_budget_directory_changes(self, cursor):
+        return self.changes[cursor]
+
+    def get_latest_cursor(self, budget_directory_path):
+        return "latest"
+
+    def _get_metadata(self, path):
+        return self.metadata.get(path)
+
+def resolvable_budget_dropbox(directory_views=None):
+    files = {
+        '/b/Budget.ymeta': {'relativeDataFolderName': 'data1~1'},
+        '/b/data1~1/devices/a.ydevice': {'deviceGUID': 'GUID-A', 'shortDeviceId': 'A',
+                                         'hasFullKnowledge': True, 'knowledgeInFullBudgetFile': 'A-5,B-3'},
+        '/b/data1~1/devices/b.ydevice': {'deviceGUID': 'GUID-B', 'shortDeviceId': 'B',
+                                         'hasFullKnowledge': True, 'knowledgeInFullBudgetFile': 'A-5,B-9'}
+    }
+    folders = {'/b/data1~1/devices': [entry('file', '/b/data1~1/devices/a.ydevice'),
+                                      entry('file', '/b/data1~1/devices/b.ydevice')]}
+    budget_file = dict(entry('file', '/b/data1~1/guid-b/budget.yfull'), id='id:b',
+                       client_modified='2016-01-10T00:00:00Z')
+    return FakeBudgetDropbox(files, folders, {'/b/data1~1/GUID-B/Budget.yfull': budget_file},
+                             directory_views)
+
+def test_resolve_budget_file_uses_device_with_most_knowledge():
+    db = resolvable_budget_dropbox()
+
+    assert_equal(db.newest_budget_file('/b')['id'], 'id:b')
+    assert_equal(db.listed, [('/b/data1~1/devices', False)])
+
+def test_newest_budget_file_seeds_directory_view_from_resolved_file():
+    db = resolvable_budget_dropbox({})
+    newer = dict(entry('file', '/b/data1~1/guid-a/budget.yfull'), id='id:a',
+                 client_modified='2016-01-11T00:00:00Z')
+    db.changes = {"latest": ([newer], "cursor1")}
+
+    assert_equal(db.newest_budget_file('/b')['id'], 'id:b')
+    # The second call only fetches the changes since the resolved file.
+    assert_equal(db.newest_budget_file('/b'), newer)
+    assert_equal(db.listed, [('/b/data1~1/devices', False)])
+    assert_equal(db.directory_views['/b'].cursor, "cursor1")
+
+def test_resolve_budget_file_raises_errors_other_than_not_found():
+    db = resolvable_budget_dropbox()
+
+    def revoked_listing(budget_directory_path, recursive=True):
+        raise dropbox.DropboxAuthError("Token revoked")
+    db.list_budget_directory = revoked_listing
+
+    with assert_raises(dropbox.DropboxAuthError):
+        db.newest_budget_file('/b')
+
+def test_newest_budget_file_falls_back_to_listing_without_budget_meta():
+    older = dict(entry('file', '/b/data1~1/guid-a/budget.yfull'), client_modified='2016-01-09T23:59:59Z')
+    newer = dict(entry('file', '/b/data1~1/guid-b/budget.yfull'), client_modified='2016-01-10T00:00:00Z')
+    db = FakeBudgetDropbox({}, {'/b': [older, entry('file', '/b/data1~1/guid-a/1.ydiff'), newer]}, {})
+
+    assert_equal(db.newest_budget_file('/b'), newer)
+    assert_equal(db.listed, [('/b', True)])
+
+class FakeSession(object):
+    """Stands in for a requests session, answering each post with the next
+    of the given JSON responses."""
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.urls = []
+
+    def post(self, url, data=None, headers=None, stream=False):
+        self.urls.append(url)
+        return FakeJsonResponse(self.responses.pop(0))
+
+class FakeJsonResponse(object):
+    def __init__(self, body, status_code=200):
+        self.body = body
+        self.status_code = status_code
+        self.text = str(body)
+
+    def json(self):
+        return self.body
+
+def test_get_shared_budget_folders_pages_through_root():
+    db = dropbox.Dropbox(token)
+    db.session = FakeSession([
+        {'entries': [entry('folder', '/ynab (2)'), entry('folder', '/photos')],
+         'has_more': True, 'cursor': 'cursor0'},
+        {'entries': [entry('folder', '/ynab (1)')], 'has_more': False, 'cursor': 'cursor1'}
+    ])
+
+    assert_equal(db.get_shared_budget_folders(), ['/ynab (1)', '/ynab (2)'])
+    assert_equal(db.session.urls[1], dropbox.Dropbox.dropbox_endpoints['list_folder_continue'])
+
+class FakeWatchedDropbox(dropbox.Dropbox):
+    """Dropbox whose budget directory reports a change on the first wait and
+    none after that, recording the budgets it is asked for."""
+    def __init__(self, token, cache=None, directory_views=None):
+        dropbox.Dropbox.__init__(self, token, cache,
+                                 {} if directory_views is None else directory_views)
+        self.waits = 0
+        self.fetched = []
+        self.fetched_event = None
+
+    def list_budget_directory(self, budget_directory_path, recursive=True):
+        return [entry('file', budget_directory_path + '/data/device/budget.yfull')], "cursor0"
+
+    def list_budget_directory_changes(self, cursor):
+        return [entry('file', '/b/data/device/1.ydiff')], "cursor1"
+
+    def wait_for_changes(self, cursor, timeout=30):
+        self.waits += 1
+        if self.waits > 1:
+            threading.Event().wait(0.01)
+        return self.waits == 1, None
+
+    def get_budget(self, budget_directory_path, sections=None, parse_float=None):
+        self.fetched.append(budget_directory_path)
+        if self.fetched_event is not None:
+            self.fetched_event.set()
+
+def test_budget_directory_watcher_refreshes_view_on_change():
+    db = FakeWatchedDropbox(token)
+    changed = threading.Event()
+    watcher = dropbox.BudgetDirectoryWatcher(db, '/b', lambda path: changed.set())
+
+    watcher.start()
+    assert_true(changed.wait(5))
+    watcher.stop()
+    watcher.join(5)
+
+    assert_equal(db.directory_views['/b'].cursor, "cursor1")
+    assert_true(not watcher.is_alive())
+
+def test_budget_directory_watcher_stops_after_repeated_auth_failures():
+    class RevokedDropbox(FakeWatchedDropbox):
+        attempts = 0
+
+        def list_budget_directory(self, budget_directory_path, recursive=True):
+            self.attempts += 1
+            raise dropbox.DropboxAuthError("Token revoked")
+
+    db = RevokedDropbox(token)
+    watcher = dropbox.BudgetDirectoryWatcher(db, '/b', retry_delay=0, max_auth_failures=3)
+
+    watcher.start()
+    watcher.join(5)
+
+    assert_true(not watcher.is_alive())
+    assert_equal(db.attempts, 3)
+
+def test_budget_directory_watcher_stops_when_idle():
+    db = FakeWatchedDropbox(token)
+    watcher = dropbox.BudgetDirectoryWatcher(db, '/b', idle_timeout=-1)
+
+    watcher.start()
+    watcher.join(5)
+
+    assert_true(not watcher.is_alive())
+    assert_equal(db.waits, 0)
+
+def test_watch_budget_prefetches_changed_budget_once_per_budget():
+    import shutil
+    import tempfile
+    from ynabdebtsync import api
+
+    fetched = threading.Event()
+    clients = []
+
+    def fake_dropbox(token, cache=None, directory_views=None):
+        client = FakeWatchedDropbox(token, cache, directory_views)
+        client.fetched_event = fetched
+        clients.append(client)
+        return client
+
+    cache_directory = tempfile.mkdtemp()
+    original_dropbox = api.Dropbox
+    original_config = dict(api.flask_app.config)
+    api.Dropbox = fake_dropbox
+    api.flask_app.config.update(WATCH_BUDGETS=True, BUDGET_CACHE_DIR=cache_directory,
+                                PARSER_PROCESSES=0)
+    try:
+        api.watch_budget('watch token', '/b')
+        api.watch_budget('watch token', '/b')
+        assert_true(fetched.wait(5))
+    finally:
+        for watcher in list(api._budget_watchers.values()):
+            watcher.stop()
+            watcher.join(5)
+        api._budget_watchers.clear()
+        api._directory_views.clear()
+        api.Dropbox = original_dropbox
+        api.flask_app.config.clear()
+        api.flask_app.config.update(original_config)
+        shutil.rmtree(cache_directory)
+
+    assert_equal(len(clients), 1)
+    assert_equal(clients[0].fetched, ['/b'])
+
+def test_download_json_returns_none_only_when_not_found():
+    db = dropbox.Dropbox(token)
+    db.session = FakeSession([])
+    db.session.post = lambda url, data=None, headers=None, stream=False: FakeJsonResponse(
+        {'error_summary': 'path/not_found/..'}, status_code=409)
+
+    assert_true(db._download_json('/b/Budget.ymeta') is None)
+
+    db.session.post = lambda url, data=None, headers=None, stream=False: FakeJsonResponse(
+        {'error_summary': 'invalid_access_token/..'}, status_code=401)
+
+    with assert_raises(dropbox.DropboxAuthError):
+        db._download_json('/b/Budget.ymeta')
@@ -0,0 +1,40 @@
+# -*- coding: utf8 -*-
+import shutil
+import tempfile
+from nose.tools import assert_equal, assert_true
+from ynabdebtsync import reconciliation
+
+def test_version_watermark_returns_highest_knowledge_number_per_device():
+    transactions = [{u'entityVersion': u'A-64'}, {u'entityVersion': u'A-7'},
+                    {u'entityVersion': u'B-3'}, {u'amount': 5}]
+
+    assert_equal(reconciliation.version_watermark(transactions), {u'A': 64, u'B': 3})
+
+def test_unchanged_pairs_leaves_out_changed_and_removed_transactions():
+    state = reconciliation.ReconciliationState([(u'T1', u'O1'), (u'T2', u'O2'), (u'T3', u'O3')],
+                                {u'A': 10}, {u'B': 20})
+    this_transactions = [{u'entityId': u'T1', u'entityVersion': u'A-5'},
+                         {u'entityId': u'T2', u'entityVersion': u'A-11'},
+                         {u'entityId': u'T3', u'entityVersion': u'A-10'}]
+    other_transactions = [{u'entityId': u'O1', u'entityVersion': u'B-20'},
+                          {u'entityId': u'O2', u'entityVersion': u'B-1'}]
+
+    unchanged_pairs = state.unchanged_pairs(this_transactions, other_transactions)
+
+    assert_equal([(this_txn[u'entityId'], other_txn[u'entityId']) for this_txn, other_txn in unchanged_pairs],
+                 [(u'T1', u'O1')])
+
+def test_state_store_saves_and_loads_state():
+    directory = tempfile.mkdtemp()
+    try:
+        store = reconciliation.ReconciliationStateStore(directory)
+        key = ("/ynab/joe.ynab4", "Debt", "/ynab (1)/jane.ynab4", "Debt")
+        state = reconciliation.ReconciliationState([(u'T1', u'O1')], {u'A': 10}, {u'B': 20})
+
+        store.save(key, state)
+        loaded = store.load(key)
+
+        assert_equal(loaded.to_json(), state.to_json())
+        assert_true(store.load(("other", "key")) is None)
+    finally:
+        shutil.rmtree(directory)
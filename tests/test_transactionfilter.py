@@ -0,0 +1,75 @@
+# -*- coding: utf8 -*-
+from nose.tools import assert_raises, assert_equal, assert_true
+from ynabdebtsync import transactionfilter
+
+transaction = {
+    u'cleared': u'Cleared',
+    u'memo': u'Loan for nachos',
+    u'amount': -10.5,
+    u'date': u'2015-04-28',
+    u'payeeId': u'45C13591-718B-3025-0F3C-2086F37E7676',
+    u'accountId': u'37ADA60C-BE54-074E-F1B2-1FC8F2BE93CF'
+}
+
+def test_empty_filter_has_no_predicate():
+    assert_equal(transactionfilter.TransactionFilter().predicate(), None)
+
+def test_predicate_checks_every_criterion():
+    transaction_filter = transactionfilter.TransactionFilter(
+        min_amount=-10.5, max_amount=-1, sign=transactionfilter.OUTFLOW,
+        payee_ids=[transaction["payeeId"]], account_ids=[transaction["accountId"]],
+        cleared=["Cleared", "Reconciled"], memo_contains="NACHOS")
+
+    predicate = transaction_filter.predicate()
+
+    assert_true(predicate(transaction))
+    assert_true(not predicate(dict(transaction, amount=-10.51)))
+    assert_true(not predicate(dict(transaction, cleared=u'Uncleared')))
+    assert_true(not predicate(dict(transaction, memo=u'Loan for beer')))
+
+def test_from_json_unknown_field_raises_exception():
+    with assert_raises(ValueError) as e:
+        transactionfilter.TransactionFilter.from_json({"amount": 5})
+
+    assert_equal(str(e.exception), "Unknown filter fields: amount")
+
+def test_invalid_sign_raises_exception():
+    with assert_raises(ValueError):
+        transactionfilter.TransactionFilter.from_json({"sign": "sideways"})
+
+def test_from_json_values_of_wrong_type_raise_exception():
+    for filter_json in [{"min_amount": "abc"}, {"max_amount": True},
+                        {"payee_ids": 5}, {"account_ids": [u'A', 7]},
+                        {"cleared": {"Cleared": 1}}, {"memo_contains": 3},
+                        {"start_date": "28/04/2015"}, {"end_date": 2015}]:
+        with assert_raises(ValueError):
+            transactionfilter.TransactionFilter.from_json(filter_json)
+
+def test_from_json_valid_values_round_trip():
+    filter_json = {"start_date": "2015-04", "end_date": "2015-04-28",
+                   "min_amount": -10.5, "max_amount": 0, "cleared": ["Cleared"],
+                   "memo_contains": "loan"}
+
+    transaction_filter = transactionfilter.TransactionFilter.from_json(filter_json)
+
+    assert_equal(transaction_filter.to_json(), filter_json)
+
+def test_inverted_filter_mirrors_amount_criteria():
+    transaction_filter = transactionfilter.TransactionFilter(
+        min_amount=-20, max_amount=-5, sign=transactionfilter.OUTFLOW, start_date="2015-04",
+        deleted=transactionfilter.INCLUDE_DELETED)
+
+    inverted_filter = transaction_filter.inverted()
+
+    assert_equal(inverted_filter.to_json(),
+                 {"min_amount": 5, "max_amount": 20, "sign": transactionfilter.INFLOW,
+                  "start_date": "2015-04", "deleted": transactionfilter.INCLUDE_DELETED})
+
+def test_inverted_filter_drops_budget_specific_criteria():
+    transaction_filter = transactionfilter.TransactionFilter(
+        payee_ids=["p"], account_ids=["a"], cleared=["Cleared"], memo_contains="rent",
+        sign=transactionfilter.OUTFLOW)
+
+    inverted_filter = transaction_filter.inverted()
+
+    assert_equal(inverted_filter.to_json(), {"sign": transactionfilter.INFLOW})
@@ -0,0 +1,150 @@
+# -*- coding: utf8 -*-
+import json
+import os
+import pickle
+import sys
+import unittest
+import uuid
+from decimal import Decimal
+from nose.tools import assert_raises, assert_equal, assert_true
+from ynabdebtsync import transactionstore
+
+budget_file_path = os.path.join(os.path.dirname(__file__), "budget.json")
+
+with open (budget_file_path) as budget_file:
+    budget_transactions = json.loads(budget_file.read())["transactions"]
+
+transaction = {
+    u'cleared': u'Cleared',
+    u'entityVersion': u'A-118',
+    u'entityType': u'transaction',
+    u'memo': u'Loan for nachos',
+    u'amount': 10.25,
+    u'date': u'2015-04-28',
+    u'entityId': u'AD5F14BC-5BCC-E075-4B14-208676CA762F',
+    u'accepted': True,
+    u'payeeId': u'45C13591-718B-3025-0F3C-2086F37E7676',
+    u'categoryId': u'DEF375CA-58D2-D332-4C79-20862B7566F8',
+    u'accountId': u'37ADA60C-BE54-074E-F1B2-1FC8F2BE93CF'
+}
+
+def deep_size(value, seen=None):
+    """Return the memory taken by value and everything it references, each
+    object counted once."""
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_size(key, seen) + deep_size(item, seen)
+                    for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in value)
+    elif hasattr(value, "__dict__"):
+        size += deep_size(value.__dict__, seen)
+    return size
+
+def test_row_has_same_fields_as_transaction():
+    store = transactionstore.CompactTransactionStore([transaction])
+
+    assert_equal(dict(store.row(0)), transaction)
+
+def test_row_keeps_fields_that_do_not_fit_a_column():
+    unusual_transaction = dict(transaction)
+    unusual_transaction.update({
+        u'entityId': u'Payee/Transfer:37ADA60C-BE54-074E-F1B2-1FC8F2BE93CF',
+        u'entityVersion': u'unversioned',
+        u'amount': 0.0001,
+        u'date': u'2015-04',
+        u'memo': None,
+        u'isTombstone': False,
+        u'checkNumber': u'42'
+    })
+
+    store = transactionstore.CompactTransactionStore([unusual_transaction])
+
+    assert_equal(dict(store.row(0)), unusual_transaction)
+
+def test_to_milliunits_converts_decimal_amounts_exactly():
+    assert_equal(transactionstore.to_milliunits(Decimal("1234567890123.456")), 1234567890123456)
+    assert_equal(transactionstore.to_milliunits(Decimal("-0.0005")), -1)
+    assert_equal(transactionstore.from_milliunits(-12340, fixed_point=True), Decimal("-12.34"))
+
+def test_fixed_point_store_returns_decimal_amounts_and_milliunits():
+    fixed_point_transaction = dict(transaction, amount=Decimal("10.25"))
+    store = transactionstore.CompactTransactionStore([fixed_point_transaction], fixed_point=True)
+
+    row = store.row(0)
+
+    assert_equal(dict(row), fixed_point_transaction)
+    assert_true(isinstance(row["amount"], Decimal))
+    assert_equal(row.milliunits, 10250)
+    assert_equal(transactionstore.amount_milliunits(row), 10250)
+    assert_equal(store._extra_fields, {})
+
+def test_store_is_much_smaller_than_transaction_dictionaries():
+    transactions = json.loads(json.dumps([
+        dict(transaction, entityId=unicode(uuid.UUID(int=number)).upper(),
+             entityVersion=u'A-{0}'.format(number), amount=number / 4.0)
+        for number in range(1000)]))
+
+    store = transactionstore.CompactTransactionStore(transactions)
+
+    # Every field fits a column, entity IDs being packed as 16 byte GUIDs.
+    assert_equal(store._extra_fields, {})
+    assert_equal(dict(store.row(999)), transactions[999])
+    assert_true(deep_size(store) * 5 < deep_size(transactions))
+
+def test_row_missing_field_raises_exception():
+    store = transactionstore.CompactTransactionStore([transaction])
+
+    with assert_raises(KeyError):
+        store.row(0)["isTombstone"]
+
+def test_subtransactions_are_rows_with_parent_fields():
+    store = transactionstore.CompactTransactionStore(budget_transactions)
+
+    subtransaction = store.row(len(store) - 1)
+    assert_equal(subtransaction["entityType"], "subTransaction")
+    assert_equal(subtransaction["date"], "2015-04-28")
+    assert_equal(subtransaction["memo"], "Split")
+    assert_equal(subtransaction["payeeId"], "D8EB026F-8762-54EB-019C-208AC519C084")
+
+def test_index_by_category_excludes_deleted_transactions():
+    deleted_transaction = dict(transaction, isTombstone=True)
+
+    store = transactionstore.CompactTransactionStore([transaction, deleted_transaction])
+    index = store.index_by_category()
+
+    assert_equal(len(index[transaction["categoryId"]]), 1)
+    assert_true(store.is_tombstone(1))
+
+def test_pickled_store_returns_same_rows():
+    store = transactionstore.CompactTransactionStore(budget_transactions)
+
+    unpickled_store = pickle.loads(pickle.dumps(store, pickle.HIGHEST_PROTOCOL))
+
+    assert_equal([dict(unpickled_store.row(row_number)) for row_number in range(len(store))],
+                 [dict(store.row(row_number)) for row_number in range(len(store))])
+
+def test_totals_sums_non_deleted_rows_by_category_month_and_payee():
+    transactions = [
+        dict(transaction, amount=0.1),
+        dict(transaction, amount=0.2, date=u'2015-05-01'),
+        dict(transaction, amount=5, isTombstone=True)
+    ]
+    store = transactionstore.CompactTransactionStore(transactions)
+
+    by_category, by_month, by_payee = store.totals(use_numpy=False)
+
+    category_id = transaction["categoryId"]
+    assert_equal(by_category, {category_id: 300})
+    assert_equal(by_month, {category_id: {"2015-04": 100, "2015-05": 200}})
+    assert_equal(by_payee, {category_id: {transaction["payeeId"]: 300}})
+
+@unittest.skipIf(transactionstore.numpy is None, "NumPy is not installed")
+def test_numpy_totals_equal_python_totals():
+    store = transactionstore.CompactTransactionStore(budget_transactions)
+
+    assert_equal(store.totals(use_numpy=True), store.totals(use_numpy=False))
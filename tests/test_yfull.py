@@ -0,0 +1,92 @@
+# -*- coding: utf8 -*-
+import json
+import os
+from decimal import Decimal
+from nose.tools import assert_raises, assert_equal, assert_true
+from ynabdebtsync import yfull
+
+budget_file_path = os.path.join(os.path.dirname(__file__), "budget.json")
+
+with open (budget_file_path) as budget_file:
+    budget_json = budget_file.read()
+
+def test_parse_sections_returns_only_given_sections():
+    sections = yfull.parse_sections(budget_json, ["payees", "transactions"])
+
+    budget = json.loads(budget_json)
+    assert_equal(sorted(sections.keys()), ["payees", "transactions"])
+    assert_equal(sections["payees"], budget["payees"])
+    assert_equal(sections["transactions"], budget["transactions"])
+
+def test_parse_sections_none_returns_all_sections():
+    assert_equal(yfull.parse_sections(budget_json, None), json.loads(budget_json))
+
+def test_parse_sections_parse_float_decodes_non_integer_numbers():
+    sections = yfull.parse_sections('{"transactions": [{"amount": 12.34}, {"amount": 7}]}',
+                                    ["transactions"], parse_float=Decimal)
+
+    assert_equal(sections["transactions"], [{"amount": Decimal("12.34")}, {"amount": 7}])
+    assert_true(isinstance(sections["transactions"][0]["amount"], Decimal))
+
+def test_parse_sections_malformed_json_raises_exception():
+    with assert_raises(ValueError):
+        yfull.parse_sections('{"payees": [}', ["payees"])
+
+    with assert_raises(ValueError):
+        yfull.parse_sections('{"payees": []', ["payees"])
+
+def test_parser_fed_in_chunks_returns_same_sections():
+    parser = yfull.YfullSectionParser(["masterCategories", "transactions"])
+
+    completed_sections = []
+    for start in range(0, len(budget_json), 7):
+        completed_sections.extend(parser.feed(budget_json[start:start + 7]))
+
+    budget = json.loads(budget_json)
+    assert_equal(parser.close(), {"masterCategories": budget["masterCategories"],
+                                  "transactions": budget["transactions"]})
+    assert_equal([key for key, value in completed_sections],
+                 ["masterCategories", "transactions"])
+
+def test_parser_handles_brackets_and_escaped_quotes_in_skipped_strings():
+    text = '{"skipped": ["]}\\"{", {"a": "}"}], "kept": {"b": "[\\\\"}}'
+
+    parser = yfull.YfullSectionParser(["kept"])
+    for character in text:
+        parser.feed(character)
+
+    assert_equal(parser.close(), {"kept": {"b": "[\\"}})
+
+class CountingDecoder(json.JSONDecoder):
+    def __init__(self, *args, **kwargs):
+        json.JSONDecoder.__init__(self, *args, **kwargs)
+        self.failed_attempts = 0
+
+    def raw_decode(self, s, idx=0):
+        try:
+            return json.JSONDecoder.raw_decode(self, s, idx)
+        except ValueError:
+            self.failed_attempts += 1
+            raise
+
+def test_parser_fed_in_chunks_keeps_little_text_and_decodes_items_once():
+    # A kept array is decoded as its items arrive: the text of decoded items,
+    # and of skipped sections, isn't kept around, and each chunk costs at most
+    # one failed attempt at decoding the item it cuts short.
+    transaction = {"entityId": "A" * 36, "memo": u"[{\"}]", "amount": -12.5}
+    text = json.dumps({"scheduledTransactions": [transaction] * 2000,
+                       "transactions": [transaction] * 2000})
+    chunk_size = 1000
+
+    parser = yfull.YfullSectionParser(["transactions"])
+    parser._decoder = CountingDecoder()
+    chunk_count = 0
+    largest_buffer = 0
+    for start in range(0, len(text), chunk_size):
+        parser.feed(text[start:start + chunk_size])
+        chunk_count += 1
+        largest_buffer = max(largest_buffer, len(parser._buffer))
+
+    assert_equal(parser.close(), {"transactions": [transaction] * 2000})
+    assert_true(largest_buffer < 2 * chunk_size)
+    assert_true(parser._decoder.failed_attempts <= chunk_count)
@@ -2,6 +2,8 @@
 import os
 from nose.tools import assert_raises, assert_equal, assert_true
 from ynabdebtsync import ynabbudget
+from ynabdebtsync.reconciliation import ReconciliationState
+from ynabdebtsync.transactionfilter import TransactionFilter
 from decimal import Decimal
 
 budget_file_path = os.path.join(os.path.dirname(__file__), "budget.json")
@@ -22,6 +24,83 @@ def test_instantiating_budget_with_json_works():
 
     assert ynab_budget.data["fileMetaData"]["budgetDataVersion"] == "4.2"
 
+def test_instantiating_budget_with_sections_only_loads_those_sections():
+    ynab_budget = ynabbudget.YnabBudget(budget_json, ynabbudget.COMPARISON_SECTIONS)
+
+    assert_equal(sorted(ynab_budget.data.keys()), ["masterCategories", "payees", "transactions"])
+    assert_equal(len(ynab_budget.transactions_by_category_name("Test Debt Category")), 3)
+
+def test_instantiating_budget_with_sections_and_malformed_json_raises_exception():
+    with assert_raises(ynabbudget.YnabBudgetMalformedError) as e:
+        ynab_budget = ynabbudget.YnabBudget('{"payees": [', ynabbudget.COMPARISON_SECTIONS)
+
+    assert_equal(e.exception.message, "Budget JSON is malformed")
+
+def test_compact_budget_returns_same_transactions():
+    ynab_budget = ynabbudget.YnabBudget(budget_json)
+    compact_ynab_budget = ynabbudget.YnabBudget(budget_json, compact=True)
+
+    transactions = ynab_budget.transactions_by_category_name("Test Debt Category")
+    compact_transactions = compact_ynab_budget.transactions_by_category_name("Test Debt Category")
+
+    assert_true("transactions" not in compact_ynab_budget.data)
+    assert_equal([dict(transaction) for transaction in compact_transactions], transactions)
+    assert_equal(compact_ynab_budget.calculate_category_total("Test Debt Category"), -5)
+
+def test_budget_from_data_equals_budget_from_json():
+    data = ynabbudget.parse_sections(budget_json, ynabbudget.COMPARISON_SECTIONS)
+    ynab_budget = ynabbudget.YnabBudget.from_data(data, compact=True)
+
+    assert_true("transactions" not in ynab_budget.data)
+    assert_equal(len(ynab_budget.transactions_by_category_name("Test Debt Category")), 3)
+    assert_equal(ynab_budget.calculate_category_total("Test Debt Category"), -5)
+
+def test_instantiating_fixed_point_budget_stores_exact_amounts():
+    fixed_point_budget = ynabbudget.YnabBudget(this_budget_json, ynabbudget.COMPARISON_SECTIONS, fixed_point=True)
+
+    total = fixed_point_budget.calculate_category_total("Tithing")
+
+    assert_true(fixed_point_budget.transaction_store is not None)
+    assert_true(isinstance(total, Decimal))
+    assert_equal(total, Decimal("242.73"))
+
+def test_fixed_point_comparer_returns_same_missing_transactions():
+    budget_comparer = ynabbudget.YnabBudgetComparer(this_budget_json, "Test Debt Category", other_budget_json, "Test Debt Category")
+    fixed_point_comparer = ynabbudget.YnabBudgetComparer(this_budget_json, "Test Debt Category", other_budget_json, "Test Debt Category",
+                                                         fixed_point=True)
+
+    missing = budget_comparer.get_missing_transactions()
+    fixed_point_missing = fixed_point_comparer.get_missing_transactions()
+
+    assert_equal([[dict(txn) for txn in side] for side in fixed_point_missing], [list(side) for side in missing])
+
+def test_parse_budgets_returns_compact_indexed_budgets_in_order():
+    budgets = ynabbudget.parse_budgets([this_budget_json, other_budget_json])
+
+    assert_equal(len(budgets), 2)
+    assert_true(budgets[0].transaction_store is not None)
+    assert_true("category_transactions" in budgets[0]._indexes)
+    assert_equal(budgets[0].calculate_category_total("Tithing"), 242.73)
+    assert_equal(budgets[1].calculate_category_total("Test Debt Category"),
+                 ynabbudget.YnabBudget(other_budget_json).calculate_category_total("Test Debt Category"))
+
+def test_parallel_comparer_returns_same_missing_transactions():
+    budget_comparer = ynabbudget.YnabBudgetComparer(this_budget_json, "Test Debt Category", other_budget_json, "Test Debt Category")
+    parallel_comparer = ynabbudget.YnabBudgetComparer(this_budget_json, "Test Debt Category", other_budget_json, "Test Debt Category",
+                                                      parallel=True)
+
+    missing = budget_comparer.get_missing_transactions()
+    parallel_missing = parallel_comparer.get_missing_transactions()
+
+    assert_equal([[dict(txn) for txn in side] for side in parallel_missing], [list(side) for side in missing])
+
+def test_parse_budgets_malformed_budget_raises_exception():
+    with assert_raises(ynabbudget.YnabBudgetMalformedError):
+        ynabbudget.parse_budgets(['{"transactions": [}', other_budget_json])
+
+def test_parse_budgets_without_budgets_returns_empty_list():
+    assert_equal(ynabbudget.parse_budgets([]), [])
+
 def test_instantiating_budget_without_json_raises_exception():
     with assert_raises(ValueError) as e:
         ynab_budget = ynabbudget.YnabBudget(None)
@@ -54,6 +133,70 @@ def test_get_category_id_from_name_existing_category_returns_id():
 
     assert_equal(ynab_budget.category_id_from_name("Test Debt Category"), "DEF375CA-58D2-D332-4C79-20862B7566F8")
 
+def test_get_category_id_from_name_is_case_insensitive():
+    ynab_budget = ynabbudget.YnabBudget(budget_json)
+
+    assert_equal(ynab_budget.category_id_from_name("test DEBT category"), "DEF375CA-58D2-D332-4C79-20862B7566F8")
+
+def test_get_category_id_from_name_name_with_slash_returns_id():
+    ynab_budget = ynabbudget.YnabBudget(budget_json)
+
+    assert_equal(ynab_budget.category_id_from_name("Rent/Mortgage"), "A8")
+
+def test_get_category_id_from_name_master_sub_path_returns_id():
+    ynab_budget = ynabbudget.YnabBudget(budget_json)
+
+    assert_equal(ynab_budget.category_id_from_name("monthly bills/rent/mortgage"), "A8")
+    assert_equal(ynab_budget.category_id_from_name("Debt/Car Payment"), "A36")
+
+def test_get_category_id_from_name_prefers_live_category_over_deleted_one():
+    ynab_budget = ynabbudget.YnabBudget(budget_json)
+
+    ynab_budget.data["masterCategories"] = [
+        {
+            u'name': u'Debt',
+            u'isTombstone': True,
+            u'subCategories': [{u'name': u'Loans', u'entityId': u'A1'}]
+        },
+        {
+            u'name': u'Debt',
+            u'subCategories': [{u'name': u'Loans', u'entityId': u'A2'}]
+        }
+    ]
+
+    assert_equal(ynab_budget.category_id_from_name("Loans"), "A2")
+
+def test_get_category_id_from_name_ambiguous_category_raises_exception():
+    ynab_budget = ynabbudget.YnabBudget(budget_json)
+
+    ynab_budget.data["masterCategories"] = [
+        {
+            u'name': u'Debt',
+            u'subCategories': [{u'name': u'Loans', u'entityId': u'A1'}]
+        },
+        {
+            u'name': u'Family',
+            u'subCategories': [{u'name': u'Loans', u'entityId': u'A2'}]
+        }
+    ]
+
+    with assert_raises(ynabbudget.YnabBudgetAmbiguousCategoryError) as e:
+        ynab_budget.category_id_from_name("Loans")
+
+    assert_equal(e.exception.category_ids, ["A1", "A2"])
+    assert_equal(ynab_budget.category_id_from_name("Family/Loans"), "A2")
+
+def test_category_name_from_id_returns_name():
+    ynab_budget = ynabbudget.YnabBudget(budget_json)
+
+    assert_equal(ynab_budget.category_name_from_id("A6"), "Charitable")
+
+def test_category_name_from_id_inexistent_category_raises_exception():
+    ynab_budget = ynabbudget.YnabBudget(budget_json)
+
+    with assert_raises(LookupError) as e:
+        ynab_budget.category_name_from_id("non existent ID")
+
 def test_transactions_by_category_name_inexistent_category_raises_exception():
     ynab_budget = ynabbudget.YnabBudget(budget_json)
 
@@ -105,6 +248,48 @@ def test_transactions_by_category_name_subtransactions_without_memo_inherit_pare
 
     assert_equal(transactions[0]["memo"], transactions[1]["memo"])
 
+def test_transactions_by_category_name_includes_subtransactions_of_split_transactions():
+    ynab_budget = ynabbudget.YnabBudget(budget_json)
+
+    transactions = ynab_budget.transactions_by_category_name("Electricity")
+
+    assert_equal(len(transactions), 1)
+    assert_equal(transactions[0]["entityId"], "DD8A151C-FC59-60D2-5EC5-2089FD28F643")
+    assert_equal(transactions[0]["date"], "2015-04-28")
+
+def test_transactions_by_category_name_sorting_result_does_not_affect_later_calls():
+    ynab_budget = ynabbudget.YnabBudget(budget_json)
+
+    transactions = ynab_budget.transactions_by_category_name("Test Debt Category")
+    transactions.reverse()
+    del transactions[0]
+
+    assert_equal(len(ynab_budget.transactions_by_category_name("Test Debt Category")), 3)
+
+def test_transactions_by_category_name_does_not_modify_subtransactions_in_budget_data():
+    ynab_budget = ynabbudget.YnabBudget(budget_json)
+
+    transactions = ynab_budget.transactions_by_category_name("Electricity")
+
+    split_transaction = [transaction for transaction in ynab_budget.data["transactions"]
+                         if "subTransactions" in transaction][0]
+    subtransaction = split_transaction["subTransactions"][1]
+    assert_true("date" not in subtransaction)
+    assert_true("memo" not in subtransaction)
+    assert_true("payeeId" not in subtransaction)
+    assert_equal(transactions[0]["memo"], "Split")
+    assert_equal(transactions[0]["payeeId"], "D8EB026F-8762-54EB-019C-208AC519C084")
+
+def test_subtransaction_view_is_read_only():
+    ynab_budget = ynabbudget.YnabBudget(budget_json)
+
+    subtransaction = ynab_budget.transactions_by_category_name("Electricity")[0]
+
+    with assert_raises(TypeError):
+        subtransaction["memo"] = "Changed"
+    with assert_raises(TypeError):
+        subtransaction.update({"memo": "Changed"})
+
 def test_transactions_by_category_name_no_transactions_returns_empty_list():
     ynab_budget = ynabbudget.YnabBudget(budget_json)
 
@@ -129,6 +314,32 @@ def test_calculate_category_total_decimal_amount_returns_correct_amount():
     ynab_budget = ynabbudget.YnabBudget(this_budget_json)
     assert_equal(ynab_budget.calculate_category_total("Tithing"), 242.73)
 
+def test_category_totals_returns_totals_of_every_category():
+    ynab_budget = ynabbudget.YnabBudget(budget_json)
+
+    category_totals = ynab_budget.category_totals()
+
+    assert_equal(category_totals.by_category["DEF375CA-58D2-D332-4C79-20862B7566F8"], -5)
+    assert_equal(category_totals.by_category["A12"], -5)
+    assert_equal(category_totals.by_month["DEF375CA-58D2-D332-4C79-20862B7566F8"], {"2015-04": -5})
+    assert_equal(sum(category_totals.by_payee["DEF375CA-58D2-D332-4C79-20862B7566F8"].values()), -5)
+
+def test_category_totals_of_compact_budget_equal_those_of_dictionary_budget():
+    ynab_budget = ynabbudget.YnabBudget(this_budget_json)
+    compact_ynab_budget = ynabbudget.YnabBudget(this_budget_json, compact=True)
+
+    assert_equal(compact_ynab_budget.category_totals(use_numpy=False), ynab_budget.category_totals())
+
+def test_category_totals_decimal_amounts_are_exact():
+    ynab_budget = ynabbudget.YnabBudget(budget_json)
+
+    ynab_budget.data["transactions"] = [
+        {u'entityId': u'A', u'amount': 0.1, u'date': u'2015-04-28', u'categoryId': u'A12'},
+        {u'entityId': u'B', u'amount': 0.2, u'date': u'2015-04-28', u'categoryId': u'A12'}
+    ]
+
+    assert_equal(ynab_budget.category_totals().by_category["A12"], 0.3)
+
 def test_transactions_by_category_name_filtered_by_date_returns_transactions_of_that_date():
     ynab_budget = ynabbudget.YnabBudget(this_budget_json)
 
@@ -179,6 +390,71 @@ def test_transactions_by_category_name_filtered_by_date_returns_transactions_of_
     november_2013_transactions = ynab_budget.filter_category_transactions_by_date('test debt category', '2013-11')
     assert_equal(len(november_2013_transactions), 0)
 
+def date_range_budget():
+    ynab_budget = ynabbudget.YnabBudget(this_budget_json)
+
+    ynab_budget.data["transactions"] = [
+        {
+            u'entityId': u'AD5F14BC-5BCC-E075-4B14-208676CA762' + str(day),
+            u'amount': 10,
+            u'date': date,
+            u'categoryId': u'DEF375CA-58D2-D332-4C79-20862B7566F8'
+        }
+        for day, date in enumerate([u'2015-05-01', u'2015-03-28', u'2015-04-30',
+                                    u'2014-12-31', u'2015-04-01'])
+    ]
+
+    return ynab_budget
+
+def test_transactions_between_returns_transactions_in_range_sorted_by_date():
+    ynab_budget = date_range_budget()
+
+    transactions = ynab_budget.transactions_between('test debt category', '2015-03-28', '2015-04-30')
+
+    assert_equal([txn["date"] for txn in transactions], ["2015-03-28", "2015-04-01", "2015-04-30"])
+
+def test_transactions_between_partial_dates_cover_whole_month_or_year():
+    ynab_budget = date_range_budget()
+
+    assert_equal([txn["date"] for txn in ynab_budget.transactions_between('test debt category', '2015-04', '2015-04')],
+                 ["2015-04-01", "2015-04-30"])
+    assert_equal([txn["date"] for txn in ynab_budget.transactions_between('test debt category', '2015', '2015')],
+                 ["2015-03-28", "2015-04-01", "2015-04-30", "2015-05-01"])
+
+def test_transactions_since_and_until_leave_range_open():
+    ynab_budget = date_range_budget()
+
+    assert_equal([txn["date"] for txn in ynab_budget.transactions_since('test debt category', '2015-04-15')],
+                 ["2015-04-30", "2015-05-01"])
+    assert_equal([txn["date"] for txn in ynab_budget.transactions_until('test debt category', '2015-03')],
+                 ["2014-12-31", "2015-03-28"])
+
+def test_transactions_between_malformed_date_raises_exception():
+    ynab_budget = date_range_budget()
+
+    with assert_raises(ValueError):
+        ynab_budget.transactions_since('test debt category', '28/03/2015')
+
+def test_transactions_by_category_name_with_transaction_filter_returns_matching_transactions():
+    ynab_budget = date_range_budget()
+
+    transactions = ynab_budget.transactions_by_category_name(
+        'test debt category', TransactionFilter(start_date='2015-04', sign='inflow'))
+
+    assert_equal([txn["date"] for txn in transactions], ["2015-04-01", "2015-04-30", "2015-05-01"])
+
+def test_transactions_by_category_name_with_transaction_filter_handles_deleted_transactions():
+    ynab_budget = date_range_budget()
+    ynab_budget.data["transactions"][0]["isTombstone"] = True
+
+    def dates(deleted):
+        return [txn["date"] for txn in ynab_budget.transactions_by_category_name(
+            'test debt category', TransactionFilter(start_date='2015-04', deleted=deleted))]
+
+    assert_equal(dates("exclude"), ["2015-04-01", "2015-04-30"])
+    assert_equal(dates("include"), ["2015-04-01", "2015-04-30", "2015-05-01"])
+    assert_equal(dates("only"), ["2015-05-01"])
+
 def test_transactions_by_category_name_non_deleted_transaction_returns_transaction():
     ynab_budget = ynabbudget.YnabBudget(this_budget_json)
 
@@ -309,23 +585,32 @@ def test_categories_reconcile_if_category_totals_are_equal():
 
     assert_true(budget_comparer.categories_are_reconciled())
 
-def test_get_missing_transactions_of_amount_returns_correct_number_of_missing_transactions():
+def test_compare_returns_correct_number_of_missing_transactions():
     budget_comparer = ynabbudget.YnabBudgetComparer(this_budget_json, "Test Debt Category", other_budget_json, "Test Debt Category")
 
-    assert_equal(len(budget_comparer._get_missing_transactions_of_amount(5)), 1)
+    comparison = budget_comparer.compare()
 
-def test_get_missing_transactions_of_amount_returns_correct_missing_transactions():
+    assert_equal(len(comparison.this_missing), 1)
+    assert_equal(len(comparison.other_missing), 0)
+
+def test_compare_returns_correct_missing_transactions():
     budget_comparer = ynabbudget.YnabBudgetComparer(this_budget_json, "Test Debt Category", other_budget_json, "Test Debt Category")
 
-    missing_transaction = budget_comparer._get_missing_transactions_of_amount(5)[0]
+    missing_transaction = budget_comparer.compare().this_missing[0]
     assert_equal(missing_transaction["memo"], "Loan for beer")
     assert_equal(missing_transaction["amount"], -5)
 
-def test_no_transactions_of_given_amount_throws_exception():
-    budget_comparer = ynabbudget.YnabBudgetComparer(this_budget_json, "Test Debt Category", other_budget_json, "Test Debt Category")
+def test_match_transactions_of_same_number_returns_no_missing_transactions():
+    superset = [{u'entityId': u'A', u'date': u'2015-01-01', u'memo': u''},
+                {u'entityId': u'B', u'date': u'2015-01-10', u'memo': u''}]
+    subset = [{u'entityId': u'X', u'date': u'2015-01-11', u'memo': u''},
+              {u'entityId': u'Y', u'date': u'2015-01-02', u'memo': u''}]
 
-    with assert_raises(ValueError) as e:
-        budget_comparer._get_missing_transactions_of_amount(3)
+    missing, pairs = ynabbudget._match_transactions(superset, subset)
+
+    assert_equal(missing, [])
+    assert_equal(sorted((this["entityId"], other["entityId"]) for this, other in pairs),
+                 [(u'A', u'Y'), (u'B', u'X')])
 
 def test_get_missing_transactions_returns_correct_transactions():
     budget_comparer = ynabbudget.YnabBudgetComparer(this_budget_json, "Test Debt Category", other_budget_json, "Test Debt Category")
@@ -1044,6 +1329,523 @@ def test_get_missing_transactions_with_start_date_ignores_past_transactions():
     assert_equal(other_missing[0]["amount"], -1.5)
     assert_equal(other_missing[0]["memo"], "Loan for wine")
 
+def test_get_missing_transactions_with_start_date_mid_month_includes_later_months():
+    budget_comparer = ynabbudget.YnabBudgetComparer(this_budget_json, "Test Debt Category", other_budget_json, "Test Debt Category")
+
+    budget_comparer.this_budget.data["transactions"] = [
+        {
+            u'entityId': u'AD5F14BC-5BCC-E075-4B14-208676CA762F',
+            u'memo': u'Borrow for wine',
+            u'amount': 7,
+            u'date': date,
+            u'categoryId': u'DEF375CA-58D2-D332-4C79-20862B7566F8'
+        }
+        for date in [u'2015-04-10', u'2015-04-28', u'2015-06-02']
+    ]
+    budget_comparer.other_budget.data["transactions"] = []
+
+    budget_comparer.set_start_date("2015-04-15")
+    budget_comparer.set_end_date("2015-05")
+    this_missing, other_missing = budget_comparer.get_missing_transactions()
+
+    assert_equal([txn["date"] for txn in other_missing], ["2015-04-28"])
+
+def test_get_missing_transactions_with_filter_mirrors_amounts_for_other_budget():
+    budget_comparer = ynabbudget.YnabBudgetComparer(this_budget_json, "Test Debt Category", other_budget_json, "Test Debt Category")
+
+    budget_comparer.this_budget.data["transactions"] = [
+        {u'entityId': u'A', u'amount': 7, u'date': u'2015-04-28', u'categoryId': u'DEF375CA-58D2-D332-4C79-20862B7566F8'},
+        {u'entityId': u'B', u'amount': -3, u'date': u'2015-04-28', u'categoryId': u'DEF375CA-58D2-D332-4C79-20862B7566F8'}
+    ]
+    budget_comparer.other_budget.data["transactions"] = [
+        {u'entityId': u'C', u'amount': -7, u'date': u'2015-04-28', u'categoryId': u'DEF375CA-58D2-D332-4C79-20862B7566F8'},
+        {u'entityId': u'D', u'amount': 2, u'date': u'2015-04-28', u'categoryId': u'DEF375CA-58D2-D332-4C79-20862B7566F8'}
+    ]
+
+    budget_comparer.set_filter(TransactionFilter(sign='inflow'))
+    this_missing, other_missing = budget_comparer.get_missing_transactions()
+
+    assert_equal(len(this_missing), 0)
+    assert_equal(len(other_missing), 0)
+
+def test_get_missing_transactions_with_payee_filter_matches_other_budget_payees():
+    budget_comparer = ynabbudget.YnabBudgetComparer(this_budget_json, "Test Debt Category", other_budget_json, "Test Debt Category")
+
+    budget_comparer.this_budget.data["transactions"] = [
+        {u'entityId': u'A', u'amount': 7, u'date': u'2015-04-28', u'payeeId': u'THIS-PAYEE',
+         u'categoryId': u'DEF375CA-58D2-D332-4C79-20862B7566F8'},
+        {u'entityId': u'B', u'amount': 3, u'date': u'2015-04-28', u'payeeId': u'THIS-OTHER-PAYEE',
+         u'categoryId': u'DEF375CA-58D2-D332-4C79-20862B7566F8'}
+    ]
+    budget_comparer.other_budget.data["transactions"] = [
+        {u'entityId': u'C', u'amount': -7, u'date': u'2015-04-28', u'payeeId': u'OTHER-PAYEE',
+         u'categoryId': u'DEF375CA-58D2-D332-4C79-20862B7566F8'}
+    ]
+
+    budget_comparer.set_filter(TransactionFilter(payee_ids=[u'THIS-PAYEE']))
+    this_missing, other_missing = budget_comparer.get_missing_transactions()
+
+    assert_equal(len(this_missing), 0)
+    assert_equal(len(other_missing), 0)
+
+def test_get_missing_transactions_many_discrepancies_returns_all_missing_transactions():
+    budget_comparer = ynabbudget.YnabBudgetComparer(this_budget_json, "Test Debt Category", other_budget_json, "Test Debt Category")
+
+    def transaction(entity_id, amount, day):
+        return {u'entityId': entity_id, u'amount': amount, u'date': u'2015-04-{0:02d}'.format(day),
+                u'categoryId': u'DEF375CA-58D2-D332-4C79-20862B7566F8'}
+
+    budget_comparer.this_budget.data["transactions"] = (
+        [transaction(u'T{0}'.format(day), day, day) for day in range(1, 29)] +
+        [transaction(u'TX', 5, 20)])
+    budget_comparer.other_budget.data["transactions"] = (
+        [transaction(u'O{0}'.format(day), -day, day) for day in range(1, 29) if day % 3 != 0] +
+        [transaction(u'OX', -2.5, 1)])
+
+    this_missing, other_missing = budget_comparer.get_missing_transactions()
+
+    assert_equal([txn["entityId"] for txn in this_missing], ["OX"])
+    assert_equal(sorted(txn["entityId"] for txn in other_missing),
+                 sorted([u'T{0}'.format(day) for day in range(3, 29, 3)] + [u'TX']))
+
+def test_get_missing_transactions_recurring_amount_with_shifted_dates_returns_unmatched_month():
+    budget_comparer = ynabbudget.YnabBudgetComparer(this_budget_json, "Test Debt Category", other_budget_json, "Test Debt Category")
+
+    def transaction(entity_id, amount, date):
+        return {u'entityId': entity_id, u'amount': amount, u'date': date,
+                u'categoryId': u'DEF375CA-58D2-D332-4C79-20862B7566F8'}
+
+    # The other budget entered every rent payment a couple of days late and
+    # is missing April's.
+    budget_comparer.this_budget.data["transactions"] = [
+        transaction(u'T{0}'.format(month), -500, u'2015-{0:02d}-01'.format(month))
+        for month in range(1, 13)]
+    budget_comparer.other_budget.data["transactions"] = [
+        transaction(u'O{0}'.format(month), 500, u'2015-{0:02d}-03'.format(month))
+        for month in range(1, 13) if month != 4]
+
+    this_missing, other_missing = budget_comparer.get_missing_transactions()
+
+    assert_equal(this_missing, [])
+    assert_equal([txn["entityId"] for txn in other_missing], [u'T4'])
+
+def test_get_missing_transactions_equally_close_dates_prefers_same_memo():
+    budget_comparer = ynabbudget.YnabBudgetComparer(this_budget_json, "Test Debt Category", other_budget_json, "Test Debt Category")
+
+    budget_comparer.this_budget.data["transactions"] = [
+        {u'entityId': u'A', u'amount': -5, u'date': u'2015-04-27', u'memo': u'Cinema',
+         u'categoryId': u'DEF375CA-58D2-D332-4C79-20862B7566F8'},
+        {u'entityId': u'B', u'amount': -5, u'date': u'2015-04-29', u'memo': u'Lunch',
+         u'categoryId': u'DEF375CA-58D2-D332-4C79-20862B7566F8'}
+    ]
+    budget_comparer.other_budget.data["transactions"] = [
+        {u'entityId': u'C', u'amount': 5, u'date': u'2015-04-28', u'memo': u'lunch ',
+         u'categoryId': u'DEF375CA-58D2-D332-4C79-20862B7566F8'}
+    ]
+
+    this_missing, other_missing = budget_comparer.get_missing_transactions()
+
+    assert_equal([txn["entityId"] for txn in other_missing], [u'A'])
+
+def test_unmatched_transactions_minimises_total_date_distance():
+    superset = [{u'entityId': entity_id, u'date': date} for entity_id, date in
+                [(u'A', u'2015-01-01'), (u'B', u'2015-01-10'), (u'C', u'2015-01-11'), (u'D', u'2015-01-30')]]
+    subset = [{u'entityId': u'X', u'date': u'2015-01-02'}, {u'entityId': u'Y', u'date': u'2015-01-12'}]
+
+    unmatched = ynabbudget._unmatched_transactions(superset, subset)
+
+    assert_equal([txn["entityId"] for txn in unmatched], [u'B', u'D'])
+
+def test_comparer_with_parsed_budgets_uses_them_as_is():
+    this_budget = ynabbudget.YnabBudget(this_budget_json)
+    other_budget = ynabbudget.YnabBudget(other_budget_json)
+
+    budget_comparer = ynabbudget.YnabBudgetComparer(this_budget, "Test Debt Category", other_budget, "Test Debt Category")
+
+    assert_true(budget_comparer.this_budget is this_budget)
+    assert_true(budget_comparer.other_budget is other_budget)
+
+def multi_budget_comparer():
+    def transaction(entity_id, amount):
+        return {u'entityId': entity_id, u'amount': amount, u'date': u'2015-04-28',
+                u'categoryId': u'DEF375CA-58D2-D332-4C79-20862B7566F8'}
+
+    comparer = ynabbudget.MultiBudgetComparer([
+        ("joe", this_budget_json, "Test Debt Category"),
+        ("jane", other_budget_json, "Test Debt Category"),
+        ("jim", this_budget_json, "Test Debt Category")
+    ])
+    comparer.budgets["joe"].data["transactions"] = [transaction(u'J1', 5), transaction(u'J2', -2)]
+    comparer.budgets["jane"].data["transactions"] = [transaction(u'A1', -5)]
+    comparer.budgets["jim"].data["transactions"] = [transaction(u'M1', -5), transaction(u'M2', 2)]
+    return comparer
+
+def test_multi_budget_comparer_compares_every_pair_of_budgets():
+    comparer = multi_budget_comparer()
+
+    missing = comparer.get_missing_transactions()
+
+    assert_equal(comparer.pairs(), [("joe", "jane"), ("joe", "jim"), ("jane", "jim")])
+    entity_ids = dict((pair, ([txn["entityId"] for txn in this_missing], [txn["entityId"] for txn in other_missing]))
+                      for pair, (this_missing, other_missing) in missing.items())
+    assert_equal(entity_ids, {
+        ("joe", "jane"): ([], [u'J2']),
+        ("joe", "jim"): ([], []),
+        ("jane", "jim"): ([u'M2', u'M1'], [u'A1'])
+    })
+
+def test_multi_budget_comparer_pair_comparer_shares_parsed_budgets():
+    comparer = multi_budget_comparer()
+
+    pair_comparer = comparer.comparer("joe", "jim")
+
+    assert_true(pair_comparer.this_budget is comparer.budgets["joe"])
+    assert_true(pair_comparer.other_budget is comparer.budgets["jim"])
+    assert_equal(comparer.categories_are_reconciled()[("joe", "jim")], True)
+
+def test_multi_budget_comparer_duplicate_names_raises_exception():
+    with assert_raises(ValueError):
+        ynabbudget.MultiBudgetComparer([("joe", this_budget_json, "Test Debt Category"),
+                                        ("joe", other_budget_json, "Test Debt Category")])
+
+def test_get_missing_transactions_with_reconciliation_state_only_examines_changed_transactions():
+    budget_comparer = ynabbudget.YnabBudgetComparer(this_budget_json, "Test Debt Category", other_budget_json, "Test Debt Category")
+
+    def transaction(entity_id, entity_version, amount, date):
+        return {u'entityId': entity_id, u'entityVersion': entity_version, u'amount': amount, u'date': date,
+                u'categoryId': u'DEF375CA-58D2-D332-4C79-20862B7566F8'}
+
+    budget_comparer.this_budget.data["transactions"] = [
+        transaction(u'T1', u'A-1', -5, u'2015-04-01'),
+        transaction(u'T2', u'A-2', -5, u'2015-04-10'),
+        transaction(u'T3', u'A-3', 7, u'2015-04-12')
+    ]
+    budget_comparer.other_budget.data["transactions"] = [
+        transaction(u'O1', u'B-1', 5, u'2015-04-02'),
+        transaction(u'O2', u'B-2', 5, u'2015-04-10')
+    ]
+    budget_comparer.set_reconciliation_state(ReconciliationState())
+
+    this_missing, other_missing = budget_comparer.get_missing_transactions()
+
+    assert_equal([txn["entityId"] for txn in other_missing], [u'T3'])
+    assert_equal(sorted(budget_comparer.reconciliation_state.matched_pairs), [(u'T1', u'O1'), (u'T2', u'O2')])
+
+    # Joe moves a payment to the date Jane recorded for another one, and Jane
+    # records the missing transaction.
+    budget_comparer.this_budget.data["transactions"] = [
+        transaction(u'T1', u'A-4', -5, u'2015-04-10'),
+        transaction(u'T2', u'A-2', -5, u'2015-04-10'),
+        transaction(u'T3', u'A-3', 7, u'2015-04-12')
+    ]
+    budget_comparer.other_budget.data["transactions"] = [
+        transaction(u'O1', u'B-1', 5, u'2015-04-02'),
+        transaction(u'O2', u'B-2', 5, u'2015-04-10'),
+        transaction(u'O3', u'B-3', -7, u'2015-04-12')
+    ]
+
+    this_missing, other_missing = budget_comparer.get_missing_transactions()
+
+    assert_equal((this_missing, other_missing), ([], []))
+    assert_equal(sorted(budget_comparer.reconciliation_state.matched_pairs),
+                 [(u'T1', u'O1'), (u'T2', u'O2'), (u'T3', u'O3')])
+    assert_equal(budget_comparer.reconciliation_state.this_watermark, {u'A': 4})
+
+def digest_comparer():
+    budget_comparer = ynabbudget.YnabBudgetComparer(this_budget_json, "Test Debt Category", other_budget_json, "Test Debt Category")
+
+    def transaction(entity_id, amount, date):
+        return {u'entityId': entity_id, u'amount': amount, u'date': date,
+                u'categoryId': u'DEF375CA-58D2-D332-4C79-20862B7566F8'}
+
+    budget_comparer.this_budget.data["transactions"] = [
+        transaction(u'T1', -5, u'2014-03-01'),
+        transaction(u'T2', 7.5, u'2015-01-10'),
+        transaction(u'T3', -2, u'2015-01-20'),
+        transaction(u'T4', -3, u'2015-06-15'),
+        transaction(u'T5', -3, u'2015-08-01')
+    ]
+    budget_comparer.other_budget.data["transactions"] = [
+        transaction(u'O1', 5, u'2014-03-02'),
+        transaction(u'O3', 2, u'2015-01-21'),
+        transaction(u'O2', -7.5, u'2015-01-09'),
+        transaction(u'O4', 3, u'2015-06-15')
+    ]
+    return budget_comparer
+
+def test_category_digests_are_independent_of_order_and_normalise_sign():
+    budget_comparer = digest_comparer()
+
+    this_digests = budget_comparer.this_budget.category_digests("Test Debt Category")
+    other_digests = budget_comparer.other_budget.category_digests("Test Debt Category", sign=-1)
+
+    assert_equal(this_digests.by_month["2015-01"], other_digests.by_month["2015-01"])
+    assert_equal(this_digests.by_month["2015-01"][0], 2)
+    assert_equal(this_digests.by_year["2014"], other_digests.by_year["2014"])
+    assert_true(this_digests.by_year["2015"] != other_digests.by_year["2015"])
+
+def test_divergent_months_returns_months_whose_digests_differ():
+    budget_comparer = digest_comparer()
+
+    assert_equal(budget_comparer.divergent_months(), ["2015-08"])
+    assert_equal(budget_comparer.first_divergent_month(), "2015-08")
+
+    budget_comparer.other_budget.data["transactions"] = budget_comparer.other_budget.data["transactions"] + [
+        {u'entityId': u'O5', u'amount': 3, u'date': u'2015-08-02', u'categoryId': u'DEF375CA-58D2-D332-4C79-20862B7566F8'}]
+
+    assert_equal(budget_comparer.divergent_months(), [])
+    assert_equal(budget_comparer.first_divergent_month(), None)
+
+def test_divergent_months_only_returns_months_in_date_range():
+    budget_comparer = digest_comparer()
+    budget_comparer.this_budget.data["transactions"] = budget_comparer.this_budget.data["transactions"] + [
+        {u'entityId': u'T6', u'amount': 1, u'date': u'2013-12-01', u'categoryId': u'DEF375CA-58D2-D332-4C79-20862B7566F8'}]
+
+    budget_comparer.set_start_date("2014")
+    budget_comparer.set_end_date("2015-07")
+
+    assert_equal(budget_comparer.divergent_months(), [])
+
+def test_divergent_months_returns_months_of_same_year_with_moved_transaction():
+    budget_comparer = digest_comparer()
+    # Both sides have the transaction, in different months of 2015, so 2015's
+    # digests are equal but March's and April's aren't.
+    budget_comparer.this_budget.data["transactions"] = budget_comparer.this_budget.data["transactions"] + [
+        {u'entityId': u'T6', u'amount': -4, u'date': u'2015-03-31', u'categoryId': u'DEF375CA-58D2-D332-4C79-20862B7566F8'}]
+    budget_comparer.other_budget.data["transactions"] = budget_comparer.other_budget.data["transactions"] + [
+        {u'entityId': u'O5', u'amount': 3, u'date': u'2015-08-02', u'categoryId': u'DEF375CA-58D2-D332-4C79-20862B7566F8'},
+        {u'entityId': u'O6', u'amount': 4, u'date': u'2015-04-01', u'categoryId': u'DEF375CA-58D2-D332-4C79-20862B7566F8'}]
+
+    this_digests = budget_comparer.this_budget.category_digests("Test Debt Category")
+    other_digests = budget_comparer.other_budget.category_digests("Test Debt Category", sign=-1)
+    assert_equal(this_digests.by_year["2015"], other_digests.by_year["2015"])
+
+    assert_equal(budget_comparer.divergent_months(), ["2015-03", "2015-04"])
+
+def test_get_missing_transactions_narrows_divergent_months_to_date_range():
+    budget_comparer = digest_comparer()
+    # O2, on the 9th, is out of the range, so T2, on the 10th, is missing.
+    budget_comparer.set_start_date("2015-01-10")
+    budget_comparer.set_end_date("2015-06-15")
+
+    this_missing, other_missing = budget_comparer.get_missing_transactions()
+
+    assert_equal(this_missing, [])
+    assert_equal([txn["entityId"] for txn in other_missing], [u'T2'])
+
+def test_get_missing_transactions_only_matches_divergent_months():
+    budget_comparer = digest_comparer()
+
+    this_missing, other_missing = budget_comparer.get_missing_transactions()
+
+    assert_equal(this_missing, [])
+    assert_equal([txn["entityId"] for txn in other_missing], [u'T5'])
+
+def test_get_missing_transactions_mid_month_start_date_matches_partial_month():
+    budget_comparer = digest_comparer()
+    # Balanced over the whole month, but not from the 15th onwards.
+    budget_comparer.other_budget.data["transactions"] = budget_comparer.other_budget.data["transactions"] + [
+        {u'entityId': u'O5', u'amount': 3, u'date': u'2015-08-02', u'categoryId': u'DEF375CA-58D2-D332-4C79-20862B7566F8'}]
+    budget_comparer.this_budget.data["transactions"][-1][u'date'] = u'2015-08-20'
+
+    budget_comparer.set_start_date("2015-08-15")
+    this_missing, other_missing = budget_comparer.get_missing_transactions()
+
+    assert_equal(this_missing, [])
+    assert_equal([txn["entityId"] for txn in other_missing], [u'T5'])
+
+def test_category_balances_returns_running_balance_per_date():
+    budget_comparer = digest_comparer()
+
+    dates, balances = budget_comparer.other_budget.category_balances("Test Debt Category", sign=-1)
+
+    assert_equal(dates, ["2014-03-02", "2015-01-09", "2015-01-21", "2015-06-15"])
+    assert_equal(balances, [-5000, 2500, 500, -2500])
+
+def test_divergence_returns_last_date_balances_agreed_and_gap():
+    budget_comparer = digest_comparer()
+
+    divergence = budget_comparer.divergence()
+
+    assert_equal(divergence, ynabbudget.Divergence("2015-06-15", "2015-08-01", Decimal("-3")))
+
+def test_divergence_in_sync_as_of_end_date_returns_no_diverged_date():
+    budget_comparer = digest_comparer()
+
+    budget_comparer.set_end_date("2015-07")
+
+    assert_equal(budget_comparer.divergence(), ynabbudget.Divergence("2015-06-15", None, 0))
+
+def test_divergence_counts_balances_from_start_date():
+    budget_comparer = digest_comparer()
+    budget_comparer.other_budget.data["transactions"] = budget_comparer.other_budget.data["transactions"][1:]
+
+    assert_equal(budget_comparer.divergence().last_agreement_date, None)
+
+    budget_comparer.set_start_date("2015")
+
+    assert_equal(budget_comparer.divergence().last_agreement_date, "2015-06-15")
+
+def test_batch_budget_comparer_compares_every_category_pair():
+    comparer = ynabbudget.BatchBudgetComparer(this_budget_json, other_budget_json,
+                                              [("Test Debt Category", "Test Debt Category"), ("Phone", "Phone")])
+
+    def transaction(entity_id, amount, category_id):
+        return {u'entityId': entity_id, u'amount': amount, u'date': u'2015-04-28', u'categoryId': category_id}
+
+    comparer.this_budget.data["transactions"] = [
+        transaction(u'T1', -5, u'DEF375CA-58D2-D332-4C79-20862B7566F8'),
+        transaction(u'T2', -30, u'A9'),
+        transaction(u'T3', -12.5, u'A9')
+    ]
+    comparer.other_budget.data["transactions"] = [
+        transaction(u'O1', 5, u'DEF375CA-58D2-D332-4C79-20862B7566F8'),
+        transaction(u'O2', 30, u'A9')
+    ]
+
+    comparisons = comparer.compare()
+
+    assert_equal(comparisons[("Test Debt Category", "Test Debt Category")],
+                 ynabbudget.CategoryPairComparison([], [], -5, 5))
+    phone = comparisons[("Phone", "Phone")]
+    assert_equal([txn["entityId"] for txn in phone.other_missing], [u'T3'])
+    assert_equal((phone.this_total, phone.other_total), (-42.5, 30))
+
+def test_batch_budget_comparer_pair_comparer_shares_parsed_budgets():
+    comparer = ynabbudget.BatchBudgetComparer(this_budget_json, other_budget_json,
+                                              [("Test Debt Category", "Test Debt Category")])
+
+    pair_comparer = comparer.comparer("Test Debt Category", "Test Debt Category")
+
+    assert_true(pair_comparer.this_budget is comparer.this_budget)
+    assert_true(pair_comparer.other_budget is comparer.other_budget)
+
+def tolerance_comparer():
+    budget_comparer = ynabbudget.YnabBudgetComparer(this_budget_json, "Test Debt Category", other_budget_json, "Test Debt Category")
+
+    def transaction(entity_id, amount):
+        return {u'entityId': entity_id, u'amount': amount, u'date': u'2015-04-28',
+                u'categoryId': u'DEF375CA-58D2-D332-4C79-20862B7566F8'}
+
+    budget_comparer.this_budget.data["transactions"] = [
+        transaction(u'T1', -20.03), transaction(u'T2', 7), transaction(u'T3', -100)]
+    budget_comparer.other_budget.data["transactions"] = [
+        transaction(u'O1', 20), transaction(u'O2', -9), transaction(u'O3', 101)]
+    return budget_comparer
+
+def test_compare_without_tolerance_has_no_near_matches():
+    budget_comparer = tolerance_comparer()
+
+    comparison = budget_comparer.compare()
+
+    assert_equal(len(comparison.this_missing), 3)
+    assert_equal(len(comparison.other_missing), 3)
+    assert_equal(comparison.near_matches, [])
+
+def test_compare_with_absolute_tolerance_reports_near_matches_separately():
+    budget_comparer = tolerance_comparer()
+
+    budget_comparer.set_tolerance(absolute_tolerance=0.05)
+    comparison = budget_comparer.compare()
+
+    assert_equal([(this_txn["entityId"], other_txn["entityId"]) for this_txn, other_txn in comparison.near_matches],
+                 [(u'T1', u'O1')])
+    assert_equal(sorted(txn["entityId"] for txn in comparison.this_missing), [u'O2', u'O3'])
+    assert_equal(sorted(txn["entityId"] for txn in comparison.other_missing), [u'T2', u'T3'])
+
+def test_get_missing_transactions_with_relative_tolerance_leaves_out_near_matches():
+    budget_comparer = tolerance_comparer()
+
+    budget_comparer.set_tolerance(relative_tolerance=0.01)
+    this_missing, other_missing = budget_comparer.get_missing_transactions()
+
+    assert_equal([txn["entityId"] for txn in this_missing], [u'O2'])
+    assert_equal([txn["entityId"] for txn in other_missing], [u'T2'])
+
+def test_set_tolerance_negative_raises_exception():
+    budget_comparer = tolerance_comparer()
+
+    with assert_raises(ValueError):
+        budget_comparer.set_tolerance(absolute_tolerance=-1)
+
+def test_compare_reconciled_categories_is_decided_by_precheck():
+    budget_comparer = digest_comparer()
+    budget_comparer.this_budget.data["transactions"] = budget_comparer.this_budget.data["transactions"][:-1]
+
+    comparison = budget_comparer.compare()
+
+    assert_true(budget_comparer.categories_agree())
+    assert_equal(comparison.decided_by, "precheck")
+    assert_equal(list(comparison.timings), ["precheck"])
+    assert_equal((comparison.this_missing, comparison.other_missing), ([], []))
+
+def test_compare_categories_out_of_sync_is_decided_by_matching():
+    budget_comparer = digest_comparer()
+
+    comparison = budget_comparer.compare()
+
+    assert_equal(budget_comparer.categories_agree(), False)
+    assert_equal(comparison.decided_by, "matching")
+    assert_equal(list(comparison.timings), ["precheck", "digests", "matching"])
+    assert_equal([txn["entityId"] for txn in comparison.other_missing], [u'T5'])
+
+def test_compare_precheck_only_covers_date_range():
+    budget_comparer = digest_comparer()
+    budget_comparer.other_budget.data["transactions"] = budget_comparer.other_budget.data["transactions"] + [
+        {u'entityId': u'O5', u'amount': 3, u'date': u'2015-09-01', u'categoryId': u'DEF375CA-58D2-D332-4C79-20862B7566F8'}]
+
+    comparison = budget_comparer.compare()
+
+    assert_true(budget_comparer.categories_agree())
+    assert_equal(comparison.decided_by, "precheck")
+
+    budget_comparer.set_end_date("2015-08")
+
+    assert_equal(budget_comparer.categories_agree(), False)
+    assert_equal(budget_comparer.compare().decided_by, "matching")
+
+def test_categories_agree_mid_month_date_range_returns_none():
+    budget_comparer = digest_comparer()
+
+    budget_comparer.set_start_date("2015-01-15")
+
+    assert_equal(budget_comparer.categories_agree(), None)
+    assert_equal(budget_comparer.compare().decided_by, "matching")
+
+def test_iter_missing_transactions_yields_same_transactions_as_get_missing_transactions():
+    budget_comparer = tolerance_comparer()
+
+    missing = list(budget_comparer.iter_missing_transactions())
+    this_missing, other_missing = budget_comparer.get_missing_transactions()
+
+    assert_equal(sorted(txn["entityId"] for side, txn in missing if side == ynabbudget.THIS_MISSING),
+                 sorted(txn["entityId"] for txn in this_missing))
+    assert_equal(sorted(txn["entityId"] for side, txn in missing if side == ynabbudget.OTHER_MISSING),
+                 sorted(txn["entityId"] for txn in other_missing))
+
+def test_iter_missing_transactions_yields_in_amount_order_as_groups_are_matched():
+    budget_comparer = tolerance_comparer()
+
+    missing = budget_comparer.iter_missing_transactions()
+
+    assert_equal(next(missing), (ynabbudget.THIS_MISSING, budget_comparer.other_budget.data["transactions"][2]))
+    assert_equal([txn["entityId"] for side, txn in missing], [u'T3', u'T1', u'O1', u'T2', u'O2'])
+
+def test_iter_missing_transactions_with_tolerance_leaves_out_near_matches():
+    budget_comparer = tolerance_comparer()
+
+    budget_comparer.set_tolerance(absolute_tolerance=0.05)
+
+    assert_equal(sorted((side, txn["entityId"]) for side, txn in budget_comparer.iter_missing_transactions()),
+                 [(ynabbudget.OTHER_MISSING, u'T2'), (ynabbudget.OTHER_MISSING, u'T3'),
+                  (ynabbudget.THIS_MISSING, u'O2'), (ynabbudget.THIS_MISSING, u'O3')])
+
+def test_iter_missing_transactions_of_reconciled_categories_yields_nothing():
+    budget_comparer = digest_comparer()
+    budget_comparer.this_budget.data["transactions"] = budget_comparer.this_budget.data["transactions"][:-1]
+
+    assert_equal(list(budget_comparer.iter_missing_transactions()), [])
+
 def test_get_this_payees_returns_this_budgets_payees():
     budget_comparer = ynabbudget.YnabBudgetComparer(this_budget_json, "Test Debt Category", other_budget_json, "Test Debt Category")
 
@@ -1057,3 +1859,40 @@ def test_get_other_payees_returns_other_budgets_payees():
     other_payees = budget_comparer.get_other_payees()
 
     assert_equal(other_payees["8F925C3-F8762-54EB-019C-208AC519C084"], "Other budget shop")
+
+def test_set_malformed_start_date_raises_exception():
+    budget_comparer = digest_comparer()
+
+    for start_date in ("01/02/2016", "undefined", 2016):
+        with assert_raises(ValueError):
+            budget_comparer.set_start_date(start_date)
+
+    assert_equal(budget_comparer.start_date, None)
+    assert_equal([txn["entityId"] for txn in budget_comparer.compare().other_missing], [u"T5"])
+
+def test_set_malformed_end_date_raises_exception():
+    budget_comparer = digest_comparer()
+
+    with assert_raises(ValueError):
+        budget_comparer.set_end_date("2015/06")
+
+    assert_equal(budget_comparer.end_date, None)
+
+def test_set_malformed_dates_with_filter_raises_exception():
+    budget_comparer = digest_comparer()
+    budget_comparer.set_filter(TransactionFilter(sign='outflow'))
+
+    with assert_raises(ValueError):
+        budget_comparer.set_start_date("01/02/2016")
+    with assert_raises(ValueError):
+        budget_comparer.set_end_date("undefined")
+
+def test_set_malformed_dates_of_multi_and_batch_comparers_raises_exception():
+    batch_comparer = ynabbudget.BatchBudgetComparer(this_budget_json, other_budget_json,
+                                                    [("Test Debt Category", "Test Debt Category")])
+
+    for comparer in (multi_budget_comparer(), batch_comparer):
+        with assert_raises(ValueError):
+            comparer.set_start_date("undefined")
+        with assert_raises(ValueError):
+            comparer.set_end_date("01/02/2016")
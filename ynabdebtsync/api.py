@@ -1,16 +1,206 @@
 # -*- coding: utf8 -*-
 
+import collections
+import hashlib
+import json
+import multiprocessing
+import threading
 import werkzeug
 import time
 
 from server import flask_app
-from flask import request
-from flask_restful import Resource, Api, reqparse
-from ynabbudget import YnabBudgetComparer
-from dropbox import Dropbox
+from flask import Response, request, stream_with_context
+from flask_restful import Resource, Api, abort, reqparse
+from ynabbudget import (COMPARISON_SECTIONS, BatchBudgetComparer, MultiBudgetComparer,
+                        YnabBudget, YnabBudgetComparer, parse_budgets)
+from transactionfilter import TransactionFilter
+from dropbox import BudgetDirectoryWatcher, Dropbox
+from budgetcache import BudgetCache
+from reconciliation import ReconciliationState, ReconciliationStateStore
 
 api = Api(flask_app)
 
+# Created on first use by parser_pool.
+_parser_pool = None
+_parser_pool_lock = threading.Lock()
+
+def parser_pool():
+    """Return the pool of processes budgets are parsed in, see
+    YnabBudgetComparer, or None if PARSER_PROCESSES isn't configured."""
+    global _parser_pool
+    processes = flask_app.config.get('PARSER_PROCESSES')
+    if _parser_pool is None and processes:
+        with _parser_pool_lock:
+            # Another request's thread may have created it meanwhile.
+            if _parser_pool is None:
+                _parser_pool = multiprocessing.Pool(processes)
+    return _parser_pool
+
+def budget_cache():
+    """Return the cache of downloaded budgets, see Dropbox, or None if
+    BUDGET_CACHE_DIR isn't configured."""
+    if not flask_app.config.get('BUDGET_CACHE_DIR'):
+        return None
+    return BudgetCache(flask_app.config['BUDGET_CACHE_DIR'],
+                       flask_app.config['BUDGET_CACHE_SIZE'] * 1024 * 1024)
+
+# Each account's budget directory views, see Dropbox, keyed by a digest of its
+# access token, and the watchers started by watch_budget, keyed by the digest
+# and budget path. Both are kept in least recently used order and bounded.
+MAX_DIRECTORY_VIEW_ACCOUNTS = 100
+MAX_WATCHED_BUDGETS = 50
+_directory_views = collections.OrderedDict()
+_directory_views_lock = threading.Lock()
+_budget_watchers = collections.OrderedDict()
+_budget_watchers_lock = threading.Lock()
+
+def _token_digest(token):
+    return hashlib.sha1(token.encode('utf-8')).hexdigest()
+
+def dropbox_client(token):
+    """Return a Dropbox for token that shares the budget cache and the
+    account's budget directory views with the process's other requests. The
+    views of the least recently used accounts are dropped beyond
+    MAX_DIRECTORY_VIEW_ACCOUNTS."""
+    digest = _token_digest(token)
+    with _directory_views_lock:
+        views = _directory_views.pop(digest, {})
+        _directory_views[digest] = views
+        while len(_directory_views) > MAX_DIRECTORY_VIEW_ACCOUNTS:
+            _directory_views.popitem(last=False)
+    return Dropbox(token, budget_cache(), views)
+
+def watch_budget(token, budget_path):
+    """Start watching the budget at budget_path for changes, if WATCH_BUDGETS
+    is configured and it isn't watched yet. Each change refreshes the
+    budget's directory view and downloads the new version into the budget
+    cache, see BudgetDirectoryWatcher. Beyond MAX_WATCHED_BUDGETS, the least
+    recently used budget's watcher is stopped."""
+    if not flask_app.config.get('WATCH_BUDGETS'):
+        return
+
+    key = (_token_digest(token), budget_path)
+    with _budget_watchers_lock:
+        # Forget the watchers that stopped by themselves, e.g. idle ones or
+        # those whose token was revoked.
+        for stopped_key in [watched_key for watched_key, watcher in _budget_watchers.items()
+                            if not watcher.is_alive()]:
+            del _budget_watchers[stopped_key]
+
+        watcher = _budget_watchers.pop(key, None)
+        if watcher is not None:
+            watcher.touch()
+            _budget_watchers[key] = watcher
+            return
+
+        while len(_budget_watchers) >= MAX_WATCHED_BUDGETS:
+            _budget_watchers.popitem(last=False)[1].stop()
+
+        db = dropbox_client(token)
+
+        def prefetch_budget(path):
+            if db.cache is None:
+                return
+            if parser_pool() is not None:
+                db.get_budget_file(path)
+            else:
+                db.get_budget(path, COMPARISON_SECTIONS)
+
+        watcher = BudgetDirectoryWatcher(db, budget_path, prefetch_budget)
+        watcher.start()
+        _budget_watchers[key] = watcher
+        flask_app.logger.info("Watching budget {path}".format(path=budget_path))
+
+def get_budgets(db, budget_paths):
+    """Fetch and parse the budgets at budget_paths concurrently, see
+    Dropbox.get_budget_files. Without a parser pool each budget is parsed as
+    it downloads, see Dropbox.get_budgets, otherwise the downloaded files are
+    parsed in the pool, see parse_budgets. Responds with 400 Bad Request if a
+    budget is malformed."""
+    start = time.time()
+    if parser_pool() is not None:
+        budgets = parse_budgets(db.get_budget_files(budget_paths), pool=parser_pool())
+    else:
+        try:
+            budgets = [YnabBudget.from_data(data)
+                       for data in db.get_budgets(budget_paths, COMPARISON_SECTIONS)]
+        except ValueError as e:
+            abort(400, message="Budget JSON is malformed: {0}".format(e))
+    end = time.time()
+    flask_app.logger.debug("Get {count} budgets time elapsed: {time}s"
+                           .format(count=len(budget_paths), time=(end - start)))
+    return budgets
+
+def transactions_json(transactions):
+    """Return transactions as dictionaries, as those of budgets parsed in a
+    parser pool are read-only TransactionRow views."""
+    return [dict(transaction) for transaction in transactions]
+
+def transaction_filter_from_request(filter_json):
+    """Build a TransactionFilter from a request's filter, given either as a
+    JSON object or as a string with one, e.g. in a form field. Responds with
+    400 Bad Request if the filter is invalid."""
+    if not filter_json:
+        return None
+    try:
+        if isinstance(filter_json, basestring):
+            filter_json = json.loads(filter_json)
+        return TransactionFilter.from_json(filter_json)
+    except (TypeError, ValueError) as e:
+        abort(400, message="Invalid transaction filter: {0}".format(e))
+
+def set_date_range_from_request(comparer, start_date, end_date):
+    """Set a comparer's date range from a request's dates. Responds with 400
+    Bad Request if they are malformed."""
+    try:
+        comparer.set_start_date(start_date)
+        comparer.set_end_date(end_date)
+    except ValueError as e:
+        abort(400, message="Invalid date range: {0}".format(e))
+
+def tolerance_from_request(values):
+    """Return the (absolute, relative) amount tolerances of a request's form
+    or JSON, see YnabBudgetComparer.set_tolerance. Responds with 400 Bad
+    Request if they are invalid."""
+    try:
+        tolerance = (float(values.get("amount_tolerance") or 0),
+                     float(values.get("relative_tolerance") or 0))
+    except (TypeError, ValueError) as e:
+        abort(400, message="Invalid tolerance: {0}".format(e))
+    if tolerance[0] < 0 or tolerance[1] < 0:
+        abort(400, message="Tolerances must not be negative")
+    return tolerance
+
+def reconciliation_state_key(comparer, this_budget_path, other_budget_path):
+    """Return the key of the comparer's ReconciliationState, see
+    ReconciliationStateStore. Comparisons with different date ranges or
+    filters examine different transactions, so each gets its own state."""
+    def filter_key(transaction_filter):
+        if transaction_filter is None:
+            return None
+        return json.dumps(transaction_filter.to_json(), sort_keys=True)
+
+    return (this_budget_path, comparer.this_category_name, other_budget_path, comparer.other_category_name,
+            comparer.start_date, comparer.end_date,
+            filter_key(comparer.this_filter), filter_key(comparer.other_filter))
+
+def near_matches_json(near_matches):
+    return [{"this": dict(this_txn), "other": dict(other_txn)}
+            for this_txn, other_txn in near_matches]
+
+def missing_transactions_ndjson(comparer, on_finish=None):
+    """Yield a comparison's results as newline delimited JSON: a first line
+    with both budgets' payees, then a line per missing transaction with its
+    side, as the comparer finds them, see
+    YnabBudgetComparer.iter_missing_transactions. on_finish is called once
+    every transaction has been sent."""
+    yield json.dumps({"this_payees": comparer.get_this_payees(),
+                      "other_payees": comparer.get_other_payees()}) + "\n"
+    for side, transaction in comparer.iter_missing_transactions():
+        yield json.dumps({"side": side, "transaction": dict(transaction)}) + "\n"
+    if on_finish is not None:
+        on_finish()
+
 class CategoryComparison(Resource):
     def post(self):
         parser = reqparse.RequestParser()
@@ -25,12 +215,24 @@ class CategoryComparison(Resource):
         other_target_category = request.form["other_target_category"]
 
         start_date = request.form["start_date"]
+        end_date = request.form.get("end_date")
 
-        comparer = YnabBudgetComparer(this_json, this_target_category, other_json, other_target_category)
-        comparer.set_start_date(start_date)
+        comparer = YnabBudgetComparer(this_json, this_target_category, other_json, other_target_category,
+                                      pool=parser_pool())
+        set_date_range_from_request(comparer, start_date, end_date)
+        comparer.set_filter(
+            transaction_filter_from_request(request.form.get("this_filter")),
+            transaction_filter_from_request(request.form.get("other_filter"))
+        )
 
-        missing_txns = comparer.get_missing_transactions()
-        return {"this_missing": missing_txns[0], "other_missing": missing_txns[1]}
+        comparer.set_tolerance(*tolerance_from_request(request.form))
+
+        comparison = comparer.compare()
+        return {"this_missing": transactions_json(comparison.this_missing),
+                "other_missing": transactions_json(comparison.other_missing),
+                "near_matches": near_matches_json(comparison.near_matches),
+                "decided_by": comparison.decided_by,
+                "timings": comparison.timings}
 
     def get(self):
         return {"key": "value"}
@@ -50,6 +252,11 @@ class DropboxBudgets(Resource):
             budgets = db.get_their_budgets()
             end = time.clock()
             flask_app.logger.debug("Get their budgets time elapsed: {time}s".format(time=(end - start)))
+        elif whose == 'shared':
+            start = time.clock()
+            budgets = db.get_all_their_budgets()
+            end = time.clock()
+            flask_app.logger.debug("Get all shared budgets time elapsed: {time}s".format(time=(end - start)))
         return budgets
 
 class DropboxBudgetComparison(Resource):
@@ -62,27 +269,166 @@ class DropboxBudgetComparison(Resource):
         this_budget_path = json['this_budget_path']
         other_budget_path = json['other_budget_path']
 
-        db = Dropbox(token)
+        db = dropbox_client(token)
+
+        # Both budgets are fetched concurrently, see Dropbox.get_budget_files,
+        # which logs each fetch's time and how much they overlapped.
+        this_budget, other_budget = get_budgets(db, [this_budget_path, other_budget_path])
+        watch_budget(token, other_budget_path)
+
+        this_target_category = json['this_target_category']
+        other_target_category = json['other_target_category']
+
+        start_date = json['comparison_start_date']
+        end_date = json.get('comparison_end_date')
+
+        comparer = YnabBudgetComparer(this_budget, this_target_category, other_budget, other_target_category)
+        set_date_range_from_request(comparer, start_date, end_date)
+        comparer.set_filter(
+            transaction_filter_from_request(json.get('this_filter')),
+            transaction_filter_from_request(json.get('other_filter'))
+        )
+
+        state_store = state_key = None
+        if flask_app.config.get('RECONCILIATION_STATE_DIR'):
+            state_store = ReconciliationStateStore(flask_app.config['RECONCILIATION_STATE_DIR'])
+            state_key = reconciliation_state_key(comparer, this_budget_path, other_budget_path)
+            comparer.set_reconciliation_state(state_store.load(state_key) or ReconciliationState())
+
+        comparer.set_tolerance(*tolerance_from_request(json))
+
+        if json.get('stream'):
+            # Send the missing transactions as they are found, see
+            # missing_transactions_ndjson.
+            def save_state():
+                if state_store is not None:
+                    state_store.save(state_key, comparer.reconciliation_state)
+                flask_app.logger.info("Finished streaming budget comparison. Time elapsed: {time}s"
+                                      .format(time=(time.clock() - method_start)))
+            return Response(stream_with_context(missing_transactions_ndjson(comparer, save_state)),
+                            mimetype='application/x-ndjson')
+
+        start = time.clock()
+        comparison = comparer.compare()
+        end = time.clock()
+        flask_app.logger.debug("Find missing transactions time elapsed: {time}s, decided by {stage}, stages: {timings}"
+                               .format(time=(end - start), stage=comparison.decided_by,
+                                       timings=", ".join("{0} {1:f}s".format(*timing)
+                                                         for timing in comparison.timings.items())))
+
+        if state_store is not None:
+            state_store.save(state_key, comparer.reconciliation_state)
+
+        method_finish = time.clock()
+        method_elapsed = method_finish - method_start
+        flask_app.logger.info("Finished comparing budgets. Time elapsed: {time}s".format(time=method_elapsed))
+
+        this_payees = comparer.get_this_payees()
+        other_payees = comparer.get_other_payees()
+
+        return {"this_missing": transactions_json(comparison.this_missing),
+                "other_missing": transactions_json(comparison.other_missing),
+                "near_matches": near_matches_json(comparison.near_matches),
+                "decided_by": comparison.decided_by, "timings": comparison.timings,
+                "this_payees": this_payees, "other_payees": other_payees}
+
+class DropboxBatchBudgetComparison(Resource):
+    """Compares several pairs of categories between two budgets. The
+    request's 'category_pairs' is a list of objects with a
+    'this_target_category' and an 'other_target_category'."""
+    def post(self):
+        method_start = time.clock()
+        flask_app.logger.info("Comparing category pairs")
+
+        json = request.get_json()
+        token = json['access_token']
+
+        db = dropbox_client(token)
+
+        this_budget, other_budget = get_budgets(db, [json['this_budget_path'], json['other_budget_path']])
+
+        category_pairs = [(pair['this_target_category'], pair['other_target_category'])
+                          for pair in json['category_pairs']]
+
+        comparer = BatchBudgetComparer(this_budget, other_budget, category_pairs)
+        set_date_range_from_request(comparer, json.get('comparison_start_date'),
+                                    json.get('comparison_end_date'))
+        comparer.set_filter(
+            transaction_filter_from_request(json.get('this_filter')),
+            transaction_filter_from_request(json.get('other_filter'))
+        )
 
         start = time.clock()
-        this_json = db.get_budget_file(this_budget_path)
+        comparisons = comparer.compare()
         end = time.clock()
-        elapsed = end - start
-        flask_app.logger.debug("Get this budget time elapsed: {time}s".format(time=elapsed))
+        flask_app.logger.debug("Compare category pairs time elapsed: {time}s".format(time=(end - start)))
+
+        method_finish = time.clock()
+        method_elapsed = method_finish - method_start
+        flask_app.logger.info("Finished comparing category pairs. Time elapsed: {time}s".format(time=method_elapsed))
+
+        return {"comparisons": [{"this_target_category": this_category,
+                                 "other_target_category": other_category,
+                                 "this_missing": transactions_json(comparisons[(this_category, other_category)].this_missing),
+                                 "other_missing": transactions_json(comparisons[(this_category, other_category)].other_missing),
+                                 "this_total": comparisons[(this_category, other_category)].this_total,
+                                 "other_total": comparisons[(this_category, other_category)].other_total}
+                                for this_category, other_category in category_pairs],
+                "this_payees": comparer.this_budget.payee_ids_to_names(),
+                "other_payees": comparer.other_budget.payee_ids_to_names()}
+
+class DropboxBudgetDivergence(Resource):
+    """Answers since when two categories are out of sync, see
+    YnabBudgetComparer.divergence."""
+    def post(self):
+        json = request.get_json()
+        token = json['access_token']
+
+        db = dropbox_client(token)
+
+        this_budget, other_budget = get_budgets(db, [json['this_budget_path'], json['other_budget_path']])
+
+        comparer = YnabBudgetComparer(this_budget, json['this_target_category'],
+                                      other_budget, json['other_target_category'])
+        set_date_range_from_request(comparer, json.get('comparison_start_date'),
+                                    json.get('comparison_end_date'))
 
         start = time.clock()
-        other_json = db.get_budget_file(other_budget_path)
+        divergence = comparer.divergence()
         end = time.clock()
-        elapsed = end - start
-        flask_app.logger.debug("Get other budget time elapsed: {time}s".format(time=elapsed))
+        flask_app.logger.debug("Find divergence time elapsed: {time}s".format(time=(end - start)))
 
-        this_target_category = json['this_target_category']
-        other_target_category = json['other_target_category']
+        return {"last_agreement_date": divergence.last_agreement_date,
+                "diverged_date": divergence.diverged_date,
+                "gap": divergence.gap}
 
-        start_date = json['comparison_start_date']
+class DropboxMultiBudgetComparison(Resource):
+    """Compares a debt category shared between several people. The request's
+    'budgets' is a list of objects with each person's 'name', 'budget_path'
+    and 'target_category'. Every pair of budgets is compared."""
+    def post(self):
+        method_start = time.clock()
+        flask_app.logger.info("Comparing budgets of several people")
 
-        comparer = YnabBudgetComparer(this_json, this_target_category, other_json, other_target_category)
-        comparer.set_start_date(start_date)
+        json = request.get_json()
+        token = json['access_token']
+        budgets = json['budgets']
+        if len(budgets) < 2:
+            abort(400, message="At least two budgets are needed")
+
+        db = dropbox_client(token)
+
+        parsed_budgets = get_budgets(db, [budget['budget_path'] for budget in budgets])
+        parties = [(budget['name'], parsed_budget, budget['target_category'])
+                   for budget, parsed_budget in zip(budgets, parsed_budgets)]
+
+        try:
+            comparer = MultiBudgetComparer(parties)
+        except ValueError as e:
+            abort(400, message=str(e))
+        set_date_range_from_request(comparer, json.get('comparison_start_date'),
+                                    json.get('comparison_end_date'))
+        comparer.set_filter(transaction_filter_from_request(json.get('filter')))
 
         start = time.clock()
         missing_txns = comparer.get_missing_transactions()
@@ -93,13 +439,16 @@ class DropboxBudgetComparison(Resource):
         method_elapsed = method_finish - method_start
         flask_app.logger.info("Finished comparing budgets. Time elapsed: {time}s".format(time=method_elapsed))
 
-        this_payees = comparer.get_this_payees()
-        other_payees = comparer.get_other_payees()
+        comparisons = [{"this_name": this_name, "other_name": other_name,
+                        "this_missing": transactions_json(missing_txns[(this_name, other_name)][0]),
+                        "other_missing": transactions_json(missing_txns[(this_name, other_name)][1])}
+                       for this_name, other_name in comparer.pairs()]
 
-        return {"this_missing": missing_txns[0], "other_missing": missing_txns[1],
-                "this_payees": this_payees, "other_payees": other_payees}
+        return {"comparisons": comparisons, "payees": comparer.get_payees()}
 
 api.add_resource(CategoryComparison, "/api/categorycomparison")
 api.add_resource(DropboxBudgets, "/api/dropboxbudgets/<string:whose>")
 api.add_resource(DropboxBudgetComparison, "/api/dropboxbudgetcomparison")
-
+api.add_resource(DropboxBatchBudgetComparison, "/api/dropboxbatchcomparison")
+api.add_resource(DropboxBudgetDivergence, "/api/dropboxbudgetdivergence")
+api.add_resource(DropboxMultiBudgetComparison, "/api/dropboxmultibudgetcomparison")
@@ -0,0 +1,87 @@
+# -*- coding: utf8 -*-
+"""Offline comparison of budget files, e.g. synced Dropbox folders.
+
+The job file is a JSON object whose "comparisons" list has objects with a
+"this_budget" and an "other_budget" Budget.yfull file path, a
+"this_category" and an "other_category", and optionally a "start_date" and
+an "end_date". Every budget file is read and parsed once, concurrently in a
+process pool, however many comparisons it is part of. The results are
+written as JSON to the output file, or to stdout.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import sys
+import time
+
+from ynabbudget import YnabBudgetComparer, parse_budgets
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+logger.addHandler(logging.NullHandler())
+
+def compare_budget_files(comparisons, processes=None):
+    """Run the comparisons of a job file, see the module's documentation.
+    Return the list of results, one per comparison, in the same order, with
+    the comparison's fields plus its "this_missing" and "other_missing"
+    transactions."""
+    paths = sorted(set(comparison[side] for comparison in comparisons
+                       for side in ("this_budget", "other_budget")))
+    if not paths:
+        return []
+
+    start = time.time()
+    budget_jsons = []
+    for path in paths:
+        with open(path) as budget_file:
+            budget_jsons.append(budget_file.read())
+
+    pool = multiprocessing.Pool(processes or min(len(paths),
+                                                 multiprocessing.cpu_count()))
+    try:
+        budgets = dict(zip(paths, parse_budgets(budget_jsons, pool=pool)))
+    finally:
+        pool.close()
+        pool.join()
+    logger.debug("Parse {count} budgets time elapsed: {time}s".format(
+        count=len(paths), time=(time.time() - start)))
+
+    results = []
+    for comparison in comparisons:
+        comparer = YnabBudgetComparer(budgets[comparison["this_budget"]],
+                                      comparison["this_category"],
+                                      budgets[comparison["other_budget"]],
+                                      comparison["other_category"])
+        comparer.set_start_date(comparison.get("start_date"))
+        comparer.set_end_date(comparison.get("end_date"))
+        this_missing, other_missing = comparer.get_missing_transactions()
+
+        result = dict(comparison)
+        result["this_missing"] = [dict(txn) for txn in this_missing]
+        result["other_missing"] = [dict(txn) for txn in other_missing]
+        results.append(result)
+
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare debt categories of budget files.")
+    parser.add_argument("job_file", help="JSON file listing the comparisons")
+    parser.add_argument("-o", "--output", help="file to write the results to")
+    parser.add_argument("-p", "--processes", type=int,
+                        help="number of budget parsing processes")
+    args = parser.parse_args(argv)
+
+    with open(args.job_file) as job_file:
+        comparisons = json.load(job_file)["comparisons"]
+
+    results = compare_budget_files(comparisons, args.processes)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"results": results}, output_file, indent=2)
+    else:
+        json.dump({"results": results}, sys.stdout, indent=2)
+    return 0
@@ -0,0 +1,109 @@
+# -*- coding: utf8 -*-
+
+import cPickle
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+
+class BudgetCache(object):
+    """Keeps downloaded budgets in a directory, one pickle file per key, e.g.
+    a Budget.yfull file's Dropbox ID and revision, so an unchanged budget is
+    read from disk instead of being downloaded again. See Dropbox.
+
+    The directory is kept under max_size bytes by evicting the least recently
+    used files, a file's modification time being updated whenever it is read.
+    Files are replaced atomically and evictions are serialised with a lock
+    file, so several processes, e.g. gunicorn workers, can share a directory.
+    """
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+
+    def path(self, key):
+        """Return the path of the cache file of key, a tuple of strings."""
+        digest = hashlib.sha1(json.dumps(list(key))).hexdigest()
+        return os.path.join(self.directory, digest + ".pickle")
+
+    def get(self, key):
+        """Return the cached value of key, or None if there is none."""
+        path = self.path(key)
+        try:
+            cache_file = open(path, "rb")
+        except IOError:
+            return None
+        try:
+            with cache_file:
+                value = cPickle.load(cache_file)
+        except Exception:
+            # Corrupt, or written by an incompatible version, which can fail
+            # to unpickle in many ways. Treat it as missing and drop it.
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+        try:
+            os.utime(path, None)
+        except OSError:
+            # Evicted by another process since it was read.
+            pass
+        return value
+
+    def put(self, key, value):
+        """Cache value under key, then evict the least recently used files
+        until the cache fits in max_size again. A value larger than max_size
+        isn't cached."""
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        cache_file = tempfile.NamedTemporaryFile(dir=self.directory,
+                                                 suffix=".tmp", delete=False)
+        try:
+            with cache_file:
+                cPickle.dump(value, cache_file, cPickle.HIGHEST_PROTOCOL)
+                cache_file.flush()
+                os.fsync(cache_file.fileno())
+            if os.path.getsize(cache_file.name) > self.max_size:
+                os.remove(cache_file.name)
+                return
+            os.rename(cache_file.name, self.path(key))
+        except:
+            if os.path.exists(cache_file.name):
+                os.remove(cache_file.name)
+            raise
+
+        self._evict()
+
+    def _evict(self):
+        with open(os.path.join(self.directory, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                entries = []
+                for name in os.listdir(self.directory):
+                    if not name.endswith(".pickle"):
+                        continue
+                    try:
+                        stat = os.stat(os.path.join(self.directory, name))
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, name))
+
+                size = sum(entry[1] for entry in entries)
+                for mtime, file_size, name in sorted(entries):
+                    if size <= self.max_size:
+                        break
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except OSError:
+                        pass
+                    size -= file_size
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
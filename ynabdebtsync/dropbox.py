@@ -1,16 +1,31 @@
 # -*- coding: utf8 -*-
 
-import dateutil.parser
-import datetime
+import codecs
 import json
+import re
 import requests
+import threading
 import time
 import logging
+from multiprocessing.pool import ThreadPool
+
+from yfull import YfullSectionParser
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 logger.addHandler(logging.NullHandler())
 
+# Name of a budget folder shared by another person, see
+# Dropbox.get_their_budgets.
+shared_folder_name = re.compile(r'^YNAB \(([0-9]+)\)$', re.IGNORECASE)
+
+class DropboxAuthError(Exception):
+    """Raised when Dropbox rejects the access token, e.g. because it was
+    revoked or expired."""
+
+class DropboxNotFoundError(Exception):
+    """Raised when there is no file or folder at the requested path."""
+
 class Dropbox(object):
     """Wrapper to Dropbox's HTTP API:
         https://www.dropbox.com/developers/documentation/http/documentation#files-list_folder"""
@@ -25,11 +40,24 @@ class Dropbox(object):
     dropbox_endpoints = {
         'list_folder': 'https://api.dropboxapi.com/2/files/list_folder',
         'list_folder_continue': 'https://api.dropboxapi.com/2/files/list_folder/continue',
+        'list_folder_longpoll': 'https://notify.dropboxapi.com/2/files/list_folder/longpoll',
+        'get_metadata': 'https://api.dropboxapi.com/2/files/get_metadata',
+        'list_folder_get_latest_cursor': 'https://api.dropboxapi.com/2/files/list_folder/get_latest_cursor',
         'download': 'https://content.dropboxapi.com/2/files/download'
     }
 
-    def __init__(self, token):
+    def __init__(self, token, cache=None, directory_views=None):
+        """cache is a BudgetCache that downloaded budgets are kept in, keyed by
+        their file's ID and revision. If None, every budget is downloaded.
+
+        directory_views is a dictionary of budget paths to their
+        BudgetDirectoryView, shared by the Dropbox objects of the same
+        account, e.g. one per request. Views are added to it as budgets are
+        fetched. If None, each budget directory is listed in full every
+        time."""
         self.token = token
+        self.cache = cache
+        self.directory_views = directory_views
         self.session = requests.Session()
         self.session.headers.update({'Authorization': 'Bearer ' + self.token,
                                      'Content-Type': 'application/json'})
@@ -46,6 +74,50 @@ class Dropbox(object):
         shares their budget(s), it will appear as 'YNAB (2)'."""
         return self.get_all_budgets_at_path('/YNAB (1)')
 
+    def get_shared_budget_folders(self):
+        """Returns the paths of every shared budget folder at the root, i.e.
+        'YNAB (1)', 'YNAB (2)', etc., one per person that shared their 'YNAB'
+        folder, sorted by their number."""
+        url = self.dropbox_endpoints['list_folder']
+        data = {
+            'path': '',
+            'recursive': False,
+            'include_media_info': False,
+            'include_deleted': False
+        }
+
+        r = self.session.post(url, data=json.dumps(data))
+
+        if r.status_code == requests.codes.ok:
+            try:
+                root_contents = r.json()
+            except ValueError:
+                self.raise_exception(r, 'Could not retrieve list of shared folders')
+        else:
+            self.raise_exception(r, 'Could not retrieve list of shared folders')
+
+        entries, cursor = self._continue_listing(root_contents)
+
+        folders = []
+
+        for entry in entries:
+            match = shared_folder_name.match(entry['name'])
+            if entry['.tag'] == 'folder' and match:
+                folders.append((int(match.group(1)), entry['path_lower']))
+
+        return [path for number, path in sorted(folders)]
+
+    def get_all_their_budgets(self):
+        """Returns the budgets in every shared budget folder, see
+        get_shared_budget_folders. Each budget's 'folder' is the path of the
+        shared folder it is in, identifying whose budget it is."""
+        budgets = []
+        for folder in self.get_shared_budget_folders():
+            for budget in self.get_all_budgets_at_path(folder):
+                budget['folder'] = folder
+                budgets.append(budget)
+        return budgets
+
     def get_all_budgets_at_path(self, path):
         url = self.dropbox_endpoints['list_folder']
         data = {
@@ -89,12 +161,166 @@ class Dropbox(object):
                                      error_code=request.status_code,
                                      error_message=request.text))
         logger.error(exception_message)
+        if request.status_code == self.dropbox_error_codes['bad_token']:
+            raise DropboxAuthError(exception_message)
+        if self._is_not_found(request):
+            raise DropboxNotFoundError(exception_message)
         raise Exception(exception_message)
 
+    def _is_not_found(self, request):
+        """Returns whether the request failed because its path doesn't exist,
+        e.g. a 'path/not_found/..' error."""
+        if request.status_code != self.dropbox_error_codes['unknown']:
+            return False
+        try:
+            error_summary = request.json().get('error_summary', '')
+        except ValueError:
+            return False
+        return error_summary.startswith(('path/not_found', 'path_lookup/not_found'))
+
+    # Most budgets fetched at the same time by get_budget_files and
+    # get_budgets, whatever the number of budgets asked for.
+    max_concurrent_fetches = 4
+
+    def get_budget_files(self, budget_directory_paths):
+        """Fetches several budgets concurrently, a thread per budget up to
+        max_concurrent_fetches, see get_budget_file. The threads share this
+        object's session, so its connection pool, and the request takes as
+        long as the slowest fetch rather than their sum. Returns the budgets
+        in the same order as budget_directory_paths."""
+        return self._fetch_concurrently(self.get_budget_file,
+                                        budget_directory_paths)
+
+    def get_budgets(self, budget_directory_paths, sections=None, parse_float=None):
+        """Fetches and parses several budgets concurrently, see get_budget and
+        get_budget_files."""
+        return self._fetch_concurrently(
+            lambda path: self.get_budget(path, sections, parse_float),
+            budget_directory_paths
+        )
+
+    def _fetch_concurrently(self, fetch, budget_directory_paths):
+        if not budget_directory_paths:
+            return []
+        fetch_times = {}
+
+        def timed_fetch(budget_directory_path):
+            start = time.time()
+            budget = fetch(budget_directory_path)
+            fetch_times[budget_directory_path] = (start, time.time())
+            return budget
+
+        start = time.time()
+        pool = ThreadPool(min(len(budget_directory_paths),
+                              self.max_concurrent_fetches))
+        try:
+            budgets = pool.map(timed_fetch, budget_directory_paths)
+        finally:
+            pool.close()
+            pool.join()
+        elapsed = time.time() - start
+
+        # How much of the fetches ran at the same time: the time they would
+        # have taken one after the other, less the time they took.
+        sequential_elapsed = sum(end - fetch_start
+                                 for fetch_start, end in fetch_times.values())
+        for path in budget_directory_paths:
+            logger.debug("Get budget {path} time elapsed: {time}s"
+                         .format(path=path, time=(fetch_times[path][1] - fetch_times[path][0])))
+        logger.debug("Get {count} budgets time elapsed: {time}s, fetches overlapped for {overlap}s"
+                     .format(count=len(budget_directory_paths), time=elapsed,
+                             overlap=max(sequential_elapsed - elapsed, 0)))
+
+        return budgets
+
     def get_budget_file(self, budget_directory_path):
+        """Returns the contents of the newest Budget.yfull file of the budget
+        at budget_directory_path, see newest_budget_file."""
+        budget_file = self.newest_budget_file(budget_directory_path)
+        cache_key = ('file', budget_file['id'], budget_file['rev'])
+        budget_json = self._cached(cache_key)
+        if budget_json is not None:
+            return budget_json
+
+        r = self._download(budget_file)
+
+        if r.status_code == requests.codes.ok:
+            start = time.clock()
+            budget_json = r.text
+            end = time.clock()
+            elapsed = end - start
+            logger.debug("Requests response.text access time elapsed: {time}s".format(time=elapsed))
+            self._cache(cache_key, budget_json)
+            return budget_json
+        else:
+            self.raise_exception(r, 'Could not get the budget file')
+
+    def get_budget(self, budget_directory_path, sections=None, parse_float=None,
+                   chunk_size=64 * 1024):
+        """Returns the dictionary of the given top-level sections of the
+        newest Budget.yfull file of the budget at budget_directory_path, see
+        yfull.parse_sections.
+
+        The file is parsed while it downloads: each chunk of the response is
+        decoded and fed to a YfullSectionParser as it arrives, so parsing
+        overlaps with the transfer and the file's whole text is never held in
+        memory. Raises a ValueError if the file is malformed.
+        """
+        budget_file = self.newest_budget_file(budget_directory_path)
+        cache_key = ('sections', budget_file['id'], budget_file['rev'],
+                     sorted(sections) if sections is not None else None,
+                     parse_float.__name__ if parse_float is not None else None)
+        budget = self._cached(cache_key)
+        if budget is not None:
+            return budget
+
+        r = self._download(budget_file, stream=True)
+
+        if r.status_code != requests.codes.ok:
+            self.raise_exception(r, 'Could not get the budget file')
+
+        start = time.time()
+        # YNAB stores its budget in utf-8. The incremental decoder keeps the
+        # bytes of a character split across two chunks until the next one.
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        parser = YfullSectionParser(sections, parse_float)
+        try:
+            for chunk in r.iter_content(chunk_size):
+                parser.feed(decoder.decode(chunk))
+            parser.feed(decoder.decode(b'', final=True))
+        finally:
+            r.close()
+        budget = parser.close()
+        elapsed = time.time() - start
+        logger.debug("Download and parse budget time elapsed: {time}s, {speed} KB/s"
+                     .format(time=elapsed, speed=(budget_file['size'] // 1024 // max(elapsed, 0.001))))
+
+        self._cache(cache_key, budget)
+        return budget
+
+    def _cached(self, cache_key):
+        if self.cache is None:
+            return None
+        start = time.time()
+        budget = self.cache.get(cache_key)
+        if budget is not None:
+            logger.debug("Read cached budget {key} time elapsed: {time}s"
+                         .format(key=cache_key[1:3], time=(time.time() - start)))
+        return budget
+
+    def _cache(self, cache_key, budget):
+        if self.cache is not None:
+            self.cache.put(cache_key, budget)
+
+    def list_budget_directory(self, budget_directory_path, recursive=True):
+        """Lists the budget at budget_directory_path, recursively unless
+        recursive is False, paging through list_folder/continue. Returns the
+        list of entries and the cursor to fetch later changes with, see
+        list_budget_directory_changes.
+        """
         data = {
             'path': budget_directory_path,
-            'recursive': True,
+            'recursive': recursive,
             'include_media_info': False,
             'include_deleted': False
         }
@@ -106,8 +332,6 @@ class Dropbox(object):
 
         if budget_dir_contents_response.status_code == requests.codes.ok:
             try:
-                # TODO deal with has_more. Up to ~2000 files we're OK.
-                # http://stackoverflow.com/questions/34237283/dropbox-api-list-folder-functions
                 budget_dir_contents = budget_dir_contents_response.json()
             except ValueError:
                 self.raise_exception(budget_dir_contents_response,
@@ -119,81 +343,276 @@ class Dropbox(object):
         logger.debug("Budget directory has_more: {has_more}"
                      .format(has_more=budget_dir_contents['has_more']))
 
-        if budget_dir_contents['has_more']:
-            # Bootstrap the loop using the initial response's data.
-            paginated_results = {}
-            paginated_results['cursor'] = budget_dir_contents['cursor']
-            paginated_results['has_more'] = True
-
-            while paginated_results['has_more']:
-                logger.debug("Processing cursor {cursor}"
-                    .format(cursor=paginated_results['cursor']))
-
-                data = {
-                    'cursor': paginated_results['cursor']
-                }
-                paginated_results_response = self.session.post(
-                    self.dropbox_endpoints['list_folder_continue'],
-                    data=json.dumps(data)
-                )
-                try:
-                    paginated_results = paginated_results_response.json()
-                except ValueError:
-                    self.raise_exception(paginated_results_response,
-                                         ('Could not parse paginated list of'
-                                          'budgets'))
+        return self._continue_listing(budget_dir_contents)
+
+    def list_budget_directory_changes(self, cursor):
+        """Returns the entries that changed since cursor was returned, deleted
+        ones having a '.tag' of 'deleted', and the cursor to fetch the next
+        changes with. Returns None if Dropbox reset the cursor, in which case
+        the directory has to be listed again."""
+        data = {
+            'cursor': cursor
+        }
+        changes_response = self.session.post(
+            self.dropbox_endpoints['list_folder_continue'],
+            data=json.dumps(data)
+        )
 
-                budget_dir_contents['entries'].extend(paginated_results['entries'])
-                logger.debug("Added {entries_count} entries"
-                             .format(entries_count=len(budget_dir_contents['entries'])))
+        if changes_response.status_code == self.dropbox_error_codes['unknown']:
+            try:
+                error_summary = changes_response.json().get('error_summary', '')
+            except ValueError:
+                error_summary = ''
+            if error_summary.startswith('reset/'):
+                logger.debug("Cursor {cursor} was reset".format(cursor=cursor))
+                return None
+
+        if changes_response.status_code == requests.codes.ok:
+            try:
+                changes = changes_response.json()
+            except ValueError:
+                self.raise_exception(changes_response,
+                                     'Could not parse list of budget changes')
+        else:
+            self.raise_exception(changes_response,
+                                 'Could not retrieve list of budget changes')
+
+        return self._continue_listing(changes)
+
+    def _continue_listing(self, budget_dir_contents):
+        entries = budget_dir_contents['entries']
+        paginated_results = budget_dir_contents
+
+        while paginated_results['has_more']:
+            logger.debug("Processing cursor {cursor}"
+                .format(cursor=paginated_results['cursor']))
+
+            data = {
+                'cursor': paginated_results['cursor']
+            }
+            paginated_results_response = self.session.post(
+                self.dropbox_endpoints['list_folder_continue'],
+                data=json.dumps(data)
+            )
+            try:
+                paginated_results = paginated_results_response.json()
+            except ValueError:
+                self.raise_exception(paginated_results_response,
+                                     ('Could not parse paginated list of'
+                                      'budgets'))
+
+            entries.extend(paginated_results['entries'])
+            logger.debug("Added {entries_count} entries"
+                         .format(entries_count=len(entries)))
 
         logger.debug("Processed list_folder paginated results")
 
-        # Need to replace (add, actually) UTC timezone to the naive datetime
-        # returned by datetime.max, otherwise comparisons fail with a
-        # TypeError when the strings are converted to datetime.
-        earliest_iso8601_date = datetime.datetime.min.replace(
-                tzinfo = dateutil.tz.tzutc()
-        ).isoformat()
+        return entries, paginated_results['cursor']
+
+    def wait_for_changes(self, cursor, timeout=30):
+        """Blocks until the directory cursor was returned for changes, or for
+        up to timeout seconds, using list_folder/longpoll. Returns whether
+        there are changes, and the number of seconds Dropbox asked to wait
+        before calling again, or None."""
+        # The longpoll endpoint must be called without an Authorization
+        # header, so the session isn't used.
+        data = {
+            'cursor': cursor,
+            'timeout': timeout
+        }
+        r = requests.post(self.dropbox_endpoints['list_folder_longpoll'],
+                          data=json.dumps(data),
+                          headers={'Content-Type': 'application/json'},
+                          # Dropbox adds up to 90 seconds of jitter.
+                          timeout=timeout + 120)
+
+        if r.status_code == requests.codes.ok:
+            try:
+                result = r.json()
+            except ValueError:
+                self.raise_exception(r, 'Could not parse budget changes')
+        else:
+            self.raise_exception(r, 'Could not wait for budget changes')
+
+        return result['changes'], result.get('backoff')
+
+    def newest_budget_file(self, budget_directory_path):
+        """Returns the Dropbox metadata of the most recently modified
+        Budget.yfull file in the budget at budget_directory_path. Each device
+        of the budget keeps its own copy of the file.
+
+        The file is found through the budget's metadata, see
+        resolve_budget_file, which only needs a handful of small requests.
+        With directory_views, the resolved file and a cursor taken just before
+        resolving it seed the directory's BudgetDirectoryView, so later calls
+        only fetch the changes since. If the file can't be resolved the
+        directory's listing is searched instead.
+        """
+        view = None
+        if self.directory_views is not None:
+            view = self.directory_views.setdefault(
+                budget_directory_path,
+                BudgetDirectoryView(budget_directory_path)
+            )
+
+        if view is None or view.cursor is None:
+            # Taken first, so changes made while resolving aren't missed.
+            cursor = None
+            if view is not None:
+                cursor = self.get_latest_cursor(budget_directory_path)
+            budget_file = self.resolve_budget_file(budget_directory_path)
+            if budget_file is not None:
+                if view is not None:
+                    view.seed([budget_file], cursor)
+                return budget_file
+
+        if view is None:
+            entries, cursor = self.list_budget_directory(budget_directory_path)
+        else:
+            entries = view.refresh(self)
 
-        # Build a dummy entry so max() can be used to maintain the newest
-        # version of the budget.
-        newest_budget_file = {'client_modified': earliest_iso8601_date}
+        newest_budget_file = None
 
-        for entry in budget_dir_contents['entries']:
+        for entry in entries:
             if entry['.tag'] == 'file' and 'yfull' in entry['name']:
                 logger.debug(
                     "Found budget file at {path}\n\tClient modification time: {date}"
                     .format(path=entry['path_lower'], date=entry['client_modified'])
                 )
-                newest_budget_file = max(
-                    newest_budget_file,
-                    entry,
-                    key=lambda x: dateutil.parser.parse(x['client_modified'])
-                )
+                # Dropbox's timestamps are all UTC in the same
+                # "%Y-%m-%dT%H:%M:%SZ" format, so they sort as strings.
+                if (newest_budget_file is None or
+                        entry['client_modified'] > newest_budget_file['client_modified']):
+                    newest_budget_file = entry
 
         logger.debug("Using budget file at {budget_path}"
                      .format(budget_path=newest_budget_file))
 
-        # If .tag does not exist then newest_budget_file is still the dummy
-        # object and no budget file was found.
-        if '.tag' not in newest_budget_file:
+        if newest_budget_file is None:
             error_msg = ('No budget file found for budget at "{path}"'
                         .format(path=budget_directory_path))
             logger.error(error_msg)
             raise Exception(error_msg)
 
+        return newest_budget_file
+
+    def resolve_budget_file(self, budget_directory_path):
+        """Returns the Dropbox metadata of the Budget.yfull file of the budget
+        at budget_directory_path, found without listing the budget's
+        directory, or None if it couldn't be found that way.
+
+        Budget.ymeta names the budget's data folder. In it, each device of the
+        budget has a devices/<short ID>.ydevice file, which says how up to date
+        that device's copy of the full budget file is, and a folder named
+        after the device's GUID, holding that Budget.yfull file. The copy of
+        the device with the most knowledge is used.
+        """
+        budget_meta = self._download_json(budget_directory_path + '/Budget.ymeta')
+        if budget_meta is None or 'relativeDataFolderName' not in budget_meta:
+            return None
+        data_folder_path = (budget_directory_path + '/' +
+                            budget_meta['relativeDataFolderName'])
+
+        try:
+            device_entries, cursor = self.list_budget_directory(
+                data_folder_path + '/devices', recursive=False)
+        except DropboxNotFoundError:
+            return None
+
+        devices = []
+        for entry in device_entries:
+            if entry['.tag'] == 'file' and entry['name'].endswith('.ydevice'):
+                device = self._download_json(entry['path_lower'])
+                if device is not None and 'deviceGUID' in device:
+                    devices.append(device)
+
+        if not devices:
+            return None
+        device = max(devices, key=lambda device: (
+            bool(device.get('hasFullKnowledge')),
+            _knowledge_total(device.get('knowledgeInFullBudgetFile'))
+        ))
+
+        budget_file = self._get_metadata(
+            data_folder_path + '/' + device['deviceGUID'] + '/Budget.yfull')
+        if budget_file is None or budget_file['.tag'] != 'file':
+            return None
+
+        logger.debug("Resolved budget file at {path} from device {device}"
+                     .format(path=budget_file['path_lower'],
+                             device=device.get('shortDeviceId')))
+        return budget_file
+
+    def get_latest_cursor(self, budget_directory_path):
+        """Returns a cursor for the changes to the budget at
+        budget_directory_path from now on, without listing it, see
+        list_budget_directory_changes."""
+        data = {
+            'path': budget_directory_path,
+            'recursive': True,
+            'include_media_info': False,
+            'include_deleted': False
+        }
+        r = self.session.post(self.dropbox_endpoints['list_folder_get_latest_cursor'],
+                              data=json.dumps(data))
+        if r.status_code == requests.codes.ok:
+            try:
+                return r.json()['cursor']
+            except ValueError:
+                self.raise_exception(r, 'Could not parse budget cursor')
+        else:
+            self.raise_exception(r, 'Could not get budget cursor')
+
+    def _get_metadata(self, path):
+        """Returns the Dropbox metadata of the file or folder at path, or None
+        if there is none."""
+        r = self.session.post(self.dropbox_endpoints['get_metadata'],
+                              data=json.dumps({'path': path}))
+        if self._is_not_found(r):
+            logger.debug("No metadata for {path}".format(path=path))
+            return None
+        if r.status_code != requests.codes.ok:
+            self.raise_exception(r, 'Could not get file metadata')
+        try:
+            return r.json()
+        except ValueError:
+            return None
+
+    def _download_json(self, path):
+        """Returns the decoded contents of the small JSON file at path, or None
+        if it doesn't exist or isn't JSON."""
+        headers = {
+            'Dropbox-API-Arg': json.dumps({'path': path}),
+            'Content-Type': None
+        }
+        r = self.session.post(self.dropbox_endpoints['download'], headers=headers)
+        if self._is_not_found(r):
+            logger.debug("No file at {path}".format(path=path))
+            return None
+        if r.status_code != requests.codes.ok:
+            self.raise_exception(r, 'Could not download file')
+        r.encoding = 'utf-8'
+        try:
+            return json.loads(r.text)
+        except ValueError:
+            return None
+
+    def _download(self, budget_file, stream=False):
+        """Returns the response to a download of the file with the metadata
+        budget_file. If stream is True the body is read as it is iterated
+        over, see requests' Response.iter_content."""
         # The API call for downloading a file requires an empty or non-existent
         # Content-Type header. As it is set in the requests Session object,
         # clear it for this call.
         headers = {
-            'Dropbox-API-Arg': json.dumps({'path': newest_budget_file['id']}),
+            'Dropbox-API-Arg': json.dumps({'path': budget_file['id']}),
             'Content-Type': None
         }
 
         start = time.clock()
 
-        r = self.session.post(self.dropbox_endpoints['download'], headers=headers)
+        r = self.session.post(self.dropbox_endpoints['download'], headers=headers,
+                              stream=stream)
         # Flask uses chardet to determine the response's content's character
         # encoding if none was specified in the response headers. chardet is
         # extremely slow for long strings, and the YNAB budget can easily be
@@ -212,22 +631,150 @@ class Dropbox(object):
 
         end = time.clock()
         elapsed = end - start
-        budget_size = newest_budget_file['size']
-        logger.debug("Dropbox API call time elapsed: {time}s, {speed} KB/s".format(time=elapsed, speed=(budget_size // 1024 // elapsed)))
-
-        if r.status_code == requests.codes.ok:
-            start = time.clock()
-            budget_json = r.text
-            end = time.clock()
-            elapsed = end - start
-            logger.debug("Requests response.text access time elapsed: {time}s".format(time=elapsed))
-
-            start = time.clock()
-            budget_json.replace("\n", "")
-            end = time.clock()
-            elapsed = end - start
-            logger.debug("Remove budget newlines time elapsed: {time}s".format(time=elapsed))
-            return budget_json
-        else:
-            self.raise_exception(r, 'Could not get the budget file')
-
+        budget_size = budget_file['size']
+        # A streamed response returns as soon as the headers arrive, which can
+        # take no measurable processor time.
+        logger.debug("Dropbox API call time elapsed: {time}s, {speed} KB/s".format(time=elapsed, speed=(budget_size // 1024 // max(elapsed, 0.001))))
+
+        return r
+
+def _knowledge_total(knowledge):
+    """Returns the sum of the knowledge numbers of a YNAB knowledge string,
+    e.g. 8 for "A-5,B-3", which grows with every change a device knows of."""
+    total = 0
+    for version in (knowledge or '').split(','):
+        device, _, number = version.strip().rpartition('-')
+        if device and number.isdigit():
+            total += int(number)
+    return total
+
+class BudgetDirectoryView(object):
+    """In-memory view of the entries of a budget directory, kept up to date
+    with the changes since the previous refresh, see
+    Dropbox.list_budget_directory_changes. Listing a budget then costs as
+    much as the number of files that changed rather than the number of files
+    in it, which grows with every .ydiff a device syncs."""
+    def __init__(self, budget_directory_path):
+        self.path = budget_directory_path
+        self.cursor = None
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def seed(self, entries, cursor):
+        """Start the view from the given entries and the cursor of the
+        changes since they were current, instead of a full listing, e.g. from
+        a resolved Budget.yfull file, see Dropbox.newest_budget_file. Does
+        nothing if the view already has a cursor."""
+        with self._lock:
+            if self.cursor is None:
+                self._entries = {}
+                self._apply(entries)
+                self.cursor = cursor
+
+    def refresh(self, dropbox):
+        """Bring the view up to date using dropbox, a Dropbox, and return its
+        entries. The first refresh lists the directory in full, as does the
+        next one after Dropbox resets the cursor."""
+        with self._lock:
+            changes = None
+            if self.cursor is not None:
+                changes = dropbox.list_budget_directory_changes(self.cursor)
+
+            if changes is None:
+                entries, self.cursor = dropbox.list_budget_directory(self.path)
+                self._entries = {}
+            else:
+                entries, self.cursor = changes
+                logger.debug("Budget directory {path} has {count} changes"
+                             .format(path=self.path, count=len(entries)))
+            self._apply(entries)
+
+            return list(self._entries.values())
+
+    def _apply(self, entries):
+        for entry in entries:
+            path = entry['path_lower']
+            if entry['.tag'] == 'deleted':
+                self._entries.pop(path, None)
+                # A deleted folder takes its contents with it.
+                folder_prefix = path + '/'
+                for entry_path in [entry_path for entry_path in self._entries
+                                   if entry_path.startswith(folder_prefix)]:
+                    del self._entries[entry_path]
+            else:
+                self._entries[path] = entry
+
+class BudgetDirectoryWatcher(threading.Thread):
+    """Daemon thread that refreshes a budget's BudgetDirectoryView as soon as
+    the budget changes, waiting for changes with Dropbox.wait_for_changes.
+    on_change(budget_directory_path) is called after each refresh, e.g. to
+    download the new version of the budget into the cache before it is next
+    compared.
+
+    The watcher stops by itself once the access token has been rejected
+    max_auth_failures times in a row, or once it hasn't been touched for
+    idle_timeout seconds, see touch.
+    """
+    def __init__(self, dropbox, budget_directory_path, on_change=None,
+                 timeout=30, retry_delay=60, max_auth_failures=3,
+                 idle_timeout=6 * 60 * 60):
+        """dropbox is a Dropbox with directory_views, which the watched
+        directory's view is kept in."""
+        if dropbox.directory_views is None:
+            raise ValueError("Watching a budget requires directory views")
+        threading.Thread.__init__(
+            self, name="Watcher of {path}".format(path=budget_directory_path))
+        self.daemon = True
+        self.dropbox = dropbox
+        self.path = budget_directory_path
+        self.on_change = on_change
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        self.max_auth_failures = max_auth_failures
+        self.idle_timeout = idle_timeout
+        self.last_used = time.time()
+        self._stopped = threading.Event()
+
+    def touch(self):
+        """Mark the budget as used, postponing the idle timeout."""
+        self.last_used = time.time()
+
+    def stop(self):
+        """Stop watching once the current wait for changes ends."""
+        self._stopped.set()
+
+    def run(self):
+        view = self.dropbox.directory_views.setdefault(
+            self.path, BudgetDirectoryView(self.path))
+
+        auth_failures = 0
+        while not self._stopped.is_set():
+            if time.time() - self.last_used > self.idle_timeout:
+                logger.info("Stopped watching idle budget {path}"
+                            .format(path=self.path))
+                break
+            try:
+                if view.cursor is None:
+                    view.refresh(self.dropbox)
+                changes, backoff = self.dropbox.wait_for_changes(view.cursor,
+                                                                 self.timeout)
+                if changes and not self._stopped.is_set():
+                    view.refresh(self.dropbox)
+                    if self.on_change is not None:
+                        self.on_change(self.path)
+                auth_failures = 0
+                if backoff:
+                    self._stopped.wait(backoff)
+            except DropboxAuthError:
+                auth_failures += 1
+                if auth_failures >= self.max_auth_failures:
+                    logger.error("Stopped watching budget {path}, the access "
+                                 "token was rejected".format(path=self.path))
+                    break
+                self._stopped.wait(self.retry_delay)
+            except Exception:
+                logger.exception("Error watching budget {path}, retrying in "
+                                 "{delay}s".format(path=self.path,
+                                                   delay=self.retry_delay))
+                self._stopped.wait(self.retry_delay)
+        self._stopped.set()
@@ -0,0 +1,118 @@
+# -*- coding: utf8 -*-
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+# YNAB entity versions are a device's short ID and that device's knowledge
+# number at the time of the change, e.g. "A-64". Knowledge numbers only grow.
+_ENTITY_VERSION = re.compile(r'^([^-]+)-([0-9]+)$')
+
+def version_watermark(transactions):
+    """Return a dictionary of each device's short ID to the highest knowledge
+    number of the given transactions' entity versions."""
+    watermark = {}
+    for transaction in transactions:
+        version = _parse_entity_version(transaction.get("entityVersion"))
+        if version is not None and version[1] > watermark.get(version[0], -1):
+            watermark[version[0]] = version[1]
+    return watermark
+
+def _parse_entity_version(entity_version):
+    match = _ENTITY_VERSION.match(entity_version or "")
+    if match is None:
+        return None
+    return match.group(1), int(match.group(2))
+
+class ReconciliationState(object):
+    """What a successful comparison of two categories established: the pairs
+    of transactions, by entity ID, that matched each other, and each side's
+    version watermark at the time, see version_watermark.
+
+    A transaction whose entity version is at or below its side's watermark
+    hasn't been added or changed since. A matched pair of such transactions
+    is still matched, so the next comparison only has to examine the other
+    transactions: those added, changed or left unmatched since. A pair with a
+    changed or deleted transaction is dropped and its other transaction is
+    examined again.
+    """
+    def __init__(self, matched_pairs=(), this_watermark=None,
+                 other_watermark=None):
+        """matched_pairs is an iterable of (this_entity_id, other_entity_id)
+        tuples."""
+        self.matched_pairs = [tuple(pair) for pair in matched_pairs]
+        self.this_watermark = this_watermark or {}
+        self.other_watermark = other_watermark or {}
+
+    @classmethod
+    def from_json(cls, state_json):
+        return cls(state_json["matched_pairs"],
+                   state_json["this_watermark"],
+                   state_json["other_watermark"])
+
+    def to_json(self):
+        return {
+            "matched_pairs": [list(pair) for pair in self.matched_pairs],
+            "this_watermark": self.this_watermark,
+            "other_watermark": self.other_watermark
+        }
+
+    def unchanged_pairs(self, this_transactions, other_transactions):
+        """Return the matched pairs, as (this_transaction, other_transaction)
+        tuples, whose transactions are both still among the given ones and
+        haven't changed since the state was saved."""
+        this_unchanged = _unchanged_by_entity_id(this_transactions,
+                                                 self.this_watermark)
+        other_unchanged = _unchanged_by_entity_id(other_transactions,
+                                                  self.other_watermark)
+        return [(this_unchanged[this_id], other_unchanged[other_id])
+                for this_id, other_id in self.matched_pairs
+                if this_id in this_unchanged and other_id in other_unchanged]
+
+def _unchanged_by_entity_id(transactions, watermark):
+    unchanged = {}
+    for transaction in transactions:
+        version = _parse_entity_version(transaction.get("entityVersion"))
+        if (version is not None and "entityId" in transaction and
+                version[1] <= watermark.get(version[0], -1)):
+            unchanged[transaction["entityId"]] = transaction
+    return unchanged
+
+class ReconciliationStateStore(object):
+    """Keeps the ReconciliationState of each pair of categories as a JSON file
+    in a directory. Files are replaced atomically, so a concurrent or
+    interrupted comparison never leaves a partially written state behind."""
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, key):
+        """Return the path of the state file of key, a tuple of strings
+        identifying the pair of categories, e.g. both budgets' paths and
+        category names."""
+        digest = hashlib.sha1(json.dumps(list(key))).hexdigest()
+        return os.path.join(self.directory, digest + ".json")
+
+    def load(self, key):
+        """Return the saved state of key, or None if there is none."""
+        try:
+            with open(self.path(key)) as state_file:
+                return ReconciliationState.from_json(json.load(state_file))
+        except IOError:
+            return None
+
+    def save(self, key, state):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        state_file = tempfile.NamedTemporaryFile(dir=self.directory,
+                                                 suffix=".tmp", delete=False)
+        try:
+            with state_file:
+                json.dump(state.to_json(), state_file)
+                state_file.flush()
+                os.fsync(state_file.fileno())
+            os.rename(state_file.name, self.path(key))
+        except:
+            os.remove(state_file.name)
+            raise
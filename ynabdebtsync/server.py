@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+import os
+
 from flask import Flask
 
 flask_app = Flask('ynabdebtsync')
@@ -8,3 +10,26 @@ flask_app = Flask('ynabdebtsync')
 # logger records won't propagate up to flask's logger otherwise. See
 # http://stackoverflow.com/a/7294147.
 flask_app.logger
+
+# Directory where the matches found by each budget comparison are kept, so the
+# next comparison of the same categories only examines what changed since. See
+# ynabdebtsync.reconciliation. Comparisons start from scratch if unset.
+flask_app.config['RECONCILIATION_STATE_DIR'] = os.environ.get('RECONCILIATION_STATE_DIR')
+
+# Number of worker processes that parse the budgets of a comparison
+# concurrently, see ynabdebtsync.ynabbudget.parse_budgets. Budgets are parsed
+# on the request thread if unset.
+flask_app.config['PARSER_PROCESSES'] = int(os.environ.get('PARSER_PROCESSES') or 0)
+
+# Directory where downloaded budgets are kept, keyed by their file's revision,
+# so a budget that hasn't changed since it was last compared isn't downloaded
+# again. See ynabdebtsync.budgetcache. Budgets are always downloaded if unset.
+flask_app.config['BUDGET_CACHE_DIR'] = os.environ.get('BUDGET_CACHE_DIR')
+# Size, in megabytes, the budget cache is kept under.
+flask_app.config['BUDGET_CACHE_SIZE'] = int(os.environ.get('BUDGET_CACHE_SIZE') or 512)
+
+# Whether to watch the other budget of each comparison for changes, keeping
+# its directory listing up to date and downloading each new version into the
+# budget cache ahead of the next comparison. See
+# ynabdebtsync.dropbox.BudgetDirectoryWatcher.
+flask_app.config['WATCH_BUDGETS'] = bool(os.environ.get('WATCH_BUDGETS'))
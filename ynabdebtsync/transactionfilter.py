@@ -0,0 +1,195 @@
+# -*- coding: utf8 -*-
+
+import numbers
+import re
+
+from transactionstore import amount_milliunits, to_milliunits
+
+INFLOW = "inflow"
+OUTFLOW = "outflow"
+
+# How deleted transactions, i.e. those with isTombstone set, are treated.
+EXCLUDE_DELETED = "exclude"
+INCLUDE_DELETED = "include"
+ONLY_DELETED = "only"
+
+# yyyy[-mm[-dd]] dates accepted by the date range queries.
+_PARTIAL_DATE = re.compile(r'^[0-9]{4}(-[0-9]{2}(-[0-9]{2})?)?$')
+
+class TransactionFilter(object):
+    """Declarative description of the transactions to keep from a category,
+    e.g. for YnabBudget.transactions_by_category_name.
+
+    Every criterion is optional, a transaction is kept if it meets all the
+    given ones:
+        start_date, end_date: yyyy[-mm[-dd]] dates, both included. Looked up
+            in the budget's date index rather than checked per transaction.
+        min_amount, max_amount: amounts, both included.
+        sign: INFLOW for positive amounts, OUTFLOW for negative ones.
+        payee_ids, account_ids, cleared: collections of the payee IDs,
+            account IDs and cleared states, e.g. "Cleared", to keep.
+        memo_contains: case-insensitive substring of the memo.
+        deleted: EXCLUDE_DELETED, INCLUDE_DELETED or ONLY_DELETED.
+    """
+    fields = ("start_date", "end_date", "min_amount", "max_amount", "sign",
+              "payee_ids", "account_ids", "cleared", "memo_contains",
+              "deleted")
+
+    def __init__(self, start_date=None, end_date=None, min_amount=None,
+                 max_amount=None, sign=None, payee_ids=None, account_ids=None,
+                 cleared=None, memo_contains=None, deleted=EXCLUDE_DELETED):
+        if sign not in (None, INFLOW, OUTFLOW):
+            raise ValueError("Filter sign must be '{0}' or '{1}', not '{2}'"
+                             .format(INFLOW, OUTFLOW, sign))
+        if deleted not in (EXCLUDE_DELETED, INCLUDE_DELETED, ONLY_DELETED):
+            raise ValueError("Filter deleted must be '{0}', '{1}' or '{2}', "
+                             "not '{3}'".format(EXCLUDE_DELETED,
+                                                INCLUDE_DELETED, ONLY_DELETED,
+                                                deleted))
+
+        if not (memo_contains is None or
+                isinstance(memo_contains, basestring)):
+            raise ValueError("Filter memo_contains must be a string, not "
+                             "'{0}'".format(memo_contains))
+
+        self.start_date = _checked_date(start_date)
+        self.end_date = _checked_date(end_date)
+        self.min_amount = _checked_amount("min_amount", min_amount)
+        self.max_amount = _checked_amount("max_amount", max_amount)
+        self.sign = sign
+        self.payee_ids = _frozenset_or_none("payee_ids", payee_ids)
+        self.account_ids = _frozenset_or_none("account_ids", account_ids)
+        self.cleared = _frozenset_or_none("cleared", cleared)
+        self.memo_contains = memo_contains
+        self.deleted = deleted
+
+        self._predicate = None
+
+    @classmethod
+    def from_json(cls, filter_json):
+        """Build a filter from a dictionary, e.g. from an API request's JSON.
+        Raises a ValueError for unknown keys or invalid values."""
+        if not isinstance(filter_json, dict):
+            raise ValueError("Filter must be a JSON object")
+        unknown_fields = set(filter_json) - set(cls.fields)
+        if unknown_fields:
+            raise ValueError("Unknown filter fields: {0}".format(
+                ", ".join(sorted(unknown_fields))))
+        return cls(**dict((str(field), value)
+                          for field, value in filter_json.items()))
+
+    def to_json(self):
+        filter_json = {}
+        for field in self.fields:
+            value = getattr(self, field)
+            if isinstance(value, frozenset):
+                value = sorted(value)
+            if value is not None and value != EXCLUDE_DELETED:
+                filter_json[field] = value
+        return filter_json
+
+    def with_dates(self, start_date=None, end_date=None):
+        """Return a copy of the filter with its dates replaced by the given
+        ones, if they are not None."""
+        filter_json = self.to_json()
+        if start_date is not None:
+            filter_json["start_date"] = start_date
+        if end_date is not None:
+            filter_json["end_date"] = end_date
+        return TransactionFilter.from_json(filter_json)
+
+    def inverted(self):
+        """Return the filter for the other side of a debt, where inflows are
+        outflows and vice versa: the amount criteria are mirrored, the dates
+        and deletion are kept. The other criteria are dropped, as payee and
+        account IDs are specific to one budget, and the other side's cleared
+        states and memos needn't match this side's."""
+        inverted_filter = TransactionFilter(start_date=self.start_date,
+                                            end_date=self.end_date,
+                                            deleted=self.deleted)
+        if self.max_amount is not None:
+            inverted_filter.min_amount = -self.max_amount
+        if self.min_amount is not None:
+            inverted_filter.max_amount = -self.min_amount
+        inverted_filter.sign = {INFLOW: OUTFLOW, OUTFLOW: INFLOW}.get(self.sign)
+        return inverted_filter
+
+    def predicate(self):
+        """Return a function of a transaction that returns whether it meets the
+        filter's criteria, apart from dates and deletion, which are resolved
+        through the budget's indexes. Compiled once per filter.
+        """
+        if self._predicate is None:
+            self._predicate = self._compile()
+        return self._predicate
+
+    def _compile(self):
+        checks = []
+
+        if self.min_amount is not None:
+            min_milliunits = to_milliunits(self.min_amount)
+            checks.append(
+                lambda txn: amount_milliunits(txn) >= min_milliunits)
+        if self.max_amount is not None:
+            max_milliunits = to_milliunits(self.max_amount)
+            checks.append(
+                lambda txn: amount_milliunits(txn) <= max_milliunits)
+        if self.sign == INFLOW:
+            checks.append(lambda txn: txn["amount"] > 0)
+        elif self.sign == OUTFLOW:
+            checks.append(lambda txn: txn["amount"] < 0)
+        if self.payee_ids is not None:
+            payee_ids = self.payee_ids
+            checks.append(lambda txn: txn.get("payeeId") in payee_ids)
+        if self.account_ids is not None:
+            account_ids = self.account_ids
+            checks.append(lambda txn: txn.get("accountId") in account_ids)
+        if self.cleared is not None:
+            cleared = self.cleared
+            checks.append(lambda txn: txn.get("cleared") in cleared)
+        if self.memo_contains is not None:
+            memo_contains = self.memo_contains.lower()
+            checks.append(
+                lambda txn: memo_contains in (txn.get("memo") or "").lower())
+
+        if not checks:
+            return None
+
+        # Chain the checks into a single function, avoiding a list of results
+        # per transaction.
+        predicate = checks[0]
+        for check in checks[1:]:
+            predicate = _both(predicate, check)
+        return predicate
+
+def _both(first_check, second_check):
+    return lambda txn: first_check(txn) and second_check(txn)
+
+def _checked_date(date):
+    """Return date, or None if it is empty. Raises a ValueError if it isn't
+    in yyyy[-mm[-dd]] format."""
+    if not date:
+        return None
+    if not isinstance(date, basestring) or not _PARTIAL_DATE.match(date):
+        raise ValueError("Date '{0}' is not in yyyy[-mm[-dd]] format"
+                         .format(date))
+    return date
+
+def _checked_amount(field, amount):
+    # bool is a numbers.Number too, but true isn't an amount.
+    if amount is not None and (isinstance(amount, bool) or
+                               not isinstance(amount, numbers.Number)):
+        raise ValueError("Filter {0} must be a number, not '{1}'"
+                         .format(field, amount))
+    return amount
+
+def _frozenset_or_none(field, values):
+    if values is None:
+        return None
+    if isinstance(values, basestring):
+        values = [values]
+    if (not isinstance(values, (list, tuple, set, frozenset)) or
+            not all(isinstance(value, basestring) for value in values)):
+        raise ValueError("Filter {0} must be a string or a list of strings, "
+                         "not '{1}'".format(field, values))
+    return frozenset(values)
@@ -0,0 +1,441 @@
+# -*- coding: utf8 -*-
+
+import collections
+import datetime
+import re
+import uuid
+from array import array
+from decimal import Decimal, ROUND_HALF_UP
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Flag bits of CompactTransactionStore._flags.
+_TOMBSTONE = 1
+_ACCEPTED = 2
+_HAS_ACCEPTED = 4
+
+# Fields stored in their own column. Any other field of a transaction is kept
+# in CompactTransactionStore._extra_fields.
+_SYMBOL_FIELDS = ("categoryId", "payeeId", "accountId", "cleared",
+                  "entityType", "memo")
+_COLUMN_FIELDS = frozenset(_SYMBOL_FIELDS + (
+    "amount", "date", "entityId", "entityVersion", "accepted",
+    "isTombstone", "subTransactions"))
+
+# Entity versions are a device's short ID followed by that device's version
+# counter, e.g. "A-118".
+_ENTITY_VERSION = re.compile(r'^(.+)-([0-9]{1,18})$')
+
+def to_milliunits(amount):
+    """Return a budget amount, e.g. 12.34, as an integer number of thousandths
+    of the currency unit, e.g. 12340. Decimal amounts are converted exactly,
+    without going through a float."""
+    if isinstance(amount, Decimal):
+        return int((amount * 1000).to_integral_value(rounding=ROUND_HALF_UP))
+    return int(round(amount * 1000))
+
+def from_milliunits(milliunits, fixed_point=False):
+    """Inverse of to_milliunits. Whole amounts are returned as ints, the rest
+    as floats, which is what json.loads returns for the budget's amounts. If
+    fixed_point is True, amounts are returned as Decimals."""
+    if fixed_point:
+        return Decimal(milliunits) / 1000
+    if milliunits % 1000 == 0:
+        return milliunits // 1000
+    return milliunits / 1000.0
+
+def amount_milliunits(transaction):
+    """Return a transaction's amount as integer milliunits. For a
+    TransactionRow the amount is read straight from the store's column."""
+    if isinstance(transaction, TransactionRow):
+        return transaction.milliunits
+    return to_milliunits(transaction["amount"])
+
+def date_to_ordinal(date):
+    """Return the proleptic Gregorian ordinal of a yyyy-mm-dd date string."""
+    return datetime.date(int(date[0:4]), int(date[5:7]),
+                         int(date[8:10])).toordinal()
+
+def ordinal_to_date(ordinal):
+    return datetime.date.fromordinal(ordinal).isoformat()
+
+class CompactTransactionStore(object):
+    """Column-oriented store of a budget's transactions.
+
+    Transactions are flattened, each subtransaction being stored as its own
+    row after its parent, with the date, memo and payee it inherits from it.
+    The parents' subTransactions lists themselves aren't kept.
+    Amounts are stored as integer milliunits and dates as ordinals in arrays,
+    and the IDs and other strings that repeat across transactions are
+    interned into a symbol table, so a budget takes a fraction of the memory
+    of the dictionaries returned by json.loads. Rows are read back through
+    TransactionRow views, which have the same fields as the original
+    transactions.
+    """
+    def __init__(self, transactions, fixed_point=False):
+        """If fixed_point is True, amounts are read back as Decimals instead
+        of ints and floats, see from_milliunits. Use it with transactions
+        whose amounts were parsed as Decimals, so that they never go through
+        a float."""
+        self.fixed_point = fixed_point
+        self._symbols = []
+        self._symbol_codes = {}
+
+        self.amounts = array("l")
+        self.dates = array("l")
+        self._symbol_columns = dict((field, array("l"))
+                                    for field in _SYMBOL_FIELDS)
+        self._flags = array("B")
+        # Entity IDs are GUIDs, stored as 16 bytes each.
+        self._entity_ids = bytearray()
+        self._entity_version_devices = array("l")
+        self._entity_version_numbers = array("l")
+        # Row number to a dictionary of the fields that don't have a column,
+        # or whose value can't be stored in its column without losing
+        # information.
+        self._extra_fields = {}
+
+        for transaction in transactions:
+            self._add_row(transaction)
+            for subtransaction in transaction.get("subTransactions") or []:
+                self._add_row(subtransaction, transaction)
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Rebuilt from _symbols when unpickling.
+        del state["_symbol_codes"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._symbol_codes = dict((symbol, code)
+                                  for code, symbol in enumerate(self._symbols))
+
+    def row(self, row_number):
+        return TransactionRow(self, row_number)
+
+    def is_tombstone(self, row_number):
+        return bool(self._flags[row_number] & _TOMBSTONE)
+
+    def symbol(self, field, row_number):
+        """Return the value of a symbol column, e.g. "categoryId", for a row,
+        or None if the row doesn't have the field."""
+        code = self._symbol_columns[field][row_number]
+        if code == -1:
+            return None
+        return self._symbols[code]
+
+    def index_by_category(self, deleted=False):
+        """Return a dictionary of category IDs to a RowList of the
+        non-deleted transactions assigned to them, or of the deleted ones if
+        deleted is True, in a single pass over the store.
+        """
+        rows_by_category_code = {}
+        category_codes = self._symbol_columns["categoryId"]
+        flags = self._flags
+        for row_number in range(len(self)):
+            if bool(flags[row_number] & _TOMBSTONE) == deleted:
+                rows_by_category_code.setdefault(
+                    category_codes[row_number], array("l")).append(row_number)
+
+        return dict((self._symbols[code] if code != -1 else None,
+                     RowList(self, row_numbers))
+                    for code, row_numbers in rows_by_category_code.items())
+
+    def totals(self, use_numpy=None):
+        """Return the total amounts, in milliunits, of the non-deleted rows as
+        three dictionaries: category ID to total, category ID to a dictionary
+        of yyyy-mm month to total, and category ID to a dictionary of payee ID
+        to total. If use_numpy is None, NumPy is used if it is installed.
+        """
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        if use_numpy:
+            return self._numpy_totals()
+
+        by_category = {}
+        by_month = {}
+        by_payee = {}
+        month_by_ordinal = {}
+        symbols = self._symbols
+        category_codes = self._symbol_columns["categoryId"]
+        payee_codes = self._symbol_columns["payeeId"]
+        for row_number in range(len(self)):
+            if self._flags[row_number] & _TOMBSTONE:
+                continue
+            category_code = category_codes[row_number]
+            category_id = symbols[category_code] if category_code != -1 else None
+            payee_code = payee_codes[row_number]
+            payee_id = symbols[payee_code] if payee_code != -1 else None
+            ordinal = self.dates[row_number]
+            if ordinal not in month_by_ordinal:
+                month_by_ordinal[ordinal] = self._month(ordinal)
+            month = month_by_ordinal[ordinal]
+            amount = self.amounts[row_number]
+
+            by_category[category_id] = by_category.get(category_id, 0) + amount
+            category_months = by_month.setdefault(category_id, {})
+            category_months[month] = category_months.get(month, 0) + amount
+            category_payees = by_payee.setdefault(category_id, {})
+            category_payees[payee_id] = category_payees.get(payee_id, 0) + amount
+
+        return by_category, by_month, by_payee
+
+    def _numpy_totals(self):
+        """NumPy implementation of totals(). Amounts are summed as 64-bit
+        integers, so the totals are as exact as in the pure Python version."""
+        live = (numpy.frombuffer(self._flags, dtype=numpy.uint8)
+                & _TOMBSTONE) == 0
+        amounts = _numpy_column(self.amounts)[live]
+        # Symbol codes are shifted by one so missing values, -1, become 0.
+        category_codes = _numpy_column(self._symbol_columns["categoryId"])[live] + 1
+        payee_codes = _numpy_column(self._symbol_columns["payeeId"])[live] + 1
+        # Dates are mapped to months through the distinct dates, which are
+        # far fewer than the rows.
+        distinct_ordinals, date_codes = numpy.unique(
+            _numpy_column(self.dates)[live], return_inverse=True)
+        distinct_months = list(set(self._month(ordinal)
+                                   for ordinal in distinct_ordinals.tolist()))
+        month_codes = dict((month, code)
+                           for code, month in enumerate(distinct_months))
+        month_codes_by_date_code = numpy.array(
+            [month_codes[self._month(ordinal)]
+             for ordinal in distinct_ordinals.tolist()], dtype=numpy.int64)
+        row_month_codes = month_codes_by_date_code[date_codes]
+
+        symbols = [None] + self._symbols
+
+        by_category = {}
+        for category_code, total in _numpy_grouped_sums(category_codes, amounts):
+            by_category[symbols[category_code]] = total
+
+        by_month = {}
+        for key, total in _numpy_grouped_sums(
+                category_codes * len(distinct_months) + row_month_codes, amounts):
+            category_code, month_code = divmod(key, len(distinct_months))
+            by_month.setdefault(symbols[category_code], {})[
+                distinct_months[month_code]] = total
+
+        by_payee = {}
+        for key, total in _numpy_grouped_sums(
+                category_codes * len(symbols) + payee_codes, amounts):
+            category_code, payee_code = divmod(key, len(symbols))
+            by_payee.setdefault(symbols[category_code], {})[
+                symbols[payee_code]] = total
+
+        return by_category, by_month, by_payee
+
+    def _month(self, ordinal):
+        if ordinal == 0:
+            # Dates that aren't in yyyy-mm-dd format.
+            return None
+        return ordinal_to_date(ordinal)[:7]
+
+    def fields(self, row_number):
+        """Return the names of the fields a row has."""
+        fields = [field for field in _SYMBOL_FIELDS
+                  if self._symbol_columns[field][row_number] != -1]
+        fields.extend(("amount", "date", "entityId"))
+        if self._entity_version_devices[row_number] != -1:
+            fields.append("entityVersion")
+        flags = self._flags[row_number]
+        if flags & _HAS_ACCEPTED:
+            fields.append("accepted")
+        if flags & _TOMBSTONE:
+            fields.append("isTombstone")
+        extra_fields = self._extra_fields.get(row_number)
+        if extra_fields is not None:
+            fields.extend(field for field in extra_fields
+                          if field not in fields)
+        return fields
+
+    def value(self, row_number, field):
+        """Return the value of a row's field. Raises a KeyError if the row
+        doesn't have the field."""
+        extra_fields = self._extra_fields.get(row_number)
+        if extra_fields is not None and field in extra_fields:
+            return extra_fields[field]
+
+        if field == "amount":
+            return from_milliunits(self.amounts[row_number], self.fixed_point)
+        if field == "date":
+            return ordinal_to_date(self.dates[row_number])
+        if field in self._symbol_columns:
+            value = self.symbol(field, row_number)
+            if value is not None:
+                return value
+        elif field == "entityId":
+            return str(uuid.UUID(bytes=bytes(
+                self._entity_ids[row_number * 16:row_number * 16 + 16]))).upper()
+        elif field == "entityVersion":
+            device_code = self._entity_version_devices[row_number]
+            if device_code != -1:
+                return "{0}-{1}".format(
+                    self._symbols[device_code],
+                    self._entity_version_numbers[row_number])
+        elif field == "accepted":
+            if self._flags[row_number] & _HAS_ACCEPTED:
+                return bool(self._flags[row_number] & _ACCEPTED)
+        elif field == "isTombstone":
+            if self._flags[row_number] & _TOMBSTONE:
+                return True
+        raise KeyError(field)
+
+    def _intern(self, value):
+        if value is None:
+            return -1
+        code = self._symbol_codes.get(value)
+        if code is None:
+            code = len(self._symbols)
+            self._symbols.append(value)
+            self._symbol_codes[value] = code
+        return code
+
+    def _add_row(self, transaction, parent=None):
+        row_number = len(self.amounts)
+        extra_fields = dict((field, value)
+                            for field, value in transaction.items()
+                            if field not in _COLUMN_FIELDS)
+
+        amount = transaction["amount"]
+        milliunits = to_milliunits(amount)
+        if from_milliunits(milliunits, self.fixed_point) != amount:
+            extra_fields["amount"] = amount
+        self.amounts.append(milliunits)
+
+        # Subtransactions inherit their parent's date, payee and, if they
+        # don't have their own, memo.
+        fields = transaction
+        if parent is not None:
+            fields = dict(transaction)
+            fields["date"] = parent.get("date")
+            if "memo" not in transaction and "memo" in parent:
+                fields["memo"] = parent["memo"]
+            if "payeeId" in parent:
+                fields["payeeId"] = parent["payeeId"]
+
+        date = fields.get("date")
+        try:
+            ordinal = date_to_ordinal(date)
+            if ordinal_to_date(ordinal) != date:
+                raise ValueError(date)
+        except (TypeError, ValueError):
+            ordinal = 0
+            extra_fields["date"] = date
+        self.dates.append(ordinal)
+
+        for field in _SYMBOL_FIELDS:
+            value = fields.get(field)
+            # A missing field is stored as None, keep explicit nulls apart.
+            if value is None and field in fields:
+                extra_fields[field] = None
+            self._symbol_columns[field].append(self._intern(value))
+
+        entity_version = transaction.get("entityVersion")
+        match = None
+        if entity_version is not None:
+            match = _ENTITY_VERSION.match(entity_version)
+        if (match is not None and
+                "{0}-{1}".format(match.group(1), int(match.group(2))) ==
+                entity_version):
+            self._entity_version_devices.append(self._intern(match.group(1)))
+            self._entity_version_numbers.append(int(match.group(2)))
+        else:
+            if "entityVersion" in transaction:
+                extra_fields["entityVersion"] = entity_version
+            self._entity_version_devices.append(-1)
+            self._entity_version_numbers.append(0)
+
+        flags = 0
+        if transaction.get("isTombstone", False):
+            flags |= _TOMBSTONE
+        elif "isTombstone" in transaction:
+            extra_fields["isTombstone"] = transaction["isTombstone"]
+        if "accepted" in transaction:
+            flags |= _HAS_ACCEPTED
+            if transaction["accepted"]:
+                flags |= _ACCEPTED
+        self._flags.append(flags)
+
+        entity_id = transaction["entityId"]
+        try:
+            entity_id_bytes = uuid.UUID(entity_id).bytes
+            if str(uuid.UUID(bytes=entity_id_bytes)).upper() != entity_id:
+                raise ValueError(entity_id)
+        except ValueError:
+            # Not an uppercase GUID, e.g. "Payee/Transfer:<GUID>".
+            entity_id_bytes = b"\0" * 16
+            extra_fields["entityId"] = entity_id
+        self._entity_ids.extend(entity_id_bytes)
+
+        if extra_fields:
+            self._extra_fields[row_number] = extra_fields
+
+def _numpy_column(column):
+    return numpy.frombuffer(column, dtype="i{0}".format(column.itemsize))
+
+def _numpy_grouped_sums(keys, amounts):
+    """Return a list of (key, sum of the amounts with that key) pairs."""
+    if len(keys) == 0:
+        return []
+    order = numpy.argsort(keys, kind="mergesort")
+    sorted_keys = keys[order]
+    group_starts = numpy.concatenate(
+        ([0], numpy.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1))
+    sums = numpy.add.reduceat(amounts[order].astype(numpy.int64), group_starts)
+    return zip(sorted_keys[group_starts].tolist(), sums.tolist())
+
+class RowList(collections.Sequence):
+    """Sequence of TransactionRow views over a list of row numbers of a
+    CompactTransactionStore."""
+    __slots__ = ("_store", "_row_numbers")
+
+    def __init__(self, store, row_numbers):
+        self._store = store
+        self._row_numbers = row_numbers
+
+    def __len__(self):
+        return len(self._row_numbers)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return RowList(self._store, self._row_numbers[index])
+        return TransactionRow(self._store, self._row_numbers[index])
+
+    def __iter__(self):
+        store = self._store
+        for row_number in self._row_numbers:
+            yield TransactionRow(store, row_number)
+
+class TransactionRow(collections.Mapping):
+    """Read-only view of a row of a CompactTransactionStore, with the same
+    fields as the transaction it was built from. Use dict(row) to get a
+    dictionary, e.g. to serialise it as JSON."""
+    __slots__ = ("_store", "_row_number")
+
+    def __init__(self, store, row_number):
+        self._store = store
+        self._row_number = row_number
+
+    def __getitem__(self, field):
+        return self._store.value(self._row_number, field)
+
+    @property
+    def milliunits(self):
+        """The row's amount in integer milliunits, see to_milliunits."""
+        return self._store.amounts[self._row_number]
+
+    def __iter__(self):
+        return iter(self._store.fields(self._row_number))
+
+    def __len__(self):
+        return len(self._store.fields(self._row_number))
+
+    def __repr__(self):
+        return "TransactionRow({0!r})".format(dict(self))
@@ -0,0 +1,313 @@
+# -*- coding: utf8 -*-
+
+import json
+import re
+
+# A run of a skipped section's text up to its next bracket outside a string:
+# anything but quotes and brackets, and whole strings. Matched in bulk, so only
+# brackets are looked at one by one.
+_SKIPPED_RUN = re.compile(r'(?:[^"\[\]{}]+|"[^"\\]*(?:\\.[^"\\]*)*")*')
+# The remainder of a JSON string, after its opening quote.
+_STRING_REST = re.compile(r'(?:[^"\\]|\\.)*"', re.DOTALL)
+# The end of a top-level number, true, false or null.
+_SCALAR_END = re.compile(r'[\s,}]')
+_WHITESPACE = re.compile(r'\s*')
+
+# Parser states.
+_EXPECT_OBJECT = 0
+_EXPECT_KEY = 1
+_EXPECT_COLON = 2
+_EXPECT_VALUE = 3
+_IN_VALUE = 4
+_EXPECT_COMMA = 5
+_DONE = 6
+
+def parse_sections(budget_json, sections, parse_float=None):
+    """Return a dictionary of the given top-level sections of a Budget.yfull
+    file's contents. The other sections are skipped without being decoded.
+    parse_float is passed to json.loads, e.g. decimal.Decimal. Raises a
+    ValueError if the JSON is malformed.
+    """
+    parser = YfullSectionParser(sections, parse_float)
+    parser.feed(budget_json)
+    return parser.close()
+
+class YfullSectionParser(object):
+    """Incremental parser for the top-level sections of a Budget.yfull file,
+    e.g. "masterCategories" or "transactions".
+
+    The file's contents are passed in, in as many chunks as needed, to feed().
+    Wanted sections are decoded in a single pass by the json module's
+    decoder, straight from the buffered text. Sections that aren't wanted are
+    only scanned for their closing bracket, no Python objects are built for
+    them and their text isn't kept around.
+
+    Wanted arrays, e.g. "transactions", are decoded an item at a time, so the
+    text of the items decoded so far is dropped as the file is fed and an item
+    split across chunks only costs decoding that item again. Any other wanted
+    section split across chunks can't be told apart from a malformed one until
+    it is complete, so decoding it is retried each time the buffered text has
+    doubled since the last attempt, the failed attempts adding up to at most
+    about twice the work of the successful one.
+    """
+    def __init__(self, sections=None, parse_float=None):
+        """sections is an iterable of the top-level keys to keep. If None, all
+        sections are kept. parse_float is passed to json.loads when decoding
+        the kept sections, e.g. decimal.Decimal to read amounts exactly."""
+        self.sections = frozenset(sections) if sections is not None else None
+        self.parse_float = parse_float
+        self.data = {}
+
+        self._decoder = json.JSONDecoder(parse_float=parse_float)
+        self._state = _EXPECT_OBJECT
+        self._buffer = ""
+        self._position = 0
+        # Chunks fed while waiting for more of a kept section, see feed.
+        self._chunks = []
+        self._chunks_size = 0
+        # Buffered length at which decoding the kept section is next tried.
+        self._next_attempt = 0
+        self._closing = False
+        # The section being scanned.
+        self._key = None
+        self._keep = False
+        self._value_start = 0
+        self._value_kind = None
+        self._depth = 0
+        # The items decoded so far of a kept array section.
+        self._items = None
+        self._separator_expected = False
+
+    def feed(self, text):
+        """Parse the next chunk of the file. Return a list of the (key, value)
+        sections that were completed by this chunk and kept.
+        """
+        self._chunks.append(text)
+        self._chunks_size += len(text)
+        if len(self._buffer) + self._chunks_size < self._next_attempt:
+            return []
+
+        return self._parse_buffered()
+
+    def close(self):
+        """Signal the end of the file. Return the dictionary of kept sections.
+        Raises a ValueError if the file ended before the top-level object did.
+        """
+        self._closing = True
+        self._parse_buffered()
+        if self._state != _DONE:
+            raise ValueError("Budget JSON ended unexpectedly")
+        return self.data
+
+    def _parse_buffered(self):
+        if len(self._chunks) == 1 and not self._buffer:
+            # Avoid copying the whole file when it is fed in one go.
+            self._buffer = self._chunks[0]
+        elif self._chunks:
+            self._buffer = "".join([self._buffer] + self._chunks)
+        if self._chunks:
+            self._chunks = []
+            self._chunks_size = 0
+
+        completed_sections = []
+        while self._step(completed_sections):
+            pass
+        self._compact_buffer()
+
+        return completed_sections
+
+    def _step(self, completed_sections):
+        """Advance the parser as far as the buffered text allows within the
+        current state. Return False when more text is needed."""
+        buffer_ = self._buffer
+        position = _WHITESPACE.match(buffer_, self._position).end()
+
+        if self._state == _IN_VALUE:
+            # Whitespace inside a section is significant for strings.
+            position = self._position
+        elif position == len(buffer_):
+            self._position = position
+            return False
+
+        if self._state == _EXPECT_OBJECT:
+            self._expect(buffer_, position, "{")
+            self._position = position + 1
+            self._state = _EXPECT_KEY
+
+        elif self._state == _EXPECT_KEY:
+            if buffer_[position] == "}" and self._key is None:
+                self._position = position + 1
+                self._state = _DONE
+                return True
+            self._expect(buffer_, position, '"')
+            match = _STRING_REST.match(buffer_, position + 1)
+            if match is None:
+                self._position = position
+                return False
+            self._key = json.loads(buffer_[position:match.end()])
+            self._keep = self.sections is None or self._key in self.sections
+            self._position = match.end()
+            self._state = _EXPECT_COLON
+
+        elif self._state == _EXPECT_COLON:
+            self._expect(buffer_, position, ":")
+            self._position = position + 1
+            self._state = _EXPECT_VALUE
+
+        elif self._state == _EXPECT_VALUE:
+            self._value_start = position
+            self._value_kind = buffer_[position]
+            self._depth = 0
+            self._position = position
+            self._state = _IN_VALUE
+
+        elif self._state == _IN_VALUE:
+            if not self._keep:
+                end = self._scan_value(buffer_)
+                if end is None:
+                    return False
+            else:
+                decoded = self._decode_value(buffer_)
+                if decoded is None:
+                    return False
+                value, end = decoded
+                self.data[self._key] = value
+                completed_sections.append((self._key, value))
+            self._next_attempt = 0
+            self._position = end
+            self._state = _EXPECT_COMMA
+
+        elif self._state == _EXPECT_COMMA:
+            if buffer_[position] == "}":
+                self._state = _DONE
+            else:
+                self._expect(buffer_, position, ",")
+                self._state = _EXPECT_KEY
+            self._position = position + 1
+
+        elif self._state == _DONE:
+            raise ValueError("Extra data after the budget JSON at position "
+                             "{0}".format(position))
+
+        return True
+
+    def _decode_value(self, buffer_):
+        """Decode the current, kept, section. Return its value and the
+        position right after its end, or None if the section continues past
+        the buffered text."""
+        if self._value_kind not in '{["':
+            # A number at the end of the buffer may be cut short, so the end
+            # of the scalar is found first.
+            end = self._scan_value(buffer_)
+            if end is None:
+                return None
+            return self._decoder.decode(buffer_[self._value_start:end]), end
+
+        if self._value_kind == "[":
+            return self._decode_array(buffer_)
+
+        try:
+            return self._decoder.raw_decode(buffer_, self._value_start)
+        except ValueError:
+            if self._closing:
+                raise
+            self._next_attempt = 2 * len(buffer_) - self._value_start
+            return None
+
+    def _decode_array(self, buffer_):
+        """Decode the items of the current, kept, array section from
+        self._position. Return the array and the position right after its
+        end, or None if the array continues past the buffered text, in which
+        case self._position is left after the last decoded item."""
+        if self._items is None:
+            self._items = []
+            self._separator_expected = False
+            self._position = self._value_start + 1
+        items = self._items
+        position = self._position
+
+        while True:
+            position = _WHITESPACE.match(buffer_, position).end()
+            if position == len(buffer_):
+                break
+            character = buffer_[position]
+            if character == "]" and (self._separator_expected or not items):
+                self._items = None
+                return items, position + 1
+            if self._separator_expected:
+                self._expect(buffer_, position, ",")
+                self._separator_expected = False
+                position += 1
+                continue
+
+            try:
+                item, end = self._decoder.raw_decode(buffer_, position)
+            except ValueError:
+                if self._closing:
+                    raise
+                break
+            if end == len(buffer_) and not self._closing:
+                # A number at the end of the buffer may be cut short.
+                break
+            items.append(item)
+            self._separator_expected = True
+            position = end
+
+        self._position = position
+        return None
+
+    def _scan_value(self, buffer_):
+        """Scan the current section from self._position. Return the position
+        right after its end, or None if the section continues past the
+        buffered text, in which case self._position is left at a point the scan
+        can be resumed from."""
+        position = self._position
+
+        if self._value_kind not in '{["':
+            match = _SCALAR_END.search(buffer_, position)
+            if match is None:
+                self._position = len(buffer_)
+                return None
+            return match.start()
+
+        if self._value_kind == '"':
+            # Leave self._position at the opening quote, so the whole string
+            # is rescanned once more text arrives.
+            match = _STRING_REST.match(buffer_, self._value_start + 1)
+            if match is None:
+                return None
+            return match.end()
+
+        while True:
+            position = _SKIPPED_RUN.match(buffer_, position).end()
+            if position == len(buffer_) or buffer_[position] == '"':
+                # Out of text, possibly in the middle of a string, which is
+                # then scanned again from its opening quote.
+                self._position = position
+                return None
+            character = buffer_[position]
+            position += 1
+            if character in "[{":
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    return position
+
+    def _compact_buffer(self):
+        """Drop the text that has already been parsed, keeping the whole text
+        of a kept section that isn't complete yet, but for the items of an
+        array that were already decoded."""
+        start = self._position
+        if (self._state == _IN_VALUE and self._keep and
+                self._value_kind != "["):
+            start = self._value_start
+        self._next_attempt = max(self._next_attempt - start, 0)
+        self._value_start -= min(self._value_start, start)
+        self._buffer = self._buffer[start:]
+        self._position -= start
+
+    def _expect(self, buffer_, position, expected):
+        if buffer_[position] != expected:
+            raise ValueError("Expecting '{0}' at position {1} of the budget "
+                             "JSON".format(expected, position))
@@ -1,24 +1,143 @@
 # -*- coding: utf8 -*-
 
+import collections
 import json
-import re
+import multiprocessing
+import time
+from decimal import Decimal
+from bisect import bisect_left, bisect_right
+
+from reconciliation import ReconciliationState, version_watermark
+from transactionfilter import (TransactionFilter, EXCLUDE_DELETED,
+                               INCLUDE_DELETED, ONLY_DELETED, _checked_date)
+from transactionstore import (CompactTransactionStore, amount_milliunits,
+                              date_to_ordinal, from_milliunits, to_milliunits)
+from yfull import parse_sections
+
+# The Budget.yfull sections needed to compare budgets.
+COMPARISON_SECTIONS = ("masterCategories", "payees", "transactions")
+
+# Total amounts of a budget's categories, see YnabBudget.category_totals.
+CategoryTotals = collections.namedtuple("CategoryTotals",
+                                        ["by_category", "by_month", "by_payee"])
+
+# Digests of a category's transactions, see YnabBudget.category_digests.
+CategoryDigests = collections.namedtuple("CategoryDigests",
+                                         ["by_year", "by_month"])
+
+# When two categories' balances stopped agreeing, see
+# YnabBudgetComparer.divergence.
+Divergence = collections.namedtuple("Divergence",
+                                    ["last_agreement_date", "diverged_date",
+                                     "gap"])
+
+# Sides of the transactions yielded by
+# YnabBudgetComparer.iter_missing_transactions: missing from this category,
+# i.e. the other category's transactions, or missing from the other category.
+THIS_MISSING = "this_missing"
+OTHER_MISSING = "other_missing"
+
+# Result of comparing two categories, see YnabBudgetComparer.compare.
+Comparison = collections.namedtuple("Comparison",
+                                    ["this_missing", "other_missing",
+                                     "near_matches", "decided_by", "timings"])
+
+# Result of comparing a pair of categories, see BatchBudgetComparer.
+CategoryPairComparison = collections.namedtuple(
+    "CategoryPairComparison",
+    ["this_missing", "other_missing", "this_total", "other_total"])
+
+# Sorts after every character of a yyyy-mm-dd date, so date + _DATE_RANGE_END
+# sorts after every date that starts with date.
+_DATE_RANGE_END = "~"
 
 class YnabBudget(object):
-    """YNAB budget reading."""
-    def __init__(self, budget_json):
-        """budget_json is the Budget.yfull file's contents."""
+    """YNAB budget reading. Queries never modify the parsed budget, so an
+    instance can be shared between threads."""
+    def __init__(self, budget_json, sections=None, compact=False,
+                 fixed_point=False):
+        """budget_json is the Budget.yfull file's contents. If sections is
+        given, only those top-level sections of the budget are loaded into
+        self.data, e.g. COMPARISON_SECTIONS. The rest are skipped without being
+        decoded, which keeps memory usage down for large budgets.
+
+        If compact is True the budget's transactions are moved out of
+        self.data into self.transaction_store, a CompactTransactionStore, and
+        transaction queries return TransactionRow views instead of
+        dictionaries.
+
+        If fixed_point is True, the budget's non-integer numbers are parsed
+        straight into Decimals, never going through a float, and its
+        transactions are kept in a compact store, so compact is implied.
+        Amounts are then held as integer milliunits, which comparisons and
+        totals work on exactly, and are read back as Decimals.
+        """
         if budget_json is None:
             raise ValueError("Budget JSON is None")
         if budget_json == "":
             raise ValueError("Budget JSON is empty")
 
+        self.fixed_point = fixed_point
+        parse_float = Decimal if fixed_point else None
+
         try:
-            self.data = json.loads(budget_json)
+            if sections is None:
+                self.data = json.loads(budget_json, parse_float=parse_float)
+            else:
+                self.data = parse_sections(budget_json, sections, parse_float)
         except ValueError as e:
             raise YnabBudgetMalformedError("Budget JSON is malformed",
                                            inner_message=e,
                                            budget_json=budget_json)
 
+        self._load(compact)
+
+    @classmethod
+    def from_data(cls, data, compact=False, fixed_point=False):
+        """Build a budget from its already decoded top-level sections, e.g.
+        those Dropbox.get_budget parsed while downloading the file. If
+        fixed_point is True the sections' amounts must have been decoded as
+        Decimals, see __init__."""
+        budget = cls.__new__(cls)
+        budget.fixed_point = fixed_point
+        budget.data = data
+        budget._load(compact)
+        return budget
+
+    def _load(self, compact):
+        self.transaction_store = None
+        if compact or self.fixed_point:
+            self.transaction_store = CompactTransactionStore(
+                self.data.pop("transactions"), self.fixed_point)
+
+        # Lookup structures derived from self.data, built lazily on first use.
+        # See _index.
+        self._indexes = {}
+
+    def build_indexes(self):
+        """Build the indexes that comparisons rely on now rather than on
+        first use, e.g. before sending the budget to another process."""
+        self._category_index()
+        self._category_transactions_index()
+        self._category_milliunit_totals()
+
+    def _index(self, name, source, build):
+        """Return the index called name, calling build(source) to construct it
+        the first time it is needed. The index is rebuilt if source is no
+        longer the object it was built from, e.g. if self.data["transactions"]
+        has been replaced.
+        """
+        cached = self._indexes.get(name)
+        if cached is None or cached[0] is not source:
+            cached = (source, build(source))
+            self._indexes[name] = cached
+        return cached[1]
+
+    def _category_index(self):
+        return self._index("categories",
+                           self.data["masterCategories"],
+                           _CategoryIndex)
+
     def master_categories_to_subcategories(self):
         """Return a dictionary keyed by the budget's master categories. Each
         master category's value is a dictionary of the subcategory names to
@@ -36,94 +155,273 @@ class YnabBudget(object):
 
     def category_id_from_name(self, name):
         """Return the category ID for a given category name, case-insensitive.
-        Throws a LookupError if there is no category with the given name.
-        """
-        for master_category in self.data["masterCategories"]:
-            for sub_category in master_category["subCategories"]:
-                if sub_category["name"].lower() == name.lower():
-                    return sub_category["entityId"]
+        The name can also be given as a "master/sub" path to pick a
+        subcategory whose name is shared by several master categories.
 
-        raise LookupError("No category with name '{0}' exists in the budget"
-                          .format(name))
+        Deleted categories are only considered if no live category has the
+        given name. Throws a YnabBudgetAmbiguousCategoryError if the name
+        matches more than one category, and a LookupError if there is no
+        category with the given name.
+        """
+        category_index = self._category_index()
+
+        candidates = category_index.ids_by_name.get(name.lower())
+        if candidates is None:
+            # Subcategory names can contain "/" themselves, e.g.
+            # "Rent/Mortgage", so only try the name as a path if it didn't
+            # match a subcategory name.
+            candidates = category_index.ids_by_path(name)
+        if not candidates:
+            raise LookupError("No category with name '{0}' exists in the budget"
+                              .format(name))
+
+        return category_index.resolve(name, candidates)
+
+    def category_name_from_id(self, category_id):
+        """Return the subcategory name for a given category ID. Throws a
+        LookupError if there is no category with the given ID.
+        """
+        try:
+            return self._category_index().names_by_id[category_id][1]
+        except KeyError:
+            raise LookupError("No category with ID '{0}' exists in the budget"
+                              .format(category_id))
 
     def transactions_by_category_name(self, name, filters=None):
         """Return a list of transactions that are assigned to the given
         category name.
+
+        filters is either a TransactionFilter, in which case the transactions
+        are returned sorted by date, or a list of functions of a transaction
+        that return whether to keep it.
         """
         category_id = self.category_id_from_name(name)
 
+        if isinstance(filters, TransactionFilter):
+            return self._filtered_transactions(category_id, filters)
         return self._transactions_from_category_id(category_id, filters=filters)
 
-    def _transactions_from_category_id(self,
-                                        category_id,
-                                        transactions_to_check=None,
-                                        filters=None):
-        """Constructs a list of transactions assigned to the given category ID.
-        Subtransactions are also taken into account, by passing a transaction's
-        subtransactions in recursive calls via the transactions_to_check
-        argument.
+    def _filtered_transactions(self, category_id, transaction_filter):
+        """Apply a TransactionFilter to a category's transactions, using the
+        date indexes for the date range and deleted transactions."""
+        transactions = []
+        for deleted in (False, True):
+            if transaction_filter.deleted == (EXCLUDE_DELETED if deleted
+                                              else ONLY_DELETED):
+                continue
+            dates, _, date_transactions = self._category_date_index(category_id,
+                                                                    deleted)
+            start, end = _date_range_bounds(dates,
+                                            transaction_filter.start_date,
+                                            transaction_filter.end_date)
+            transactions.extend(date_transactions[start:end])
+
+        if transaction_filter.deleted == INCLUDE_DELETED:
+            transactions.sort(key=lambda transaction: transaction["date"])
+
+        predicate = transaction_filter.predicate()
+        if predicate is None:
+            return transactions
+        return [transaction for transaction in transactions
+                if predicate(transaction)]
+
+    def _transactions_from_category_id(self, category_id, filters=None):
+        """Constructs a list of transactions assigned to the given category ID,
+        including subtransactions, from the per-category transaction index.
         """
-        transactions_to_add = []
-
-        # Base case, start with the budget's transactions.
-        if transactions_to_check is None:
-            transactions_to_check = self.data["transactions"]
-
-        for transaction in transactions_to_check:
-            if (transaction["categoryId"] == category_id and
-                    # isTombstone == True means the transaction has been deleted.
-                    ("isTombstone" not in transaction or
-                        transaction["isTombstone"] == False)):
-                if filters is None:
-                    transactions_to_add.append(transaction)
-                elif all([filter_(transaction) for filter_ in filters]):
-                    transactions_to_add.append(transaction)
-            # Recursive case, check subtransactions. Extend transactions_to_add
-            # with the list of subtransactions assigned to the given category,
-            # if any.
-            if "subTransactions" in transaction:
-                # Subtransactions don't have their own date, add the parent
-                # transaction's date.
-                for subtransaction in transaction["subTransactions"]:
-                    subtransaction["date"] = transaction["date"]
-                    # If the subtransaction already has a memo leave it as is.
-                    if "memo" not in subtransaction and "memo" in transaction:
-                        subtransaction["memo"] = transaction["memo"]
-                    # Subtransactions don't have the payee ID, hoist it down to
-                    # be able to display the payee for the subtransaction.
-                    # Not all transactions have a payeeId.
-                    if "payeeId" in transaction:
-                        subtransaction["payeeId"] = transaction["payeeId"]
-                transactions_to_add.extend(
-                    self._transactions_from_category_id(
-                        category_id,
-                        transaction["subTransactions"],
-                        filters
-                    )
-                )
-
-        # Turn into a generator so the results from this method can be iterated
-        # over, allowing filtering by e.g. date in log(N) vs log(2N) time
-        return transactions_to_add
+        transactions = self._category_transactions_index().get(category_id, [])
+
+        if filters is None:
+            # Callers are free to sort the list they get back, don't hand out
+            # the index's own list.
+            return list(transactions)
+
+        return [transaction for transaction in transactions
+                if all(filter_(transaction) for filter_ in filters)]
+
+    def _category_transactions_index(self):
+        if self.transaction_store is not None:
+            return self._index("category_transactions",
+                               self.transaction_store,
+                               CompactTransactionStore.index_by_category)
+        return self._index("category_transactions",
+                           self.data["transactions"],
+                           _index_transactions_by_category)
+
+    def _deleted_category_transactions_index(self):
+        """Like _category_transactions_index, for deleted transactions."""
+        if self.transaction_store is not None:
+            return self._index(
+                "deleted_category_transactions",
+                self.transaction_store,
+                lambda transaction_store:
+                    transaction_store.index_by_category(deleted=True))
+        return self._index(
+            "deleted_category_transactions",
+            self.data["transactions"],
+            lambda transactions:
+                _index_transactions_by_category(transactions, deleted=True))
 
     def filter_category_transactions_by_date(self, category_name, date):
         """Retrieves transactions from a category that match a given date string, in
         yyyy[-mm[-dd]] format. The month and day are optional, so it is possible to
         filter by year; year and month; or year, month and date."""
-        filters = []
-        date_filter = lambda txn: re.match(date, txn["date"]) is not None
-        filters.append(date_filter)
+        category_id = self.category_id_from_name(category_name)
+        dates, positions, transactions = self._category_date_index(category_id)
+        start, end = _date_range_bounds(dates, date, date)
+
+        # Keep the order of transactions_by_category_name.
+        return [transaction for position, transaction in
+                sorted(zip(positions[start:end], transactions[start:end]),
+                       key=lambda position_transaction: position_transaction[0])]
+
+    def transactions_between(self, category_name, start_date=None, end_date=None):
+        """Return the transactions of a category from start_date to end_date,
+        both included, sorted by date. Dates are in yyyy[-mm[-dd]] format, a
+        year or month start date means the beginning of that year or month,
+        and a year or month end date means the end of it. Either date can be
+        None to leave that end of the range open.
+        """
+        category_id = self.category_id_from_name(category_name)
+        dates, positions, transactions = self._category_date_index(category_id)
+        start, end = _date_range_bounds(dates, start_date, end_date)
+
+        return transactions[start:end]
+
+    def transactions_since(self, category_name, start_date):
+        """Return the transactions of a category from start_date onwards,
+        sorted by date. See transactions_between."""
+        return self.transactions_between(category_name, start_date=start_date)
+
+    def transactions_until(self, category_name, end_date):
+        """Return the transactions of a category up to end_date, sorted by
+        date. See transactions_between."""
+        return self.transactions_between(category_name, end_date=end_date)
+
+    def _category_date_index(self, category_id, deleted=False):
+        """Return a category's transactions sorted by date, along with their
+        dates and their positions in the category's transaction list, for
+        bisecting by date. Built the first time each category is queried. If
+        deleted is True, the category's deleted transactions are used."""
+        if deleted:
+            category_transactions_index = self._deleted_category_transactions_index()
+        else:
+            category_transactions_index = self._category_transactions_index()
+        date_indexes = self._index("deleted_category_dates" if deleted
+                                   else "category_dates",
+                                   category_transactions_index,
+                                   lambda category_transactions_index: {})
+
+        date_index = date_indexes.get(category_id)
+        if date_index is None:
+            positions_transactions = sorted(
+                enumerate(category_transactions_index.get(category_id, [])),
+                key=lambda position_transaction: position_transaction[1]["date"])
+            date_index = (
+                [transaction["date"] for _, transaction in positions_transactions],
+                [position for position, _ in positions_transactions],
+                [transaction for _, transaction in positions_transactions]
+            )
+            date_indexes[category_id] = date_index
 
-        return self.transactions_by_category_name(category_name, filters)
+        return date_index
 
-    def calculate_category_total(self, category_name):
-        transactions = self.transactions_by_category_name(category_name)
+    def category_digests(self, category_name, sign=1):
+        """Return a CategoryDigests of a category's transactions. by_year maps
+        yyyy years, and by_month yyyy-mm months, to a digest of the multiset
+        of amounts of that period's transactions: their count and the sum of
+        a hash of each amount, modulo 2**64. Two periods with the same
+        amounts, in whatever order, have the same digest, and periods with
+        different amounts almost certainly don't.
 
-        running_total = 0
-        for transaction in transactions:
-            running_total += transaction["amount"]
+        If sign is -1 the digests are of the inverse amounts, so that a debt
+        category's digests can be compared with the other person's.
+        Built the first time each category is queried.
+        """
+        category_id = self.category_id_from_name(category_name)
+        category_transactions_index = self._category_transactions_index()
+        digest_indexes = self._index("category_digests",
+                                     category_transactions_index,
+                                     lambda category_transactions_index: {})
+
+        digests = digest_indexes.get((category_id, sign))
+        if digests is None:
+            digests = _transactions_digests(
+                category_transactions_index.get(category_id, []), sign)
+            digest_indexes[(category_id, sign)] = digests
+
+        return digests
+
+    def category_balances(self, category_name, sign=1):
+        """Return a category's running balance: the sorted list of the dates
+        of its transactions, and the list of the category's balance at the end
+        of each of those dates, in milliunits. If sign is -1 the balances are
+        of the inverse amounts, see category_digests. Built the first time
+        each category is queried, in a single pass over its date index.
+        """
+        category_id = self.category_id_from_name(category_name)
+        balance_indexes = self._index("category_balances",
+                                      self._category_transactions_index(),
+                                      lambda category_transactions_index: {})
+
+        balances = balance_indexes.get((category_id, sign))
+        if balances is None:
+            dates = []
+            running_balances = []
+            balance = 0
+            for transaction in self._category_date_index(category_id)[2]:
+                balance += sign * amount_milliunits(transaction)
+                if dates and dates[-1] == transaction["date"]:
+                    running_balances[-1] = balance
+                else:
+                    dates.append(transaction["date"])
+                    running_balances.append(balance)
+            balances = (dates, running_balances)
+            balance_indexes[(category_id, sign)] = balances
+
+        return balances
 
-        return running_total
+    def calculate_category_total(self, category_name):
+        category_id = self.category_id_from_name(category_name)
+
+        return from_milliunits(
+            self._category_milliunit_totals()[0].get(category_id, 0),
+            self.fixed_point)
+
+    def category_totals(self, use_numpy=None):
+        """Return a CategoryTotals with the total amount of every category's
+        transactions. by_category maps category IDs to their total, by_month
+        maps category IDs to a dictionary of yyyy-mm months to totals, and
+        by_payee maps category IDs to a dictionary of payee IDs to totals.
+
+        All totals are computed in a single pass over the budget's
+        transactions and summed as integer milliunits, so they are exact. For
+        compact budgets the sums are done with NumPy if use_numpy is True, or
+        if it is None and NumPy is installed. Totals are Decimals for fixed
+        point budgets.
+        """
+        by_category, by_month, by_payee = self._category_milliunit_totals(use_numpy)
+
+        return CategoryTotals(
+            dict((category_id, from_milliunits(total, self.fixed_point))
+                 for category_id, total in by_category.items()),
+            dict((category_id, _from_milliunit_totals(month_totals,
+                                                      self.fixed_point))
+                 for category_id, month_totals in by_month.items()),
+            dict((category_id, _from_milliunit_totals(payee_totals,
+                                                      self.fixed_point))
+                 for category_id, payee_totals in by_payee.items())
+        )
+
+    def _category_milliunit_totals(self, use_numpy=None):
+        if self.transaction_store is not None:
+            return self._index(
+                "category_totals",
+                self.transaction_store,
+                lambda transaction_store: transaction_store.totals(use_numpy))
+        return self._index("category_totals",
+                           self._category_transactions_index(),
+                           _category_transactions_totals)
 
     def payee_ids_to_names(self):
         ids_to_names = {}
@@ -134,6 +432,446 @@ class YnabBudget(object):
             ids_to_names[payee_id] = payee_name
         return ids_to_names
 
+class SubTransactionView(dict):
+    """Read-only copy of a subtransaction, completed with the fields it
+    inherits from its parent transaction. The budget's data is never modified,
+    so a parsed YnabBudget can be shared between threads.
+    """
+    __slots__ = ()
+
+    def __init__(self, subtransaction, parent=None):
+        dict.__init__(self, subtransaction)
+        if parent is None:
+            return
+
+        # Subtransactions don't have their own date, add the parent
+        # transaction's date.
+        dict.__setitem__(self, "date", parent["date"])
+        # If the subtransaction already has a memo leave it as is.
+        if "memo" not in subtransaction and "memo" in parent:
+            dict.__setitem__(self, "memo", parent["memo"])
+        # Subtransactions don't have the payee ID, hoist it down to be able to
+        # display the payee for the subtransaction. Not all transactions have
+        # a payeeId.
+        if "payeeId" in parent:
+            dict.__setitem__(self, "payeeId", parent["payeeId"])
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("'{0}' object is read-only"
+                        .format(type(self).__name__))
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return (SubTransactionView, (dict(self),))
+
+def _category_transactions_totals(category_transactions_index):
+    """Return the milliunit totals of a category to transactions index, in
+    the format of CompactTransactionStore.totals."""
+    by_category = {}
+    by_month = {}
+    by_payee = {}
+
+    for category_id, transactions in category_transactions_index.items():
+        category_total = 0
+        month_totals = by_month[category_id] = {}
+        payee_totals = by_payee[category_id] = {}
+        for transaction in transactions:
+            amount = to_milliunits(transaction["amount"])
+            month = transaction["date"][:7]
+            payee_id = transaction.get("payeeId")
+            category_total += amount
+            month_totals[month] = month_totals.get(month, 0) + amount
+            payee_totals[payee_id] = payee_totals.get(payee_id, 0) + amount
+        by_category[category_id] = category_total
+
+    return by_category, by_month, by_payee
+
+def _from_milliunit_totals(totals, fixed_point=False):
+    return dict((key, from_milliunits(total, fixed_point))
+                for key, total in totals.items())
+
+def _transactions_digests(transactions, sign):
+    """Return the CategoryDigests of transactions, see
+    YnabBudget.category_digests."""
+    by_year = {}
+    by_month = {}
+    for transaction in transactions:
+        amount_hash = _amount_hash(sign * amount_milliunits(transaction))
+        date = transaction["date"]
+        for digests, period in ((by_year, date[:4]), (by_month, date[:7])):
+            count, hash_sum = digests.get(period, (0, 0))
+            digests[period] = (count + 1, (hash_sum + amount_hash) & _MASK_64)
+    return CategoryDigests(by_year, by_month)
+
+_MASK_64 = 2 ** 64 - 1
+
+def _amount_hash(milliunits):
+    """Mix the bits of an amount, so that sums of hashes of different
+    multisets of amounts rarely collide (SplitMix64's finaliser)."""
+    z = (milliunits + 0x9E3779B97F4A7C15) & _MASK_64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK_64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK_64
+    return z ^ (z >> 31)
+
+def _period_overlaps_range(period, start_date, end_date):
+    """Return whether any date of a yyyy or yyyy-mm period is within the
+    range of dates, see YnabBudget.transactions_between."""
+    return ((start_date is None or period + _DATE_RANGE_END >= start_date) and
+            (end_date is None or period <= end_date + _DATE_RANGE_END))
+
+def _period_within_range(period, start_date, end_date):
+    """Return whether every date of a yyyy or yyyy-mm period is within the
+    range of dates."""
+    return ((start_date is None or start_date <= period) and
+            (end_date is None or
+             period + _DATE_RANGE_END <= end_date + _DATE_RANGE_END))
+
+def _narrowed_range(period, start_date, end_date):
+    """Return the start and end dates of the part of a yyyy or yyyy-mm period
+    that is within the range of dates, for YnabBudget.transactions_between.
+    The range is empty if they don't overlap."""
+    if start_date is not None:
+        # A longer date within the period starts later, e.g. 2015-04-15 is
+        # after 2015-04, and a shorter one starts no later than the period.
+        start_date = max(period, start_date)
+    else:
+        start_date = period
+    if end_date is None or period + _DATE_RANGE_END <= end_date + _DATE_RANGE_END:
+        end_date = period
+    return start_date, end_date
+
+def _date_range_bounds(dates, start_date, end_date):
+    """Return the slice bounds of the sorted list of dates that fall between
+    start_date and end_date, see YnabBudget.transactions_between."""
+    for date in (start_date, end_date):
+        _checked_date(date)
+
+    start = 0
+    if start_date is not None:
+        start = bisect_left(dates, start_date)
+    end = len(dates)
+    if end_date is not None:
+        end = bisect_right(dates, end_date + _DATE_RANGE_END)
+
+    return start, end
+
+def _index_transactions_by_category(transactions, index=None, deleted=False):
+    """Return a dictionary of category IDs to the list of non-deleted
+    transactions assigned to them, or of the deleted ones if deleted is True,
+    built in a single pass over the budget's transactions. Split transactions
+    are flattened, each subtransaction is added as a SubTransactionView to its
+    own category's list, right after its parent would be.
+    """
+    if index is None:
+        index = {}
+
+    for transaction in transactions:
+        # isTombstone == True means the transaction has been deleted.
+        if bool(transaction.get("isTombstone", False)) == deleted:
+            index.setdefault(transaction.get("categoryId"), []).append(transaction)
+        if "subTransactions" in transaction:
+            _index_transactions_by_category(
+                [SubTransactionView(subtransaction, transaction)
+                 for subtransaction in transaction["subTransactions"]],
+                index,
+                deleted
+            )
+
+    return index
+
+class _CategoryIndex(object):
+    """Case-insensitive lookups between subcategory names and IDs, built in a
+    single pass over the budget's master categories.
+    """
+    def __init__(self, master_categories):
+        # Lowercased subcategory name to a list of (ID, is live) candidates.
+        self.ids_by_name = {}
+        # (lowercased master name, lowercased subcategory name) to a list of
+        # (ID, is live) candidates.
+        self._ids_by_path = {}
+        # Subcategory ID to its (master name, subcategory name).
+        self.names_by_id = {}
+
+        for master_category in master_categories:
+            master_is_live = not master_category.get("isTombstone", False)
+            for sub_category in master_category["subCategories"] or []:
+                candidate = (sub_category["entityId"],
+                             master_is_live and
+                             not sub_category.get("isTombstone", False))
+                self.ids_by_name.setdefault(
+                    sub_category["name"].lower(), []).append(candidate)
+                self._ids_by_path.setdefault(
+                    (master_category["name"].lower(),
+                     sub_category["name"].lower()), []).append(candidate)
+                self.names_by_id[sub_category["entityId"]] = (
+                    master_category["name"], sub_category["name"])
+
+    def ids_by_path(self, path):
+        """Return the candidates for a "master/sub" path. Master category names
+        can contain "/" too, so every split point is tried.
+        """
+        lowercased_path = path.lower()
+        candidates = []
+        separator = lowercased_path.find("/")
+        while separator != -1:
+            candidates.extend(self._ids_by_path.get(
+                (lowercased_path[:separator], lowercased_path[separator + 1:]),
+                []))
+            separator = lowercased_path.find("/", separator + 1)
+        return candidates
+
+    def resolve(self, name, candidates):
+        """Pick the single category ID out of candidates, preferring live
+        categories over deleted ones.
+        """
+        live_ids = [category_id for category_id, is_live in candidates
+                    if is_live]
+        if len(live_ids) == 1:
+            return live_ids[0]
+        if not live_ids and len(candidates) == 1:
+            return candidates[0][0]
+
+        matches = live_ids or [category_id for category_id, _ in candidates]
+        raise YnabBudgetAmbiguousCategoryError(
+            "Category name '{0}' is ambiguous, it matches {1}. Use a "
+            "'master/sub' path instead".format(
+                name,
+                ", ".join("'{0}/{1}'".format(*self.names_by_id[category_id])
+                          for category_id in matches)),
+            category_ids=matches)
+
+def _group_by_amount(transactions, sign=1):
+    """Return a dictionary of amounts, in integer milliunits, to the list of
+    transactions of that amount. If sign is -1 the transactions are keyed by
+    their inverse amount."""
+    groups = {}
+    for transaction in transactions:
+        groups.setdefault(sign * amount_milliunits(transaction), []).append(transaction)
+    return groups
+
+def _unmatched_transactions(superset_transactions, subset_transactions):
+    """Return the transactions of superset_transactions that have no
+    counterpart in subset_transactions, see _match_transactions."""
+    return _match_transactions(superset_transactions, subset_transactions)[0]
+
+def _match_transactions(superset_transactions, subset_transactions):
+    """Match superset_transactions with subset_transactions, both being
+    transactions of the same amount (or its inverse), with the superset
+    having at least as many of them. Return the list of superset
+    transactions that have no counterpart, and the list of
+    (superset_transaction, subset_transaction) matched pairs.
+
+    Every subset transaction is paired with a superset transaction so that the
+    total number of days between paired transactions is as small as possible,
+    and the superset transactions left over are the missing ones. Between
+    equally close pairings, the one pairing the most transactions with the
+    same memo wins. This picks the right candidates even when one budget
+    entered a transaction a day or two later than the other, e.g. for a
+    recurring rent payment.
+
+    On a line, an optimal pairing never crosses over, so with both lists
+    sorted by date it can be found with dynamic programming over how many
+    subset transactions have been paired and how many superset transactions
+    have been skipped so far. The number of skips is bounded by the number of
+    missing transactions, so this takes O(len(subset) * number missing) time
+    rather than a general O(n^3) assignment.
+    """
+    superset_transactions = sorted(superset_transactions,
+                                   key=lambda txn: txn["date"])
+    subset_transactions = sorted(subset_transactions,
+                                 key=lambda txn: txn["date"])
+    missing_count = len(superset_transactions) - len(subset_transactions)
+    if not subset_transactions:
+        return superset_transactions, []
+    if missing_count == 0:
+        return [], zip(superset_transactions, subset_transactions)
+
+    superset_ordinals = [date_to_ordinal(txn["date"])
+                         for txn in superset_transactions]
+    subset_ordinals = [date_to_ordinal(txn["date"])
+                       for txn in subset_transactions]
+    superset_memos = [_normalised_memo(txn) for txn in superset_transactions]
+    subset_memos = [_normalised_memo(txn) for txn in subset_transactions]
+    # Days are weighted so that no number of memo mismatches outweighs a day.
+    day_cost = len(subset_transactions) + 1
+
+    # costs[skips] is the lowest cost of pairing the first `paired` subset
+    # transactions using the first `paired + skips` superset transactions.
+    # skipped[paired][skips] records whether that pairing skips superset
+    # transaction `paired + skips`, or pairs it with subset transaction
+    # `paired`.
+    costs = [0] * (missing_count + 1)
+    skipped = [bytearray([1]) * (missing_count + 1)]
+    for paired in range(1, len(subset_transactions) + 1):
+        subset_ordinal = subset_ordinals[paired - 1]
+        subset_memo = subset_memos[paired - 1]
+        paired_skipped = bytearray(missing_count + 1)
+        for skips in range(missing_count + 1):
+            superset_index = paired + skips - 1
+            pair_cost = (costs[skips] +
+                         day_cost * abs(superset_ordinals[superset_index] -
+                                        subset_ordinal) +
+                         (superset_memos[superset_index] != subset_memo))
+            # costs[skips - 1] has already been updated for this row.
+            if skips > 0 and costs[skips - 1] <= pair_cost:
+                costs[skips] = costs[skips - 1]
+                paired_skipped[skips] = 1
+            else:
+                costs[skips] = pair_cost
+        skipped.append(paired_skipped)
+
+    missing_transactions = []
+    matched_pairs = []
+    paired = len(subset_transactions)
+    skips = missing_count
+    while skips > 0:
+        if skipped[paired][skips]:
+            missing_transactions.append(superset_transactions[paired + skips - 1])
+            skips -= 1
+        else:
+            matched_pairs.append((superset_transactions[paired + skips - 1],
+                                  subset_transactions[paired - 1]))
+            paired -= 1
+    missing_transactions.reverse()
+    matched_pairs.extend(zip(superset_transactions[:paired],
+                             subset_transactions[:paired]))
+
+    return missing_transactions, matched_pairs
+
+def _normalised_memo(transaction):
+    return (transaction.get("memo") or "").strip().lower()
+
+def _missing_transactions(this_groups, other_groups, matched_pairs=None):
+    """Return the transactions missing from each side, given both sides'
+    transactions grouped by amount, the other side's keyed by their inverse
+    amount. See YnabBudgetComparer.get_missing_transactions.
+
+    If matched_pairs is a list, the (this_transaction, other_transaction)
+    pairs that matched are appended to it. Otherwise groups of the same size
+    aren't matched at all."""
+    missing_transactions = {THIS_MISSING: [], OTHER_MISSING: []}
+    for side, transaction in _iter_missing_transactions(this_groups,
+                                                        other_groups,
+                                                        matched_pairs):
+        missing_transactions[side].append(transaction)
+    return missing_transactions[THIS_MISSING], missing_transactions[OTHER_MISSING]
+
+def _iter_missing_transactions(this_groups, other_groups, matched_pairs=None):
+    """Generator version of _missing_transactions, yielding (side,
+    transaction) tuples, see YnabBudgetComparer.iter_missing_transactions,
+    as each amount group is matched."""
+    for amount in sorted(set(this_groups) | set(other_groups)):
+        this_group = this_groups.get(amount, [])
+        other_group = other_groups.get(amount, [])
+        if len(this_group) >= len(other_group):
+            if len(this_group) == len(other_group) and matched_pairs is None:
+                continue
+            missing, pairs = _match_transactions(this_group, other_group)
+            side = OTHER_MISSING
+        else:
+            missing, pairs = _match_transactions(other_group, this_group)
+            side = THIS_MISSING
+            pairs = [(this_txn, other_txn) for other_txn, this_txn in pairs]
+        if matched_pairs is not None:
+            matched_pairs.extend(pairs)
+        for transaction in missing:
+            yield side, transaction
+
+def _near_matches(this_transactions, other_transactions, absolute_tolerance,
+                  relative_tolerance):
+    """Pair this_transactions with other_transactions whose inverse amounts
+    are within the tolerance, absolute_tolerance being in milliunits. Return
+    the unpaired transactions of each side, in their original order, and the
+    list of (this_transaction, other_transaction) pairs.
+
+    Both sides are sorted by amount, the other side's inverted, and walked
+    together: the smaller of the two current amounts is paired with the other
+    if they are within the tolerance, otherwise it can't be paired with any
+    later, larger, amount either and is skipped. This pairs as many
+    transactions as possible.
+    """
+    this_sorted = sorted(
+        (amount_milliunits(txn), position)
+        for position, txn in enumerate(this_transactions))
+    other_sorted = sorted(
+        (-amount_milliunits(txn), position)
+        for position, txn in enumerate(other_transactions))
+
+    near_matches = []
+    this_paired = set()
+    other_paired = set()
+    this_index = other_index = 0
+    while this_index < len(this_sorted) and other_index < len(other_sorted):
+        this_amount, this_position = this_sorted[this_index]
+        other_amount, other_position = other_sorted[other_index]
+        tolerance = max(absolute_tolerance,
+                        relative_tolerance * max(abs(this_amount),
+                                                 abs(other_amount)))
+        if abs(this_amount - other_amount) <= tolerance:
+            near_matches.append((this_transactions[this_position],
+                                 other_transactions[other_position]))
+            this_paired.add(this_position)
+            other_paired.add(other_position)
+            this_index += 1
+            other_index += 1
+        elif this_amount < other_amount:
+            this_index += 1
+        else:
+            other_index += 1
+
+    return ([txn for position, txn in enumerate(this_transactions)
+             if position not in this_paired],
+            [txn for position, txn in enumerate(other_transactions)
+             if position not in other_paired],
+            near_matches)
+
+def _category_transactions(budget, category_name, transaction_filter,
+                           start_date, end_date):
+    if transaction_filter is None:
+        return budget.transactions_between(category_name, start_date, end_date)
+    return budget.transactions_by_category_name(
+        category_name, transaction_filter.with_dates(start_date, end_date))
+
+def _budget(budget, sections, fixed_point=False):
+    if isinstance(budget, YnabBudget):
+        return budget
+    return YnabBudget(budget, sections, fixed_point=fixed_point)
+
+def parse_budgets(budget_jsons, sections=COMPARISON_SECTIONS, fixed_point=False,
+                  pool=None):
+    """Parse several budgets concurrently, each in its own process. Return
+    the list of YnabBudgets, in the same order as budget_jsons, with their
+    indexes built, see YnabBudget.build_indexes.
+
+    Budgets are parsed compact, see YnabBudget, so only the compact store,
+    its indexes and the small master category and payee sections are sent
+    back from the worker processes, never the dictionaries json.loads built.
+    pool is a multiprocessing.Pool to parse in, e.g. one created once at
+    start-up. If None, a pool of a process per budget is created for the
+    call.
+    """
+    jobs = [(budget_json, sections, fixed_point) for budget_json in budget_jsons]
+    if not jobs:
+        return []
+    if pool is not None:
+        return pool.map(_parse_budget, jobs)
+
+    pool = multiprocessing.Pool(len(jobs))
+    try:
+        return pool.map(_parse_budget, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+def _parse_budget(job):
+    budget_json, sections, fixed_point = job
+    budget = YnabBudget(budget_json, sections, compact=True,
+                        fixed_point=fixed_point)
+    budget.build_indexes()
+    return budget
+
 class YnabBudgetMalformedError(Exception):
     """Exception raised when the YNAB budget JSON is malformed."""
     def __init__(self, message, inner_message="", budget_json=""):
@@ -142,354 +880,628 @@ class YnabBudgetMalformedError(Exception):
         self.inner_message = inner_message
         self.budget_json = budget_json
 
-class YnabBudgetComparerValueError(ValueError):
-    """Raise this when there are no missing transactions."""
+class YnabBudgetAmbiguousCategoryError(LookupError):
+    """Exception raised when a category name matches more than one category."""
+    def __init__(self, message, category_ids=()):
+        super(YnabBudgetAmbiguousCategoryError, self).__init__(message)
+        self.message = message
+        self.category_ids = category_ids
 
 class YnabBudgetComparer(object):
-    def __init__(self, this_budget_json, this_category_name, other_budget_json, other_category_name):
-        self.this_budget = YnabBudget(this_budget_json)
+    def __init__(self, this_budget_json, this_category_name, other_budget_json, other_category_name,
+                 budget_sections=COMPARISON_SECTIONS, fixed_point=False,
+                 parallel=False, pool=None):
+        """budget_sections are the Budget.yfull sections loaded from each
+        budget, see YnabBudget. None loads the whole budget. If fixed_point
+        is True, both budgets are loaded in fixed point mode, see YnabBudget.
+        Either budget may also be an already parsed YnabBudget, which is used
+        as is, so that its indexes are shared with other comparers.
+
+        If parallel is True, or a multiprocessing.Pool is given, both budgets
+        are parsed and indexed concurrently in other processes, see
+        parse_budgets. Their transactions are then TransactionRows.
+        """
+        if ((parallel or pool is not None) and
+                not isinstance(this_budget_json, YnabBudget) and
+                not isinstance(other_budget_json, YnabBudget)):
+            this_budget_json, other_budget_json = parse_budgets(
+                [this_budget_json, other_budget_json], budget_sections,
+                fixed_point, pool)
+        self.this_budget = _budget(this_budget_json, budget_sections, fixed_point)
         self.this_category_name = this_category_name
-        self.other_budget = YnabBudget(other_budget_json)
+        self.other_budget = _budget(other_budget_json, budget_sections, fixed_point)
         self.other_category_name = other_category_name
         self.start_date = None
+        self.end_date = None
+        self.this_filter = None
+        self.other_filter = None
+        self.reconciliation_state = None
+        self.absolute_tolerance = 0
+        self.relative_tolerance = 0
+        # Cached by _balance_differences.
+        self._balance_differences_cache = None
 
     def set_start_date(self, start_date):
-        self.start_date = start_date
+        """Only compare transactions from start_date onwards. start_date is in
+        yyyy[-mm[-dd]] format, see YnabBudget.transactions_between. An empty
+        start date compares all transactions. Raises a ValueError if
+        start_date is malformed."""
+        self.start_date = _checked_date(start_date)
+
+    def set_end_date(self, end_date):
+        """Only compare transactions up to end_date, see set_start_date."""
+        self.end_date = _checked_date(end_date)
+
+    def set_filter(self, this_filter, other_filter=None):
+        """Only compare the transactions that meet the given TransactionFilters.
+        If other_filter is None, this_filter's amount criteria are mirrored for
+        the other budget, see TransactionFilter.inverted. Dates set with
+        set_start_date and set_end_date take precedence over the filters'."""
+        if other_filter is None and this_filter is not None:
+            other_filter = this_filter.inverted()
+        self.this_filter = this_filter
+        self.other_filter = other_filter
+
+    def set_tolerance(self, absolute_tolerance=0, relative_tolerance=0):
+        """Report transactions whose amounts nearly match as near matches
+        rather than as missing, e.g. shared expenses entered in a different
+        currency or split unevenly. Amounts nearly match if they differ by at
+        most absolute_tolerance, e.g. 0.05, or by at most relative_tolerance
+        times the larger amount, e.g. 0.01 for 1%. See compare."""
+        if absolute_tolerance < 0 or relative_tolerance < 0:
+            raise ValueError("Tolerances must not be negative")
+        self.absolute_tolerance = absolute_tolerance
+        self.relative_tolerance = relative_tolerance
+
+    def set_reconciliation_state(self, reconciliation_state):
+        """Only examine the transactions that weren't matched by a previous
+        comparison, or have changed since, see ReconciliationState. Pass an
+        empty ReconciliationState to start tracking matches. After
+        get_missing_transactions, self.reconciliation_state is the state to
+        use for the next comparison."""
+        self.reconciliation_state = reconciliation_state
+
+    def _this_transactions(self):
+        return self._category_transactions(self.this_budget,
+                                           self.this_category_name,
+                                           self.this_filter)
+
+    def _other_transactions(self):
+        return self._category_transactions(self.other_budget,
+                                           self.other_category_name,
+                                           self.other_filter)
+
+    def _category_transactions(self, budget, category_name, transaction_filter):
+        return _category_transactions(budget, category_name,
+                                      transaction_filter, self.start_date,
+                                      self.end_date)
 
     def categories_are_reconciled(self):
-        return abs(self.this_budget.calculate_category_total(self.this_category_name)) == abs(self.other_budget.calculate_category_total(self.other_category_name))
+        this_category_id = self.this_budget.category_id_from_name(self.this_category_name)
+        other_category_id = self.other_budget.category_id_from_name(self.other_category_name)
+        # Compare the exact milliunit totals.
+        this_total = self.this_budget._category_milliunit_totals()[0].get(this_category_id, 0)
+        other_total = self.other_budget._category_milliunit_totals()[0].get(other_category_id, 0)
+
+        return abs(this_total) == abs(other_total)
 
     def get_missing_transactions(self):
         """Gets the transactions missing from each budget.
 
-        To identify which transactions are missing, both transactions lists are
-        sorted by transaction amount. "this" category's in ascending order,
-        "other" category's in descending order. An inflow in this_transactions
-        will be an outflow in other_transactions, so if both categories have
-        the same transactions, this_transactions[n] will correspond to
-        other_transactions[n]. One will be an inflow, i.e. positive amount and
-        the other will be an outflow, i.e. negative amount.
-
-        Matching transactions' amounts will add up to zero, as the inflow will
-        cancel out the outflow. If the amounts for a given
-        (this_transactions[n], other_transactions[n]) pair do not add up to
-        zero, it means that one, or both, of the categories is missing one, or
-        more, transactions.
-
-        There are four main cases when the transactions don't match, based on
-        the signs of this_amount and other_amount:
-            A. this_amount < 0, other_amount > 0
-            B. this_amount < 0, other_amount < 0
-            C. this_amount > 0, other_amount > 0
-            D. this_amount > 0, other_amount < 0
-
-        Cases A and D have a further two cases each:
-            1. abs(this_amount) > abs(other_amount)
-            2. abs(this_amount) < abs(other_amount)
-
-        The third case, abs(this_amount) == abs(other_amount) is impossible, as
-        the opposing signs mean that, if the absolute values are equal, the actual
-        values cancel each other out. E.g. this_amount = -3, other_amount = 3
-            abs(-3) == abs(3)
-        but
-            -3 + 3 == 0
-        so the transactions cancel each other out.
-
-        Cases B and C don't distinguish between the absolute values of their
-        transactions: the missing transaction is always from the same budget.
-        For case B, the missing transaction is always the one from this_budget.
-        For case C, the missing transaction is always the one from
-        other_budget.
-
-        An example of case A follows, which should be enough to construct the
-        rest of cases.
-
-        this_amount = -10
-        other_amount = 8
-        abs(this_amount) > abs(other_amount)
-
-            this_transactions                       other_transactions
-            amount  memo                            amount  memo
-         -> $-10    loan money for nachos        -> $8      loan money for beer
-            $8      borrow money for beer           $-10    loan money for sandwich
-            $10     borrow money for sandwich
-
-        In this case, the two transactions marked with a -> don't cancel each
-        other out. To cancel each other out, other_transactions needs a
-        transaction of amount $10. Because other_transactions is in descending
-        order, if it existed, that transaction would be above the $8
-        transaction, so we know for certain that the missing transaction out of
-        the pair [$-10, $8] is the one from this_budget, i.e. the $-10
-        transaction (which, when added to other_budget would become a $10 to
-        cancel out the amounts).
-
-        We don't know anything about the $8 dollar transaction from
-        other_transactions yet, the algorithm only considers one pair of
-        transactions at a time. In this example, the additional transactions
-        have been included to give context.
-
-        The rest of cases can be derived in a similar fashion.
-
-        Once a divergence in amounts is identified, transactions of the
-        identified amount are compared to the other category's transactions of
-        the inverse amount. If the missing transaction's amount is $-5, i.e. it
-        was an outflow, all outflows of $-5 from that category are compared to
-        all inflows of $5 from the other category to find candidate missing
-        transactions.
+        An inflow in this category is an outflow of the same amount in the
+        other category, and vice versa. If both categories have the same
+        transactions, then for every amount, this category has as many
+        transactions of that amount as the other category has of the inverse
+        amount. E.g.
+            this_transactions = Joe's transactions = $-5, $+2, $+7, $+7
+            other_transactions = Jane's transactions = $+5, $-2, $-7
+
+        Both categories' transactions are grouped by amount in a single pass,
+        keying the other category's groups by the inverse of their amount, so
+        that matching groups have the same key. Only the groups whose sizes
+        differ have missing transactions: the larger group's extra
+        transactions are missing from the other category. In the example,
+        Joe's group for $+7 has two transactions and Jane's group for $-7 has
+        one, so one of Joe's $+7 transactions is missing from Jane's budget.
 
         While just adding the number of missing transactions would suffice to
         bring the two categories into sync, it is much more useful to the user
         if they can know what transactions were missing, e.g. when did the
         transaction take place, and what was it for? Missing transaction
-        candidates are determined by matching the subset of transactions for a
-        given pair of amounts (inflows in one category, outflows in the other)
-        by date. If more than one missing transaction occurred on the same
-        date, the first one is chosen as a candidate, for simplicity. The date
-        of missing transactions is deemed important, while the memo (what it
-        was for) is a nice-have.
-        """
-        this_transactions = []
-        other_transactions = []
+        candidates are determined by matching the two groups of a differing
+        amount by date, see _unmatched_transactions. The date of missing
+        transactions is deemed important, while the memo (what it was for) is
+        a nice-have.
 
-        if self.start_date is not None:
-            this_transactions = self.this_budget.filter_category_transactions_by_date(
-                self.this_category_name,
-                self.start_date
-            )
-            other_transactions = self.other_budget.filter_category_transactions_by_date(
-                self.other_category_name,
-                self.start_date
-            )
-        else:
-            this_transactions = self.this_budget.transactions_by_category_name(
-                self.this_category_name
-            )
-            other_transactions = self.other_budget.transactions_by_category_name(
-                self.other_category_name
-            )
+        Only the months whose digests differ are matched, see
+        divergent_months, unless filters are set.
 
-        this_transactions.sort(key=lambda transaction: transaction["amount"])
-        # other_transactions amounts are the inverse of this_transactions
-        # amounts. Sort in reverse order so the indices of other_transactions
-        # match the inverse transaction of this_transactions.
-        # E.g. this_transactions = Joe's transactions = $-5, $+2, $+7
-        #    other_transactions = Jane's transactions = $+5, $-2, $-7
-        other_transactions.sort(key=lambda transaction: transaction["amount"],
-                                reverse=True)
-
-        this_missing_transactions = []
-        other_missing_transactions = []
-
-        # Sentinel to know when iteration has finished.
-        done = object()
-
-        other_iter = iter(other_transactions)
-        other_transaction = next(other_iter, done)
-        if other_transaction is done:
-            # Other transactions was empty, other_budget is missing all of this
-            # budget's transactions, and this_budget is not missing any.
-            other_missing_transactions = this_transactions
-            return [], other_missing_transactions
-
-        this_iter = iter(this_transactions)
-        this_transaction = next(this_iter, done)
-
-        # Each category's transactions are sorted by amount. Therefore, if the
-        # amounts ever differ it is because the category whose current
-        # transaction's amount is greater than the other is missing transactions
-        # of the smaller amount. The number of transactions missing is the
-        # difference of transactions for that amount between the two
-        # categories.
-        while this_transaction is not done and other_transaction is not done:
-            this_amount = this_transaction["amount"]
-            other_amount = other_transaction["amount"]
-            # When the amounts aren't the inverse of each other they don't
-            # cancel each other out, meaning there is a discrepancy in
-            # transactions.
-            if this_amount != -other_amount:
-                if (this_amount < 0 and other_amount > 0):
-                    if abs(this_amount) > abs(other_amount):
-                        missing_transactions = self._get_this_budget_transactions_missing_from_other_budget(this_amount)
-                        other_missing_transactions.extend(missing_transactions)
-                        for transaction in missing_transactions:
-                            this_transaction = next(this_iter, done)
-
-                    # Don't need to check for abs(this_amount) == abs(other_amount).
-                    # Due to this_amount being negative and other_amount positive, if
-                    # they are equal it means they are the inverse of each other.
-                    else:
-                        missing_transactions = self._get_other_budget_transactions_missing_from_this_budget(other_amount)
-                        this_missing_transactions.extend(missing_transactions)
-                        for transaction in missing_transactions:
-                            other_transaction = next(other_iter, done)
-
-                elif (this_amount < 0 and other_amount < 0):
-                    missing_transactions = self._get_this_budget_transactions_missing_from_other_budget(this_amount)
-                    other_missing_transactions.extend(missing_transactions)
-                    for transaction in missing_transactions:
-                        this_transaction = next(this_iter, done)
-
-                elif (this_amount > 0 and other_amount > 0):
-                    missing_transactions = self._get_other_budget_transactions_missing_from_this_budget(other_amount)
-                    this_missing_transactions.extend(missing_transactions)
-                    for transaction in missing_transactions:
-                        other_transaction = next(other_iter, done)
-
-                elif (this_amount > 0 and other_amount < 0):
-                    if abs(this_amount) > abs(other_amount):
-                        missing_transactions = self._get_other_budget_transactions_missing_from_this_budget(other_amount)
-                        this_missing_transactions.extend(missing_transactions)
-                        for transaction in missing_transactions:
-                            other_transaction = next(other_iter, done)
-                    else:
-                        missing_transactions = self._get_this_budget_transactions_missing_from_other_budget(this_amount)
-                        other_missing_transactions.extend(missing_transactions)
-                        for transaction in missing_transactions:
-                            this_transaction = next(this_iter, done)
-
-
-            # Amounts cancel each other out, representing a matching inflow
-            # and outflow. Check the next pair.
-            else:
-                this_transaction = next(this_iter, done)
-                other_transaction = next(other_iter, done)
-
-        # If this_transactions hasn't reached the end, the remaining transactions
-        # are missing from other_transactions.
-        while this_transaction is not done:
-            other_missing_transactions.append(this_transaction)
-            this_transaction = next(this_iter, done)
-        # If other_transactions hasn't reached the end, the remaining transactions
-        # are missing from this_transactions.
-        while other_transaction is not done:
-            this_missing_transactions.append(other_transaction)
-            other_transaction = next(other_iter, done)
-
-        return this_missing_transactions, other_missing_transactions
-
-    def _get_missing_transactions_of_amount(self, this_amount):
-        """Gets the missing pair transactions for a given amount. A pair
-        transaction is a one that cancels out the transaction for the given
-        amount. E.g. if the amount is 5 (an inflow), its pair transaction in
-        the other budget is of amount -5, i.e. an outflow. this_amount gives
-        the cardinality of the transactions to look for, i.e. are we checking
-        for outflows from this_budget compared to inflows for other_budget, or
-        vice versa?
-
-        For each budget's transactions, compiles a list of pair transactions
-        for the given amount argument. One of the lists is a superset of the
-        other list and this method returns the relative complement, i.e. of the
-        list with more transactions, those that are missing from the list that
-        has less transactions."""
-
-        if self.start_date is not None:
-            this_transactions = self.this_budget.filter_category_transactions_by_date(
-                self.this_category_name,
-                self.start_date
-            )
-            other_transactions = self.other_budget.filter_category_transactions_by_date(
-                self.other_category_name,
-                self.start_date
-            )
-        else:
-            this_transactions = self.this_budget.transactions_by_category_name(
-                self.this_category_name
-            )
-            other_transactions = self.other_budget.transactions_by_category_name(
-                self.other_category_name
-            )
+        If a reconciliation state is set, see set_reconciliation_state, the
+        pairs it matched that haven't changed since are left out, and the
+        state is updated with this comparison's matches.
 
-        this_transactions = [txn for txn in this_transactions
-                             if txn["amount"] == this_amount]
-        this_transactions.sort(key=lambda txn: txn["date"])
-
-        other_transactions = [txn for txn in other_transactions
-                              if txn["amount"] == -this_amount]
-        other_transactions.sort(key=lambda txn: txn["date"])
-
-        missing_transactions = []
-
-        # The superset can be either this budget's category's transactions or
-        # other budget's category's transactions, we only know at runtime.
-        if len(this_transactions) > len(other_transactions):
-            superset_transactions = this_transactions
-            subset_transactions = other_transactions
-        elif len(this_transactions) < len(other_transactions):
-            superset_transactions = other_transactions
-            subset_transactions = this_transactions
-        elif len(this_transactions) == len(other_transactions):
-            raise YnabBudgetComparerValueError("There are no missing transactions. Both budget categories contain the same number of transactions ({}) for this_amount = {} and other_amount = {}".format(len(this_transactions), this_amount, -this_amount))
-
-        missing_transactions_target_count = len(superset_transactions) - len(subset_transactions)
-
-        # Sentinel to know when iteration has ended.
-        done = object()
-
-        superset_transactions_iter = iter(superset_transactions)
-        # Superset is guaranteed to have at least one item. From the previous
-        # comparisons to determine if this_transactions or other_transactions
-        # is the superset, the only case where it could be empty is if both
-        # this_transactions and other_transactions were empty, but then a
-        # ValueError is raised and execution is stopped.
-        superset_transaction = next(superset_transactions_iter)
-
-        subset_transactions_iter = iter(subset_transactions)
-        subset_transaction = next(subset_transactions_iter, done)
-        if subset_transaction is done:
-            # The subset is empty and is missing all of superset's transactions.
-            return superset_transactions
-
-        while (superset_transaction is not done
-               and subset_transaction is not done
-               and len(missing_transactions) < missing_transactions_target_count):
-            # Subset is missing the current superset transaction. Add it and
-            # check the next superset_transaction.
-            if superset_transaction["date"] != subset_transaction["date"]:
-                missing_transactions.append(superset_transaction)
-                superset_transaction = next(superset_transactions_iter, done)
-            # Transactions match up, check the next pair. This is a naïve
-            # approach. If there are multiple transactions on the same date,
-            # the order between superset and subset might not be the same.
-            # Further, if one of the missing transactions is on the day where
-            # there are multiple transactions, due to ordering, we might choose
-            # the wrong transaction as candidate. While the amount will be
-            # correct, the memo will be for another transaction and may confuse
-            # the user.
-            # TODO fuzzy compare memos for similar content?
-            else:
-                superset_transaction = next(superset_transactions_iter, done)
-                subset_transaction = next(subset_transactions_iter, done)
-
-        # Skip current superset_transaction if the last iteration was a missing
-        # transaction and it was already added.
-        if (superset_transaction is not done) and (
-            len(missing_transactions) > 0
-            and
-            superset_transaction is missing_transactions[-1]
-        ):
-            superset_transaction = next(superset_transactions, done)
-
-        # Only add enough superset_transactions to pad missing_transactions
-        # to the right amount. Dates between super and subset mismatch, so
-        # the missing transactions returned aren't the best quality, but serve
-        # to reconcile the budgets.
-        # TODO raise an error so the caller can decide how to resolve the issue.
-        while (superset_transaction is not done
-               and len(missing_transactions) < missing_transactions_target_count):
-            missing_transactions.append(superset_transaction)
-            superset_transaction = next(superset_transactions_iter, done)
+        If a tolerance is set, see set_tolerance, the transactions that nearly
+        match one another are left out, see compare.
 
-        return missing_transactions
+        Returns the list of transactions missing from this category, i.e.
+        other category transactions, and the list of transactions missing from
+        the other category, i.e. this category transactions, both sorted by
+        amount.
+        """
+        comparison = self.compare()
+        return comparison.this_missing, comparison.other_missing
+
+    def compare(self):
+        """Return a Comparison of the categories: this_missing and
+        other_missing are the transactions missing from each category, see
+        get_missing_transactions, and near_matches is the list of
+        (this_transaction, other_transaction) pairs that didn't match exactly
+        but whose amounts are within the tolerance, see set_tolerance.
+
+        Near matches are looked for among the transactions that didn't match
+        exactly, sorted by amount, sliding a window the width of the
+        tolerance over both lists at once, so it takes O(n log n) time.
+
+        The comparison goes through stages, each only run if the previous
+        ones couldn't tell the result:
+            "precheck": the categories' totals, transaction counts and
+                digests over the date range agree, so they are reconciled,
+                see categories_agree.
+            "digests": no month's digests differ, see divergent_months.
+            "matching": transactions are matched by amount and date.
+            "tolerance": the remaining transactions are matched within the
+                tolerance, if one is set.
+        The Comparison's decided_by is the stage that told the result, and
+        timings is an OrderedDict of each stage that ran to the seconds it
+        took. Filters and reconciliation states skip the first two stages.
+        """
+        timings = collections.OrderedDict()
+
+        if self.reconciliation_state is None:
+            decided_by, groups = self._groups_to_match(timings)
+            if decided_by is not None:
+                return Comparison([], [], [], decided_by, timings)
+            stage_start = time.time()
+            this_missing, other_missing = _missing_transactions(*groups)
+        else:
+            stage_start = time.time()
+            this_missing, other_missing = self._missing_transactions_with_state()
+        timings["matching"] = time.time() - stage_start
+        decided_by = "matching"
+
+        near_matches = []
+        if self.absolute_tolerance or self.relative_tolerance:
+            stage_start = time.time()
+            # this_missing are the other category's transactions, and vice
+            # versa.
+            other_missing, this_missing, near_matches = _near_matches(
+                other_missing, this_missing,
+                to_milliunits(self.absolute_tolerance), self.relative_tolerance)
+            timings["tolerance"] = time.time() - stage_start
+            decided_by = "tolerance"
+
+        return Comparison(this_missing, other_missing, near_matches,
+                          decided_by, timings)
+
+    def iter_missing_transactions(self):
+        """Generator version of get_missing_transactions, yielding (side,
+        transaction) tuples, side being THIS_MISSING or OTHER_MISSING, as soon
+        as each amount group is matched, so the missing transactions never
+        have to be held in lists. Transactions come in amount order, both
+        sides mixed.
+
+        With a tolerance or a reconciliation state set, every transaction has
+        to be matched before any is known to be missing, so they are only
+        yielded once the whole comparison is done.
+        """
+        if (self.reconciliation_state is not None or
+                self.absolute_tolerance or self.relative_tolerance):
+            comparison = self.compare()
+            for transaction in comparison.this_missing:
+                yield THIS_MISSING, transaction
+            for transaction in comparison.other_missing:
+                yield OTHER_MISSING, transaction
+            return
+
+        decided_by, groups = self._groups_to_match(collections.OrderedDict())
+        if decided_by is None:
+            for side_transaction in _iter_missing_transactions(*groups):
+                yield side_transaction
+
+    def _groups_to_match(self, timings):
+        """Run the precheck and digests stages of compare, recording their
+        timings. Return the stage that decided the comparison and None, or
+        None and both categories' transactions to match, grouped by amount.
+        """
+        if self.this_filter is not None or self.other_filter is not None:
+            return None, (_group_by_amount(self._this_transactions()),
+                          _group_by_amount(self._other_transactions(), sign=-1))
+
+        stage_start = time.time()
+        categories_agree = self.categories_agree()
+        timings["precheck"] = time.time() - stage_start
+        if categories_agree:
+            return "precheck", None
+
+        stage_start = time.time()
+        # Only match the transactions of the months whose digests differ, see
+        # divergent_months.
+        months = self._divergent_months(include_partial_months=True)
+        timings["digests"] = time.time() - stage_start
+        if not months:
+            return "digests", None
+
+        this_transactions = self._months_transactions(
+            self.this_budget, self.this_category_name, months)
+        other_transactions = self._months_transactions(
+            self.other_budget, self.other_category_name, months)
+        return None, (_group_by_amount(this_transactions),
+                      _group_by_amount(other_transactions, sign=-1))
+
+    def categories_agree(self):
+        """Return whether both categories' totals, numbers of transactions
+        and amount multiset hashes (see YnabBudget.category_digests) agree
+        over the comparison's date range, the other category's amounts
+        inverted. If they do, the categories almost certainly have the same
+        transactions, which is told from per month figures without looking at
+        any transaction. Returns None if the date range starts or ends
+        mid-month, as per month figures can't tell then. Filters are not taken
+        into account.
+        """
+        for date in (self.start_date, self.end_date):
+            if date is not None and len(date) > len("yyyy-mm"):
+                return None
+
+        this_category_id = self.this_budget.category_id_from_name(self.this_category_name)
+        other_category_id = self.other_budget.category_id_from_name(self.other_category_name)
+        this_figures = self._range_figures(
+            self.this_budget.category_digests(self.this_category_name).by_month,
+            self.this_budget._category_milliunit_totals()[1].get(this_category_id, {}))
+        other_count, other_hash, other_total = self._range_figures(
+            self.other_budget.category_digests(self.other_category_name, sign=-1).by_month,
+            self.other_budget._category_milliunit_totals()[1].get(other_category_id, {}))
+
+        return this_figures == (other_count, other_hash, -other_total)
+
+    def _range_figures(self, month_digests, month_totals):
+        """Return the number of transactions, the digest's hash and the total
+        of the months in the date range."""
+        count = hash_sum = total = 0
+        for month, (month_count, month_hash) in month_digests.items():
+            if _period_overlaps_range(month, self.start_date, self.end_date):
+                count += month_count
+                hash_sum = (hash_sum + month_hash) & _MASK_64
+                total += month_totals.get(month, 0)
+        return count, hash_sum, total
+
+    def _missing_transactions_with_state(self):
+        this_transactions = self._this_transactions()
+        other_transactions = self._other_transactions()
+
+        unchanged_pairs = self.reconciliation_state.unchanged_pairs(
+            this_transactions, other_transactions)
+        this_matched_ids = set(this_txn["entityId"]
+                               for this_txn, other_txn in unchanged_pairs)
+        other_matched_ids = set(other_txn["entityId"]
+                                for this_txn, other_txn in unchanged_pairs)
+
+        matched_pairs = []
+        missing_transactions = _missing_transactions(
+            _group_by_amount(txn for txn in this_transactions
+                             if txn.get("entityId") not in this_matched_ids),
+            _group_by_amount((txn for txn in other_transactions
+                              if txn.get("entityId") not in other_matched_ids),
+                             sign=-1),
+            matched_pairs)
+
+        self.reconciliation_state = ReconciliationState(
+            [(this_txn["entityId"], other_txn["entityId"])
+             for this_txn, other_txn in unchanged_pairs + matched_pairs
+             if "entityId" in this_txn and "entityId" in other_txn],
+            version_watermark(this_transactions),
+            version_watermark(other_transactions))
 
-    def _get_this_budget_transactions_missing_from_other_budget(self, this_amount):
-        return self._get_missing_transactions_of_amount(this_amount)
+        return missing_transactions
 
-    def _get_other_budget_transactions_missing_from_this_budget(self, other_amount):
-        this_amount = -other_amount
-        return self._get_missing_transactions_of_amount(this_amount)
+    def divergent_months(self):
+        """Return the yyyy-mm months, overlapping the comparison's date range,
+        whose transactions differ between the categories, sorted. The month
+        digests of both categories' transactions are compared, see
+        YnabBudget.category_digests. Year digests aren't enough to skip a
+        year, as a transaction dated in different months of the same year by
+        each side leaves them equal. Digests cover whole months and don't
+        take filters into account.
+        """
+        return self._divergent_months(include_partial_months=False)
+
+    def _divergent_months(self, include_partial_months):
+        """See divergent_months. If include_partial_months is True, months
+        only partly in the date range are always included, as their digests
+        also cover transactions out of the range."""
+        start_date, end_date = self.start_date, self.end_date
+        this_digests = self.this_budget.category_digests(self.this_category_name)
+        other_digests = self.other_budget.category_digests(self.other_category_name,
+                                                           sign=-1)
+
+        months = []
+        for month in sorted(set(this_digests.by_month) | set(other_digests.by_month)):
+            if not _period_overlaps_range(month, start_date, end_date):
+                continue
+            if (this_digests.by_month.get(month) != other_digests.by_month.get(month) or
+                    (include_partial_months and
+                     not _period_within_range(month, start_date, end_date))):
+                months.append(month)
+
+        return months
+
+    def first_divergent_month(self):
+        """Return the first yyyy-mm month in which the categories may have
+        different transactions, or None if they have the same ones. See
+        divergent_months."""
+        months = self.divergent_months()
+        return months[0] if months else None
+
+    def divergence(self):
+        """Return a Divergence telling since when the categories are out of
+        sync, as of the comparison's end date: last_agreement_date is the
+        last date at the end of which both categories' balances, counted from
+        the comparison's start date, agreed. diverged_date is the first date
+        after it, when they stopped agreeing, and gap is the difference
+        between the balances as of the end date, this category's minus the
+        inverse of the other's.
+
+        If the balances agree as of the end date, diverged_date is None. If
+        they haven't agreed since the start date, last_agreement_date is
+        None. Filters are not taken into account.
+
+        The running balances are merged once per start date, after which
+        each query is a binary search on the dates.
+        """
+        dates, differences, last_agreements = self._balance_differences()
+
+        end = len(dates)
+        if self.end_date is not None:
+            end = _date_range_bounds(dates, None, self.end_date)[1]
+        if end == 0:
+            return Divergence(None, None, 0)
+
+        gap = differences[end - 1]
+        if gap == 0:
+            return Divergence(dates[end - 1], None, 0)
+        last_agreement = last_agreements[end - 1]
+        return Divergence(dates[last_agreement] if last_agreement >= 0 else None,
+                          dates[last_agreement + 1],
+                          from_milliunits(gap, self.this_budget.fixed_point))
+
+    def _balance_differences(self):
+        """Return the sorted dates of both categories' transactions from the
+        start date, the difference between their balances at the end of each
+        date, and the index of the last date at or before each date on which
+        the difference was 0, or -1."""
+        cached = self._balance_differences_cache
+        if cached is not None and cached[0] == self.start_date:
+            return cached[1]
+
+        this_dates, this_balances = self._balances_since(
+            self.this_budget.category_balances(self.this_category_name))
+        other_dates, other_balances = self._balances_since(
+            self.other_budget.category_balances(self.other_category_name,
+                                                sign=-1))
+
+        dates = []
+        differences = []
+        last_agreements = []
+        this_balance = other_balance = 0
+        this_index = other_index = 0
+        last_agreement = -1
+        while this_index < len(this_dates) or other_index < len(other_dates):
+            date = min(this_dates[this_index] if this_index < len(this_dates)
+                       else _DATE_RANGE_END,
+                       other_dates[other_index] if other_index < len(other_dates)
+                       else _DATE_RANGE_END)
+            if this_index < len(this_dates) and this_dates[this_index] == date:
+                this_balance = this_balances[this_index]
+                this_index += 1
+            if other_index < len(other_dates) and other_dates[other_index] == date:
+                other_balance = other_balances[other_index]
+                other_index += 1
+            if this_balance == other_balance:
+                last_agreement = len(dates)
+            dates.append(date)
+            differences.append(this_balance - other_balance)
+            last_agreements.append(last_agreement)
+
+        balance_differences = (dates, differences, last_agreements)
+        self._balance_differences_cache = (self.start_date, balance_differences)
+        return balance_differences
+
+    def _balances_since(self, dates_balances):
+        """Return the dates and balances from the start date onwards, with
+        balances counted from the start date."""
+        dates, balances = dates_balances
+        start = _date_range_bounds(dates, self.start_date, None)[0]
+        baseline = balances[start - 1] if start > 0 else 0
+        return dates[start:], [balance - baseline for balance in balances[start:]]
+
+    def _months_transactions(self, budget, category_name, months):
+        """Return the transactions of the yyyy-mm months that are in the
+        comparison's date range, each month's range being narrowed to it."""
+        transactions = []
+        for month in months:
+            start_date, end_date = _narrowed_range(month, self.start_date,
+                                                   self.end_date)
+            transactions.extend(budget.transactions_between(
+                category_name, start_date, end_date))
+        return transactions
 
     def get_this_payees(self):
         return self.this_budget.payee_ids_to_names()
 
     def get_other_payees(self):
         return self.other_budget.payee_ids_to_names()
+
+class MultiBudgetComparer(object):
+    """Compares a debt category shared between more than two people, e.g.
+    the owners of the "YNAB", "YNAB (1)" and "YNAB (2)" Dropbox folders, pair
+    by pair.
+
+    Each budget is parsed once, and each category's transactions are fetched
+    and grouped by amount once, however many pairs the budget is part of.
+    """
+    def __init__(self, parties, budget_sections=COMPARISON_SECTIONS):
+        """parties is a list of (name, budget, category_name) tuples, where
+        name identifies the party in the results and budget is the party's
+        Budget.yfull contents or a parsed YnabBudget. See YnabBudgetComparer
+        for budget_sections."""
+        names = [name for name, budget, category_name in parties]
+        if len(set(names)) != len(names):
+            raise ValueError("Party names must be unique")
+
+        self.names = names
+        self.budgets = {}
+        self.category_names = {}
+        for name, budget, category_name in parties:
+            self.budgets[name] = _budget(budget, budget_sections)
+            self.category_names[name] = category_name
+        self.start_date = None
+        self.end_date = None
+        self.filter = None
+
+    def set_start_date(self, start_date):
+        """See YnabBudgetComparer.set_start_date."""
+        self.start_date = _checked_date(start_date)
+
+    def set_end_date(self, end_date):
+        """See YnabBudgetComparer.set_end_date."""
+        self.end_date = _checked_date(end_date)
+
+    def set_filter(self, transaction_filter):
+        """Only compare the transactions that meet transaction_filter, given
+        from the point of view of the first party of each pair. Its amount
+        criteria are mirrored for the second party, see
+        YnabBudgetComparer.set_filter."""
+        self.filter = transaction_filter
+
+    def pairs(self):
+        """Return the (this_name, other_name) pairs of parties, in the order
+        the parties were given."""
+        return [(this_name, other_name)
+                for i, this_name in enumerate(self.names)
+                for other_name in self.names[i + 1:]]
+
+    def comparer(self, this_name, other_name):
+        """Return a YnabBudgetComparer for a pair of parties, sharing this
+        comparer's parsed budgets, dates and filter."""
+        comparer = YnabBudgetComparer(self.budgets[this_name],
+                                      self.category_names[this_name],
+                                      self.budgets[other_name],
+                                      self.category_names[other_name])
+        comparer.set_start_date(self.start_date)
+        comparer.set_end_date(self.end_date)
+        comparer.set_filter(self.filter)
+        return comparer
+
+    def categories_are_reconciled(self):
+        """Return a dictionary of each pair of parties to whether their
+        categories are reconciled."""
+        return dict((pair, self.comparer(*pair).categories_are_reconciled())
+                    for pair in self.pairs())
+
+    def get_missing_transactions(self):
+        """Return a dictionary of each (this_name, other_name) pair of parties
+        to its (this_missing, other_missing) transactions, see
+        YnabBudgetComparer.get_missing_transactions.
+        """
+        # A party's groups are keyed by their amount when it is the first of
+        # a pair, and by their inverse amount, with the filter mirrored, when
+        # it is the second one. Both are computed at most once per party.
+        other_filter = self.filter.inverted() if self.filter else None
+        groups = {}
+        def party_groups(name, sign):
+            if (name, sign) not in groups:
+                transactions = _category_transactions(
+                    self.budgets[name], self.category_names[name],
+                    self.filter if sign == 1 else other_filter,
+                    self.start_date, self.end_date)
+                groups[(name, sign)] = _group_by_amount(transactions, sign)
+            return groups[(name, sign)]
+
+        return dict(((this_name, other_name),
+                     _missing_transactions(party_groups(this_name, 1),
+                                           party_groups(other_name, -1)))
+                    for this_name, other_name in self.pairs())
+
+    def get_payees(self):
+        """Return a dictionary of each party's name to its budget's payee IDs
+        to names."""
+        return dict((name, budget.payee_ids_to_names())
+                    for name, budget in self.budgets.items())
+
+class BatchBudgetComparer(object):
+    """Compares several pairs of categories between the same two budgets,
+    e.g. rent, utilities and a loan shared with the same person.
+
+    Each budget is parsed once, and the indexes every comparison relies on
+    (category names, transactions by category, category totals) are built
+    in a single pass over each budget's transactions for all categories at
+    once, then shared by the comparisons of every pair.
+    """
+    def __init__(self, this_budget_json, other_budget_json, category_pairs,
+                 budget_sections=COMPARISON_SECTIONS):
+        """category_pairs is a list of (this_category_name,
+        other_category_name) tuples. See YnabBudgetComparer for the rest."""
+        self.this_budget = _budget(this_budget_json, budget_sections)
+        self.other_budget = _budget(other_budget_json, budget_sections)
+        self.category_pairs = [tuple(pair) for pair in category_pairs]
+        self.start_date = None
+        self.end_date = None
+        self.this_filter = None
+        self.other_filter = None
+
+    def set_start_date(self, start_date):
+        """See YnabBudgetComparer.set_start_date."""
+        self.start_date = _checked_date(start_date)
+
+    def set_end_date(self, end_date):
+        """See YnabBudgetComparer.set_end_date."""
+        self.end_date = _checked_date(end_date)
+
+    def set_filter(self, this_filter, other_filter=None):
+        """See YnabBudgetComparer.set_filter. The filters apply to every
+        pair."""
+        self.this_filter = this_filter
+        self.other_filter = other_filter
+
+    def comparer(self, this_category_name, other_category_name):
+        """Return a YnabBudgetComparer for a pair of categories, sharing this
+        comparer's parsed budgets, dates and filters."""
+        comparer = YnabBudgetComparer(self.this_budget, this_category_name,
+                                      self.other_budget, other_category_name)
+        comparer.set_start_date(self.start_date)
+        comparer.set_end_date(self.end_date)
+        comparer.set_filter(self.this_filter, self.other_filter)
+        return comparer
+
+    def compare(self):
+        """Return a dictionary of each (this_category_name,
+        other_category_name) pair to a CategoryPairComparison with the
+        transactions missing from each category, see
+        YnabBudgetComparer.get_missing_transactions, and each category's
+        total, regardless of dates and filters."""
+        this_totals = self.this_budget._category_milliunit_totals()[0]
+        other_totals = self.other_budget._category_milliunit_totals()[0]
+
+        comparisons = {}
+        for this_category_name, other_category_name in self.category_pairs:
+            this_missing, other_missing = self.comparer(
+                this_category_name, other_category_name).get_missing_transactions()
+            this_category_id = self.this_budget.category_id_from_name(this_category_name)
+            other_category_id = self.other_budget.category_id_from_name(other_category_name)
+            comparisons[(this_category_name, other_category_name)] = CategoryPairComparison(
+                this_missing, other_missing,
+                from_milliunits(this_totals.get(this_category_id, 0),
+                                self.this_budget.fixed_point),
+                from_milliunits(other_totals.get(other_category_id, 0),
+                                self.other_budget.fixed_point))
+
+        return comparisons